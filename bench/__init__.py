@@ -0,0 +1,3 @@
+#
+# Benchmarks, run from the repo root, e.g.: `python3 -m bench.yaml_loader`
+#
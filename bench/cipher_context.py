@@ -0,0 +1,45 @@
+#
+# Per-value cipher setup vs a prepared CipherContext, on short secrets
+# Run from the repo root: `python3 -m bench.cipher_context`
+#
+from base64 import b64decode
+from typing import Any, List
+
+from pysecretsettings import CipherContext, decrypt_str, encrypt_str
+from .common import report, timeit
+
+key = b'1234567890123456'
+
+def main() -> None:
+    rows:List[List[Any]] = []
+    for count in (10, 100, 1000, 10000):
+        values = [encrypt_str(f'secret-{i}', key) for i in range(count)]
+
+        def per_value() -> None:
+            for v in values:
+                decrypt_str(v, key)
+
+        def prepared() -> None:
+            ctx = CipherContext(key)
+            for v in values:
+                ctx.decrypt_str(v)
+
+        def batch() -> None:
+            CipherContext(key).decrypt_many([b64decode(v) for v in values])
+
+        t_per_value = timeit(per_value)
+        t_prepared = timeit(prepared)
+        t_batch = timeit(batch)
+        rows.append([
+            count,
+            f'{t_per_value * 1e6 / count:.2f}',
+            f'{t_prepared * 1e6 / count:.2f}',
+            f'{t_batch * 1e6 / count:.2f}',
+            f'{t_per_value / t_batch:.1f}x',
+        ])
+    report(rows, ['values', 'per-value us', 'prepared us', 'batch us', 'speedup'])
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#
+# Helpers shared by the benchmarks
+#
+from typing import Any, Callable, Dict, List, Optional
+import os
+import tempfile
+import time
+
+def make_settings(keys:int, realms:int = 10, encrypted:float = 0.0,
+        key:bytes = b'1234567890123456') -> Dict[str, Dict[str, str]]:
+    '''
+    Generate a dict of `realms` realms with `keys` keys spread evenly.
+    `encrypted` is the share of the `encrypted-` values, encrypted with key.
+    '''
+    from pysecretsettings import CipherContext
+
+    ctx = CipherContext(key) if encrypted else None
+    res:Dict[str, Dict[str, str]] = {}
+    per_realm = max(1, keys // realms)
+    every = round(1 / encrypted) if encrypted else 0
+    for r in range(realms):
+        values = res[f'realm{r}'] = {}
+        for i in range(per_realm):
+            value = f'value-{r}-{i}-lorem-ipsum'
+            if ctx is not None and i % every == 0:
+                values[f'encrypted-key{i}'] = ctx.encrypt_str(value)
+            else:
+                values[f'key{i}'] = value
+    return res
+
+def write_yaml(data:Dict[str, Any], dir:str) -> str:
+    '''
+    Save data into a YAML file in dir, return the file path
+    '''
+    import yaml
+
+    path = os.path.join(dir, 'settings.yaml')
+    with open(path, 'w') as f:
+        yaml.dump(data, f, Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper))
+    return path
+
+def write_ini(data:Dict[str, Dict[str, str]], dir:str) -> str:
+    '''
+    Save data into an INI file in dir, return the file path
+    '''
+    path = os.path.join(dir, 'settings.ini')
+    with open(path, 'w') as f:
+        for realm, values in data.items():
+            f.write(f'[{realm}]\n')
+            for k, v in values.items():
+                f.write(f'{k} = {v}\n')
+            f.write('\n')
+    return path
+
+def temp_dir() -> 'tempfile.TemporaryDirectory[str]':
+    return tempfile.TemporaryDirectory(prefix='pss-bench-')
+
+def timeit(func:Callable[[], Any], repeat:int = 5,
+        setup:Optional[Callable[[], Any]] = None) -> float:
+    '''
+    Return the best of `repeat` runs of func, in seconds.
+    setup, if any, is called before every run and is not timed.
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def report(rows:List[List[Any]], header:List[str]) -> None:
+    '''
+    Print a simple table
+    '''
+    widths = [
+        max(len(str(x)) for x in [h] + [r[i] for r in rows])
+        for i, h in enumerate(header)
+    ]
+    print('  '.join(str(h).rjust(w) for h, w in zip(header, widths)))
+    for r in rows:
+        print('  '.join(str(x).rjust(w) for x, w in zip(r, widths)))
+    return
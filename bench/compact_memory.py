@@ -0,0 +1,55 @@
+#
+# Memory taken by the loaded settings: dict of dicts vs compact_settings()
+# Run from the repo root: `python3 -m bench.compact_memory`
+#
+from typing import Any, Callable, List
+import gc
+import tracemalloc
+
+from pysecretsettings import IniBackend, compact_settings
+from .common import make_settings, report, temp_dir, timeit, write_ini
+
+def allocated(build:Callable[[], Any]) -> int:
+    '''
+    Bytes still allocated by build() after it returns, the result is kept
+    '''
+    tracemalloc.start()
+    res = build()
+    # the parser leaves reference cycles behind
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del res
+    return size
+
+def main() -> None:
+    rows:List[List[Any]] = []
+    with temp_dir() as dir:
+        for keys, realms in ((10000, 10), (100000, 100), (100000, 1000)):
+            path = write_ini(make_settings(keys, realms), dir)
+
+            # fresh copies not sharing the strings with the backend cache
+            def load() -> Any:
+                return IniBackend(path, cache=False).load('')
+
+            plain = allocated(load)
+            packed = allocated(lambda: compact_settings(load()))
+            data = compact_settings(load())
+            realm = data[f'realm{realms // 2}']
+            names = list(realm)
+            lookup = timeit(lambda: [realm[k] for k in names], repeat=3)
+            plain_realm = load()[f'realm{realms // 2}']
+            dict_lookup = timeit(
+                lambda: [plain_realm[k] for k in names], repeat=3)
+            rows.append([
+                keys, realms, f'{plain / 1e6:.1f}', f'{packed / 1e6:.1f}',
+                f'{plain / packed:.1f}x',
+                f'{dict_lookup / len(names) * 1e9:.0f}',
+                f'{lookup / len(names) * 1e9:.0f}'])
+    report(rows, ['keys', 'realms', 'dict MB', 'compact MB', 'saving',
+        'dict lookup ns', 'compact lookup ns'])
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#
+# Import time of the package, from `python -X importtime`, and the modules the
+# import pulls in.  Run from the repo root: `python3 -m bench.import_time`
+#
+from typing import Any, Dict, FrozenSet, List, Set, Tuple
+import subprocess
+import sys
+
+from .common import report
+
+statements = [
+    'import pysecretsettings',
+    'from pysecretsettings import PySecretSettings',
+    'from pysecretsettings import PySecretSettings, decrypt_dict',
+    'from pysecretsettings import YamlBackend',
+]
+
+probe = '''
+import sys
+before = set(sys.modules)
+{}
+print('\\n'.join(sorted(set(sys.modules) - before)))
+'''
+
+def import_time(statement:str) -> Tuple[float, List[str]]:
+    '''
+    Run the statement in a new interpreter.
+    Returns (seconds spent importing, new modules)
+    '''
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', probe.format(statement)],
+        capture_output=True, text=True, check=True)
+    modules = proc.stdout.split()
+    new = set(modules)
+    total = 0
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2]
+        # top level imports only, the nested ones are in the cumulative time
+        if name.startswith(' ') and not name.startswith('  '):
+            if name.strip() in new:
+                total += int(parts[1])
+    return total / 1e6, modules
+
+def third_party(modules:List[str]) -> Set[str]:
+    '''
+    Top level names of the modules which are neither stdlib nor ours
+    '''
+    stdlib:FrozenSet[str] = getattr(sys, 'stdlib_module_names', frozenset())
+    return {
+        m.split('.')[0] for m in modules
+        if m.split('.')[0] not in stdlib
+        and not m.startswith('pysecretsettings')
+    }
+
+def measure(repeat:int = 5) -> Dict[str, float]:
+    '''
+    Best import time of every statement, in seconds
+    '''
+    return {
+        s: min(import_time(s)[0] for _ in range(repeat)) for s in statements
+    }
+
+def main() -> None:
+    rows:List[List[Any]] = []
+    for statement in statements:
+        times = []
+        for _ in range(5):
+            t, modules = import_time(statement)
+            times.append(t)
+        rows.append([
+            statement, f'{min(times) * 1000:.1f}', len(modules),
+            ' '.join(sorted(third_party(modules))) or '-'])
+    report(rows, ['statement', 'ms', 'modules', 'third party'])
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+#
+# Scaling of the parallel bulk decryption with the number of workers
+# Run from the repo root: `python3 -m bench.parallel_decrypt`
+#
+from typing import Any, List
+import os
+
+from pysecretsettings import CipherContext
+from .common import report, timeit
+
+key = b'1234567890123456'
+
+def main() -> None:
+    ctx = CipherContext(key)
+    count = 200000
+    values = ctx.encrypt_many(
+        [f'secret-value-{i}'.encode() * 4 for i in range(count)])
+    serial = timeit(lambda: ctx.decrypt_many(values), repeat=3)
+    rows:List[List[Any]] = [['serial', 1, f'{serial * 1000:.1f}', '1.0x']]
+
+    cores = os.cpu_count() or 1
+    workers = [w for w in (2, 4, 8, 16) if w <= max(cores, 2)]
+    for processes in (False, True):
+        for w in workers:
+            t = timeit(
+                lambda: ctx.decrypt_parallel(values, w, processes), repeat=3)
+            rows.append([
+                'processes' if processes else 'threads', w,
+                f'{t * 1000:.1f}', f'{serial / t:.1f}x'])
+    print(f'{count} values, {cores} cores')
+    report(rows, ['pool', 'workers', 'ms', 'speedup'])
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#
+# Benchmark suite with regression tracking.
+# Generates INI and YAML settings files of varying size, realm count and share
+# of encrypted values, times the backends, the crypto and the package import
+# and saves the results as JSON.  Run from the repo root:
+#
+#   python3 -m bench.suite -o before.json
+#   ... change the code ...
+#   python3 -m bench.suite -o after.json --baseline before.json
+#
+# With --baseline the exit code is 1 if any case got slower than --threshold.
+#
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from pysecretsettings import decrypt_dict, encrypt_str
+from pysecretsettings.main import path2backend
+from .common import make_settings, report, temp_dir, timeit, write_ini, write_yaml
+from .import_time import measure as measure_imports
+
+key = '1234567890123456'
+
+# (keys, realms, encrypted share)
+full_cases = [
+    (keys, realms, encrypted)
+    for keys in (100, 1000, 10000)
+    for realms in (1, 10, 100)
+    for encrypted in (0.0, 0.1, 1.0)
+    if realms <= keys
+]
+quick_cases = [(1000, 10, 0.0), (1000, 10, 0.1), (1000, 10, 1.0)]
+
+writers:Dict[str, Callable[[Dict[str, Any], str], str]] = {
+    'ini': write_ini,
+    'yaml': write_yaml,
+}
+
+def bench_backends(dir:str, cases:List[Tuple[int, int, float]],
+        repeat:int) -> Dict[str, float]:
+    '''
+    Time path2backend() and cold loads of one realm and of all the realms
+    '''
+    res:Dict[str, float] = {}
+    for keys, realms, encrypted in cases:
+        data = make_settings(keys, realms, encrypted, key.encode())
+        realm = f'realm{realms // 2}'
+        for fmt, write in writers.items():
+            case = f'{fmt}-{keys}keys-{realms}realms-{int(encrypted * 100)}enc'
+            case_dir = os.path.join(dir, case)
+            os.mkdir(case_dir)
+            path = write(data, case_dir)
+
+            res[f'path2backend/{case}'] = timeit(
+                lambda: path2backend(path, False), repeat)
+            # every load is cold: new backend, no decrypt cache
+            res[f'load_realm/{case}'] = timeit(
+                lambda: path2backend(path, False).load(realm, key), repeat)
+            res[f'load_all/{case}'] = timeit(
+                lambda: path2backend(path, False).load('', key), repeat)
+    return res
+
+def bench_crypto(repeat:int) -> Dict[str, float]:
+    '''
+    Time decrypt_dict() of a 1000-value dict and encrypt_str()
+    '''
+    res:Dict[str, float] = {}
+    data = make_settings(1000, 1, 1.0, key.encode())['realm0']
+    res['decrypt_dict/1000'] = timeit(
+        lambda: decrypt_dict(data, key.encode(), cache=None), repeat)
+    values = [f'secret-value-{i}' for i in range(1000)]
+    res['encrypt_str/1000'] = timeit(
+        lambda: [encrypt_str(v, key.encode()) for v in values], repeat)
+    return res
+
+def run(quick:bool = False, repeat:int = 5) -> Dict[str, Any]:
+    '''
+    Run the whole suite, return the JSON serializable results
+    '''
+    results:Dict[str, float] = {}
+    with temp_dir() as dir:
+        results.update(
+            bench_backends(dir, quick_cases if quick else full_cases, repeat))
+    results.update(bench_crypto(repeat))
+    results.update({
+        f'import/{statement}': t
+        for statement, t in measure_imports(repeat).items()
+    })
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'quick': quick,
+        'repeat': repeat,
+        # best time in seconds per case
+        'results': results,
+    }
+
+def compare(baseline:Dict[str, Any], current:Dict[str, Any],
+        threshold:float) -> List[str]:
+    '''
+    Print the cases present in both runs, return the names of the regressions
+    '''
+    rows:List[List[Any]] = []
+    regressions:List[str] = []
+    old = baseline['results']
+    for name, t in current['results'].items():
+        if name not in old:
+            continue
+        ratio = t / old[name] if old[name] else float('inf')
+        mark = ''
+        if ratio > threshold:
+            mark = 'SLOWER'
+            regressions.append(name)
+        elif ratio < 1 / threshold:
+            mark = 'faster'
+        rows.append([
+            name, f'{old[name] * 1000:.3f}', f'{t * 1000:.3f}',
+            f'{ratio:.2f}x', mark])
+    report(rows, ['case', 'baseline ms', 'ms', 'ratio', ''])
+    return regressions
+
+def main(argv:Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python3 -m bench.suite',
+        description='Benchmark the backends and crypto, track regressions')
+    parser.add_argument(
+        '-o', '--output', help='save the results into this JSON file')
+    parser.add_argument(
+        '--baseline', help='compare with the results saved earlier')
+    parser.add_argument(
+        '--threshold', type=float, default=1.25,
+        help='slowdown ratio reported as a regression, default 1.25')
+    parser.add_argument(
+        '--repeat', type=int, default=5, help='runs per case, best one counts')
+    parser.add_argument(
+        '--quick', action='store_true', help='only the 1000 keys cases')
+    args = parser.parse_args(argv)
+
+    current = run(args.quick, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+    if not args.baseline:
+        report(
+            [[name, f'{t * 1000:.3f}'] for name, t in current['results'].items()],
+            ['case', 'ms'])
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print(f'{len(regressions)} regressions over {args.threshold}x')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,31 @@
+#
+# Compare YAML loaders on generated settings files of 1k, 10k and 100k keys
+# Run from the repo root: `python3 -m bench.yaml_loader`
+#
+from typing import Any, List
+
+from pysecretsettings import YamlBackend
+from .common import make_settings, report, temp_dir, timeit, write_yaml
+
+def main() -> None:
+    rows:List[List[Any]] = []
+    with temp_dir() as dir:
+        for keys in (1000, 10000, 100000):
+            path = write_yaml(make_settings(keys), dir)
+            times = {}
+            for loader in ('unsafe', 'python', 'auto'):
+                backend = YamlBackend(path, loader=loader, cache=False)
+                times[loader] = timeit(lambda: backend.load(''), repeat=3)
+            rows.append([
+                keys,
+                f"{times['unsafe'] * 1000:.1f}",
+                f"{times['python'] * 1000:.1f}",
+                f"{times['auto'] * 1000:.1f}",
+                f"{times['unsafe'] / times['auto']:.1f}x",
+            ])
+    report(rows, ['keys', 'unsafe ms', 'python ms', 'auto ms', 'speedup'])
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,125 @@
+#
+# The public API.  Only the error types are imported right away, the rest is
+# imported on the first access, see __getattr__, so that `import
+# pysecretsettings` loads no third-party modules.
+#
+from importlib import import_module
+from typing import TYPE_CHECKING, Any, Dict, List
+
 from .error import PySecretSettingsError, PySecretSettingsBackendError
-from .backend import PySecretSettingsBackend, FileBackend, IniBackend, YamlBackend
-from .crypto import encrypt_str, decrypt_str, decrypt_dict
-from .main import PySecretSettings
+
+if TYPE_CHECKING:
+    from .metrics import LoadMetrics, LoadRecord, HistogramMetrics
+    from .backend import PySecretSettingsBackend, FileBackend, IniBackend, YamlBackend
+    from .crypto import (
+        encrypt_str, decrypt_str, decrypt_dict, decrypt_dicts, CipherContext,
+        DecryptCache,
+        LazyDecryptedDict, decrypt_cache, seal_realm, unseal_realm
+    )
+    from .compact import CompactDict, compact_settings
+    from .snapshot import SnapshotBackend, compile_snapshot
+    from .envfile import EnvFileBackend
+    from .vault import VaultBackend
+    from .sidecar import SettingsServer, SocketBackend
+    from .shm import SharedMemoryBackend, publish_settings
+    from .watch import FileWatcher
+    from .layered import LayeredBackend
+    from .rekey import rekey_file, seal_file
+    from .main import PySecretSettings
+    from .aio import AsyncPySecretSettings, AsyncPySecretSettingsBackend
+    from .threadsafe import ConcurrentPySecretSettings
+
+# public name -> module it comes from
+_lazy:Dict[str, str] = {
+    'LoadMetrics': 'metrics',
+    'LoadRecord': 'metrics',
+    'HistogramMetrics': 'metrics',
+    'PySecretSettingsBackend': 'backend',
+    'FileBackend': 'backend',
+    'IniBackend': 'backend',
+    'YamlBackend': 'backend',
+    'encrypt_str': 'crypto',
+    'decrypt_str': 'crypto',
+    'decrypt_dict': 'crypto',
+    'decrypt_dicts': 'crypto',
+    'CipherContext': 'crypto',
+    'DecryptCache': 'crypto',
+    'LazyDecryptedDict': 'crypto',
+    'decrypt_cache': 'crypto',
+    'seal_realm': 'crypto',
+    'unseal_realm': 'crypto',
+    'CompactDict': 'compact',
+    'compact_settings': 'compact',
+    'SnapshotBackend': 'snapshot',
+    'compile_snapshot': 'snapshot',
+    'EnvFileBackend': 'envfile',
+    'VaultBackend': 'vault',
+    'SettingsServer': 'sidecar',
+    'SocketBackend': 'sidecar',
+    'SharedMemoryBackend': 'shm',
+    'publish_settings': 'shm',
+    'FileWatcher': 'watch',
+    'LayeredBackend': 'layered',
+    'rekey_file': 'rekey',
+    'seal_file': 'rekey',
+    'PySecretSettings': 'main',
+    'AsyncPySecretSettings': 'aio',
+    'AsyncPySecretSettingsBackend': 'aio',
+    'ConcurrentPySecretSettings': 'threadsafe',
+}
+
+def __getattr__(name:str) -> Any:
+    '''
+    Import the module of the public name on the first access
+    '''
+    module = _lazy.get(name)
+    if module is None:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+    value = getattr(import_module(f'.{module}', __name__), name)
+    # next time found without calling __getattr__
+    globals()[name] = value
+    return value
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(_lazy))
 
 
 __all__ = [
     'PySecretSettings',
+    'AsyncPySecretSettings',
+    'AsyncPySecretSettingsBackend',
+    'ConcurrentPySecretSettings',
     'PySecretSettingsError',
     'PySecretSettingsBackend',
     'PySecretSettingsBackendError',
     'FileBackend',
     'IniBackend',
     'YamlBackend',
+    'SnapshotBackend',
+    'compile_snapshot',
+    'EnvFileBackend',
+    'VaultBackend',
+    'SettingsServer',
+    'SocketBackend',
+    'CompactDict',
+    'compact_settings',
+    'SharedMemoryBackend',
+    'publish_settings',
+    'FileWatcher',
+    'LayeredBackend',
+    'LoadMetrics',
+    'LoadRecord',
+    'HistogramMetrics',
     'encrypt_str',
     'decrypt_str',
     'decrypt_dict',
+    'decrypt_dicts',
+    'CipherContext',
+    'DecryptCache',
+    'LazyDecryptedDict',
+    'decrypt_cache',
+    'seal_realm',
+    'unseal_realm',
+    'rekey_file',
+    'seal_file',
 ]
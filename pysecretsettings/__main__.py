@@ -0,0 +1,136 @@
+#
+# Command line tools:
+#
+#   python3 -m pysecretsettings rekey settings.yaml
+#   python3 -m pysecretsettings seal settings.yaml -o sealed.yaml
+#   python3 -m pysecretsettings serve settings.yaml
+#
+# Keys are never taken from the command line, it is visible to the other
+# users: they come from a file, an environment variable or are prompted for.
+#
+from getpass import getpass
+from typing import List, Optional
+import argparse
+import os
+import signal
+import sys
+
+from .error import PySecretSettingsError
+from .rekey import rekey_file, seal_file
+
+def read_key(what:str, key_file:Optional[str], env:str,
+        confirm:bool = False) -> str:
+    '''
+    Read the key from key_file, the environment variable env or prompt for it
+    '''
+    if key_file:
+        with open(key_file) as f:
+            return f.readline().rstrip('\r\n')
+    key = os.environ.get(env)
+    if key:
+        return key
+    if not sys.stdin.isatty():
+        raise PySecretSettingsError(
+            f'No {what} key: use a key file or set {env}')
+    key = getpass(f'Enter the {what} key: ')
+    if confirm and getpass(f'Repeat the {what} key: ') != key:
+        raise PySecretSettingsError(f'The {what} keys do not match')
+    return key
+
+def rekey(args:argparse.Namespace) -> int:
+    old_key = read_key('old', args.old_key_file, 'PSS_OLD_KEY')
+    new_key = read_key('new', args.new_key_file, 'PSS_NEW_KEY', confirm=True)
+    count = rekey_file(args.path, old_key, new_key, args.output)
+    print(f'{count} values re-encrypted', file=sys.stderr)
+    return 0
+
+def seal(args:argparse.Namespace) -> int:
+    key = read_key('encryption', args.key_file, 'PSS_KEY')
+    count = seal_file(args.path, key, args.output)
+    print(f'{count} realms sealed', file=sys.stderr)
+    return 0
+
+def serve(args:argparse.Namespace) -> int:
+    from .sidecar import SettingsServer
+
+    key = None if args.no_key else \
+        read_key('decryption', args.key_file, 'PSS_KEY')
+    server = SettingsServer(args.paths, key, args.socket, args.interval)
+    server.bind()
+
+    def stop(signum:int, frame:object) -> None:
+        server.shutdown()
+        return
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f'serving on {server.socket_path}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.close()
+    return 0
+
+def main(argv:Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python3 -m pysecretsettings',
+        description='Manage the settings and secrets files')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cmd = commands.add_parser(
+        'rekey', help='re-encrypt the encrypted- values with a new key',
+        description=(
+            'Re-encrypt the encrypted- values of an INI/YAML file. '
+            'Keys are read from the key files, PSS_OLD_KEY and PSS_NEW_KEY '
+            'environment variables or prompted for.'))
+    cmd.add_argument('path', help='settings file')
+    cmd.add_argument(
+        '-o', '--output', help='write the result here, default is in place')
+    cmd.add_argument('--old-key-file', help='file with the current key')
+    cmd.add_argument('--new-key-file', help='file with the new key')
+    cmd.set_defaults(func=rekey)
+
+    cmd = commands.add_parser(
+        'seal', help='convert to the sealed realms format',
+        description=(
+            'Replace every realm of an INI/YAML file with one '
+            'encrypted blob. The key is read from the key file, PSS_KEY '
+            'environment variable or prompted for.'))
+    cmd.add_argument('path', help='settings file')
+    cmd.add_argument(
+        '-o', '--output', help='write the result here, default is in place')
+    cmd.add_argument('--key-file', help='file with the key')
+    cmd.set_defaults(func=seal)
+
+    cmd = commands.add_parser(
+        'serve', help='serve the decrypted settings over a Unix socket',
+        description=(
+            'Load, decrypt and watch the settings files, serve them '
+            'to SocketBackend clients over a Unix socket readable by the '
+            'owner only. The key is read from the key file, PSS_KEY '
+            'environment variable or prompted for.'))
+    cmd.add_argument('paths', nargs='+', metavar='path', help='settings file')
+    cmd.add_argument(
+        '--socket', help=(
+            'socket path, default is $XDG_RUNTIME_DIR/pysecretsettings.sock '
+            'or one in a private per-user directory in the temp dir'))
+    cmd.add_argument('--key-file', help='file with the key')
+    cmd.add_argument(
+        '--no-key', action='store_true',
+        help='serve the encrypted values as they are')
+    cmd.add_argument(
+        '--interval', type=float, default=1.0,
+        help='file polling interval in seconds, default 1')
+    cmd.set_defaults(func=serve)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.func(args)
+    except (PySecretSettingsError, OSError) as ex:
+        msg = ex.msg if isinstance(ex, PySecretSettingsError) else str(ex)
+        print(f'{parser.prog} {args.command}: {msg}', file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
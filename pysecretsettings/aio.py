@@ -0,0 +1,94 @@
+#
+# Asyncio API: file I/O, parsing and decryption are done in an executor
+#
+from concurrent.futures import Executor
+from typing import Any, Dict, Mapping, Optional, Tuple
+import asyncio
+
+from .backend import PySecretSettingsBackend
+from .compact import compact_settings
+from .error import PySecretSettingsError
+from .main import PySecretSettings
+
+class AsyncPySecretSettingsBackend:
+    '''
+    Asyncio counterpart of PySecretSettingsBackend: runs load() of the wrapped
+    backend in an executor.  Concurrent loads of the same realm with the same
+    key share one in-flight call.
+    '''
+
+    def __init__(self, backend:PySecretSettingsBackend,
+            executor:Optional[Executor] = None):
+        '''
+        backend - the synchronous backend to wrap
+        executor - where to run the backend, None for the loop default one
+        '''
+        self.backend = backend
+        self.executor = executor
+        self._inflight:Dict[Tuple[Any, str, Optional[str]], 'asyncio.Future[Mapping[str, Any]]'] = {}
+        return
+
+    async def load(self, realm:str, key:Optional[str] = None) -> Mapping[str, Any]:
+        '''
+        realm is like a section in an INI file - use '' to get all the secrets
+        in one dict of dicts.
+        key is the decryption key to be used to decrypt the values associated
+        with 'encrypted-' keys
+        '''
+        loop = asyncio.get_running_loop()
+        call = (loop, realm, key)
+        fut = self._inflight.get(call)
+        if fut is None:
+            fut = loop.run_in_executor(
+                self.executor, self.backend.load, realm, key)
+            self._inflight[call] = fut
+
+            def done(f:'asyncio.Future[Mapping[str, Any]]') -> None:
+                if self._inflight.get(call) is f:
+                    del self._inflight[call]
+                return
+
+            fut.add_done_callback(done)
+        # a cancelled caller should not cancel the others
+        return await asyncio.shield(fut)
+
+class AsyncPySecretSettings:
+    '''
+    Asyncio counterpart of PySecretSettings:
+
+        settings = AsyncPySecretSettings('settings.yaml')
+        await settings.load('realm1', key)
+        settings['password']
+    '''
+
+    def __init__(self, arg:Any, executor:Optional[Executor] = None,
+            **args:Any):
+        '''
+        arg can be a backend or a string - in the latter case we will guess the
+        backend, see PySecretSettings
+        executor - where to run the backend, None for the loop default one
+        '''
+        settings = PySecretSettings(arg, **args)
+        self.backend = AsyncPySecretSettingsBackend(settings.backend, executor)
+        self.compact = settings.compact
+        self.secrets:Optional[Mapping[str, Any]] = None
+        return
+
+    async def load(self, realm:str, key:Optional[str] = None) -> Mapping[str, Any]:
+        '''
+        Use backend to load the secrets into self.secrets
+        '''
+        secrets = await self.backend.load(realm, key)
+        self.secrets = compact_settings(secrets) if self.compact else secrets
+        return self.secrets
+
+    def get(self, key:str, default:Any = None) -> Any:
+        if self.secrets is None:
+            raise PySecretSettingsError('secrets not loaded')
+        return self.secrets.get(key, default)
+
+    def __getitem__(self, key:str) -> Any:
+        '''
+        enable use of []
+        '''
+        return self.get(key)
@@ -1,19 +1,47 @@
 #
 # Backends for storage of app parameters and secrets
 #
-from typing import Any, Dict, Optional
+from typing import (
+    Any, Callable, Dict, List, Mapping, NamedTuple, NoReturn, Optional, Sequence,
+    Tuple, Union
+)
 import os.path
 import stat
+import time
 
 from .error import PySecretSettingsBackendError as BackendError
-from .crypto import decrypt_dict
+from .metrics import LoadMetrics, current_record, null_metrics
+from .crypto import (
+    CipherContext, DecryptCache, LazyDecryptedDict, decrypt_dicts
+)
+
+Fingerprint = Tuple[str, int, int, int]
+
+class NotPartial(Exception):
+    '''
+    Raised by FileBackend.parse_realm if the realm can not be loaded without
+    loading the whole document
+    '''
+    pass
 
 class PySecretSettingsBackend:
     '''
     Generic API for the settings and secrets storage
     '''
+    # cache of the decrypted values, off by default, e.g. crypto.decrypt_cache
+    # to share one between the backends
+    decrypt_cache:Optional[DecryptCache] = None
+    # decrypt values on the first access rather than on load
+    lazy_decrypt:bool = False
+    # decrypt large loads in parallel by that many threads or processes
+    decrypt_workers:int = 0
+    decrypt_processes:bool = False
+    # last used (key, cipher context)
+    _cipher:Optional[Tuple[str, CipherContext]] = None
+    # instrumentation of PySecretSettings.load(), see metrics.py
+    metrics:LoadMetrics = null_metrics
 
-    def load(self, realm:str, key:Optional[str] = None) -> Dict[str, str]:
+    def load(self, realm:str, key:Optional[str] = None) -> Mapping[str, Any]:
         '''
         realm is like a section in an INI file - use '' to get all the secrets
         in one dict of dicts.
@@ -23,39 +51,174 @@ class PySecretSettingsBackend:
         raise BackendError('Child must implement')
         return {}
 
+    def load_realms(self, realms:Sequence[str],
+            key:Optional[str] = None) -> Dict[str, Mapping[str, Any]]:
+        '''
+        Load several realms, by default one by one.  Backends override it to
+        read the storage once and decrypt all the realms in one batch.
+        '''
+        return {realm: self.load(realm, key) for realm in realms}
+
+    def fingerprint(self) -> Any:
+        '''
+        Cheap value which changes whenever the loaded data may change, None if
+        the backend can not tell, e.g. a remote store.  Used to decide if the
+        preloaded realms are still valid, see PySecretSettings.preload().
+        '''
+        return None
+
     def decrypt_realms(self, data:Dict[str, Any],
-            key:Optional[str]) -> Dict[str, str]:
+            key:Optional[str]) -> Dict[str, Any]:
         '''
         data is a dictionary of dictionaries
         '''
         if key is None:
-            return data
+            # shallow copies so that callers do not modify cached data
+            return {
+                k: dict(v) if isinstance(v, dict) else v
+                for k,v in data.items()
+            }
 
-        assert isinstance(key, str)
-        key_bytes = key.encode(encoding='UTF-8')
-        #bytes(key, 'utf-8')
+        record = current_record()
+        start = time.perf_counter() if record is not None else 0.0
+        ctx = self.cipher_context(key)
         res:Dict[str, Any] = {}
+        realms = []
         for k,v in data.items():
-            if isinstance(v, dict):
-                res[k] = decrypt_dict(v, key_bytes)
+            if not isinstance(v, dict):
+                res[k] = v
+            elif self.lazy_decrypt:
+                res[k] = LazyDecryptedDict(v, ctx, self.decrypt_cache, k)
             else:
+                # placeholder to preserve the order of realms
                 res[k] = v
+                realms.append(k)
+        # all the realms are decrypted in one batch
+        decrypted = decrypt_dicts(
+            [data[k] for k in realms], ctx, self.decrypt_cache,
+            self.decrypt_workers, self.decrypt_processes, realms)
+        res.update(zip(realms, decrypted))
+        if record is not None:
+            record.decrypt += time.perf_counter() - start
         return res
 
-    def decrypt_realm(self, data:Dict[str, Any],
-            key:Optional[str]) -> Dict[str, Any]:
+    def decrypt_realm(self, data:Dict[str, Any], key:Optional[str],
+            realm:Optional[str] = None) -> Mapping[str, Any]:
         '''
         data is a dict
         key is the decryption key.  If None, do not try to decrypt
+        realm is the name of data, needed to decrypt a `sealed-realm`
+        If lazy_decrypt is set, returns LazyDecryptedDict.
         '''
         if key is None:
-            return data
+            return dict(data) if isinstance(data, dict) else data
+        record = current_record()
+        start = time.perf_counter() if record is not None else 0.0
+        ctx = self.cipher_context(key)
+        res:Mapping[str, Any]
+        if self.lazy_decrypt:
+            res = LazyDecryptedDict(data, ctx, self.decrypt_cache, realm)
+        else:
+            res = decrypt_dicts(
+                [data], ctx, self.decrypt_cache,
+                self.decrypt_workers, self.decrypt_processes, [realm])[0]
+        if record is not None:
+            record.decrypt += time.perf_counter() - start
+        return res
+
+    def cipher_context(self, key:str) -> CipherContext:
+        '''
+        Return the CipherContext for the key, re-using the last one if the key
+        did not change
+        '''
         assert isinstance(key, str)
-        key_bytes = key.encode(encoding='UTF-8')
-        return decrypt_dict(data, key_bytes)
+        cipher = self._cipher
+        if cipher is not None and cipher[0] == key:
+            return cipher[1]
+        ctx = CipherContext(key)
+        self._cipher = (key, ctx)
+        return ctx
 #
 # Backends to store secrets in a local file
 #
+class Located(NamedTuple):
+    '''
+    Result of find_file(): absolute path and its stat
+    '''
+    path:str
+    stat:os.stat_result
+
+
+# (cwd, file name) -> absolute path, see find_file()
+_found:Dict[Tuple[str, str], str] = {}
+
+def stat_file(path:str) -> Optional[Located]:
+    '''
+    Returns Located if path is a regular file, None otherwise
+    '''
+    try:
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return Located(os.path.abspath(path), st)
+
+def find_file(file_name:str) -> Optional[Located]:
+    '''
+    Try to locate file_name:
+    - first in current then
+    - in user home dir.
+    If starts with / or ~ - it is treated as an absolute path.
+    Returns the abs path to file and its stat if succeeds.  None otherwise.
+    Where a short name was found is remembered for the process lifetime and
+    only re-checked with one stat: a file created later in the current dir
+    does not shadow the one found in the home dir, see clear_found().
+    '''
+    if file_name.startswith('~'):
+        # this is a home dir spec
+        return stat_file(os.path.expanduser(file_name))
+
+    elif file_name.startswith('/') or \
+            file_name.startswith('..') or \
+            file_name.startswith('./'):
+        # this is an absolute path
+        return stat_file(file_name)
+
+    memo = (os.getcwd(), file_name)
+    fpath = _found.get(memo)
+    if fpath is not None:
+        located = stat_file(fpath)
+        if located is not None:
+            return located
+        del _found[memo]
+
+    # try to find file_name at the following locations:
+    for loc in ['./',  os.path.expanduser('~/')]:
+        located = stat_file(loc + file_name)
+        if located is not None:
+            _found[memo] = located.path
+            return located
+
+    return None
+
+def clear_found() -> None:
+    '''
+    Forget where the short file names were found
+    '''
+    _found.clear()
+    return
+
+def check_file_permissions(located:Located) -> str:
+    '''
+    Verify the file permissions.
+    Returns errmsg, '' in case of success.
+    '''
+    if stat.S_IMODE(located.stat.st_mode) & (stat.S_IRGRP | stat.S_IROTH):
+        return f"'{located.path}' is readable by group or others"
+
+    return ''
+
 class FileBackend(PySecretSettingsBackend):
     '''
     Use local file to store secrets.
@@ -63,148 +226,430 @@ class FileBackend(PySecretSettingsBackend):
     current, then user's home dir.
     Supports enforcement of file permissions so that only user and not group or
     others can read it.
+    The parsed document is cached and re-parsed only when the file fingerprint
+    (path, mtime, size, inode) changes.
     '''
-    def __init__(self, path:str, check_permissions:bool):
+    def __init__(self, path:Union[str, Located], check_permissions:bool,
+            cache:bool = True):
         '''
         path - short or a fully qualified path to the file.  In former case
-        current dir and user's home is checked.
+        current dir and user's home is checked.  Or the result of find_file().
         check_permissions - check that the file is readable by user only
-        decrypt - request to decrypt values associated with `encrypted-` keys.
-        '''
-
-        def find_file(file_name:str) -> str:
-            '''
-            Try to locate file_name:
-            - first in current then
-            - in user home dir.
-            If starts with / or ~ - it is treated as an absolute path.
-            Returns abs path to file if succeeds.  '' otherwise.
-            '''
-
-            if file_name.startswith('~'):
-                # this is a home dir spec
-                file_name = os.path.expanduser(file_name)
-                if os.path.isfile(file_name):
-                    return os.path.abspath(file_name)
-                return ''
-
-            elif file_name.startswith('/') or \
-                    file_name.startswith('..') or \
-                    file_name.startswith('./'):
-                # this is an absolute path
-                if os.path.isfile(file_name):
-                    return os.path.abspath(file_name)
-                return ''
-
-            # try to find file_name at the following locations:
-            for loc in ['./',  os.path.expanduser('~/')]:
-                fpath = os.path.abspath(loc + file_name)
-                if os.path.isfile(fpath):
-                    return fpath
-
-            return ''
-
-        def check_file_permissions(path:str) -> str:
-            '''
-            Verify self.path permissions.
-            Returns errmsg, '' in case of success.
-            '''
-            mode = os.stat(path).st_mode
-            if stat.S_IMODE(mode) & (stat.S_IRGRP | stat.S_IROTH):
-                return f"'{path}' is readable by group or others"
-
-            return ''
-
-        self.path = find_file(path)
-        if not self.path:
+        cache - keep the parsed document until the file changes
+        '''
+
+        start = time.perf_counter()
+        located = path if isinstance(path, Located) else find_file(path)
+        if located is None:
             raise BackendError(f"Failed to find '{path}'")
+        self.path = located.path
 
         if check_permissions:
-            errmsg = check_file_permissions(self.path)
+            errmsg = check_file_permissions(located)
             if errmsg:
                 raise BackendError(errmsg)
+        # reported with the first load if metrics are enabled
+        self.discover_time = time.perf_counter() - start
+
+        self.cache = cache
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cached:Optional[Tuple[Fingerprint, Any]] = None
+        # realm -> (fingerprint, data) of the realms loaded by parse_realm
+        self._realms:Dict[str, Tuple[Fingerprint, Any]] = {}
         return
 
+    def fingerprint(self) -> Fingerprint:
+        '''
+        Cheap identity of the current file contents: (path, mtime, size, inode)
+        '''
+        st = os.stat(self.path)
+        return (self.path, st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def parse(self, text:str) -> Any:
+        '''
+        Parse the file contents into a raw, not decrypted, document.
+        '''
+        raise BackendError('Child must implement')
+
+    def read(self) -> Any:
+        '''
+        Return the parsed document.  The file is re-read and re-parsed only if
+        its fingerprint changed since the last call.
+        The result is shared - do not modify it.
+        '''
+        if not self.cache:
+            return self.timed(self.parse_file)
+
+        # fingerprint first: if the file changes while we read it, the next
+        # call sees a different fingerprint and re-parses
+        fp = self.fingerprint()
+        cached = self._cached
+        if cached is not None and cached[0] == fp:
+            self.cache_hits += 1
+            return cached[1]
+
+        self.cache_misses += 1
+        data = self.timed(self.parse_file)
+        self._cached = (fp, data)
+        return data
+
+    def parse_file(self) -> Any:
+        '''
+        Read and parse the whole file
+        '''
+        record = current_record()
+        if record is None:
+            with open(self.path) as f:
+                return self.parse(f.read())
+
+        start = time.perf_counter()
+        with open(self.path) as f:
+            text = f.read()
+        record.read += time.perf_counter() - start
+        record.bytes_read += len(text)
+        return self.parse(text)
+
+    def timed(self, parse:Callable[[], Any]) -> Any:
+        '''
+        Call parse(), account the time not spent reading as parse time
+        '''
+        record = current_record()
+        if record is None:
+            return parse()
+        start = time.perf_counter()
+        read = record.read
+        try:
+            return parse()
+        finally:
+            record.parse += time.perf_counter() - start - (record.read - read)
+
+    def parse_realm(self, realm:str) -> Any:
+        '''
+        Read and parse just the realm, not the whole file.
+        Raises NotPartial if this is not possible.
+        '''
+        raise NotPartial()
+
+    def get_realm(self, data:Any, realm:str) -> Any:
+        '''
+        Return the realm of the parsed document or raise BackendError
+        '''
+        if not isinstance(data, dict) or realm not in data:
+            raise BackendError(f"Failed to locate '{realm}' in '{self.path}'")
+        return data[realm]
+
+    def all_realms(self, data:Any) -> Any:
+        '''
+        The parsed document as a dict of realms, as load('') sees it
+        '''
+        return data
+
+    def read_realm(self, realm:str) -> Any:
+        '''
+        Return the raw data of the realm.  Uses the cached document if it is
+        fresh, otherwise parse_realm(), falling back to read().
+        The result is shared - do not modify it.
+        '''
+        fp = self.fingerprint()
+        if self.cache:
+            cached = self._cached
+            if cached is not None and cached[0] == fp:
+                self.cache_hits += 1
+                return self.get_realm(cached[1], realm)
+            realm_cached = self._realms.get(realm)
+            if realm_cached is not None and realm_cached[0] == fp:
+                self.cache_hits += 1
+                return realm_cached[1]
+        try:
+            res = self.timed(lambda: self.parse_realm(realm))
+        except NotPartial:
+            return self.get_realm(self.read(), realm)
+        if self.cache:
+            self.cache_misses += 1
+            self._realms[realm] = (fp, res)
+        return res
+
+    def load_realms(self, realms:Sequence[str],
+            key:Optional[str] = None) -> Dict[str, Mapping[str, Any]]:
+        '''
+        Parse the file once, decrypt all the realms in one batch
+        '''
+        data = self.read()
+        return self.decrypt_realms(
+            {realm: self.get_realm(data, realm) for realm in realms}, key)
+
+    def clear_cache(self) -> None:
+        '''
+        Forget the parsed document and realms, next read() will re-parse the
+        file
+        '''
+        self._cached = None
+        self._realms = {}
+        return
+
+    def watch(self, key:Optional[str] = None, interval:float = 1.0) -> Any:
+        '''
+        Start watching the file for changes, see watch.FileWatcher.
+        Returns the started FileWatcher.
+        '''
+        from .watch import FileWatcher
+
+        return FileWatcher(self, key, interval).start()
+
+
+#
+# Parsers imported on the first use, see import_yaml(), import_configparser()
+#
+yaml:Any = None
+configparser:Any = None
+
+def import_yaml() -> Any:
+    '''
+    Import PyYAML, once
+    '''
+    global yaml
+    if yaml is None:
+        import yaml
+    return yaml
+
+def import_configparser() -> Any:
+    '''
+    Import configparser, once
+    '''
+    global configparser
+    if configparser is None:
+        import configparser
+    return configparser
+
+def yaml_loader(name:str) -> Any:
+    '''
+    Map the loader name to a yaml Loader class:
+    - 'auto' - libyaml based CSafeLoader if available, SafeLoader otherwise
+    - 'c' - CSafeLoader, fail if libyaml is not available
+    - 'python' - pure python SafeLoader
+    - 'unsafe' - pure python full Loader, the original behavior
+    '''
+    yaml = import_yaml()
+    if name == 'auto':
+        return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    elif name == 'c':
+        if not hasattr(yaml, 'CSafeLoader'):
+            raise BackendError('libyaml is not available')
+        return yaml.CSafeLoader
+    elif name == 'python':
+        return yaml.SafeLoader
+    elif name == 'unsafe':
+        return yaml.Loader
+    raise BackendError(f"Unknown YAML loader '{name}'")
+
 class YamlBackend(FileBackend):
     '''
     Backend to store settings in an un-encrypted
     [YAML](https://www.javatpoint.com/yaml) file
     '''
 
-    def __init__(self, path:str, check_permissions:bool = False):
+    def __init__(self, path:Union[str, Located], check_permissions:bool = False,
+            cache:bool = True, loader:str = 'auto', partial:bool = False):
         '''
         path - short or a fully qualified path to the file.  In former case
         current dir and user's home is checked.
         check_permissions - check that the file is readable by user only
+        cache - keep the parsed document until the file changes
+        loader - one of 'auto', 'c', 'python', 'unsafe', see yaml_loader()
+        partial - when loading a single realm, parse only that realm
         '''
-        super().__init__(path, check_permissions)
+        self.loader = yaml_loader(loader)
+        self.partial = partial
+        super().__init__(path, check_permissions, cache)
         return
 
-    def load(self, realm:str, key:Optional[str] = None) -> Dict[str, str]:
+    def parse_realm(self, realm:str) -> Any:
         '''
-        Load secrets dictionary from YAML file.
-        realm is like a section in an INI file, use '' to get all the secrets
-        in one dict.
+        Parse just the realm, see yamlpartial.load_realm()
         '''
-        import yaml
+        from .yamlpartial import NoRealm, load_realm
 
-        with open(self.path) as settings:
-            data = yaml.load(settings, Loader=yaml.Loader)
+        try:
+            with open(self.path) as f:
+                return load_realm(f, realm, self.loader)
+        except NoRealm:
+            raise BackendError(f"YAML data have no realm '{realm}'")
 
-        if isinstance(data, dict):
-            if not realm:
-                return self.decrypt_realms(data, key)
-            elif realm not in data:
-                raise BackendError(f"YAML data have no realm '{realm}'")
-            data = data[realm]
-            return self.decrypt_realm(data, key)
+    def get_realm(self, data:Any, realm:str) -> Any:
+        '''
+        Return the realm of the parsed document or raise BackendError
+        '''
+        if not isinstance(data, dict):
+            self.raise_not_dict(data)
+        elif realm not in data:
+            raise BackendError(f"YAML data have no realm '{realm}'")
+        return data[realm]
 
-        elif isinstance(data, list):
+    @staticmethod
+    def raise_not_dict(data:Any) -> NoReturn:
+        '''
+        Complain about the YAML document which is not a dict
+        '''
+        if isinstance(data, list):
             raise BackendError(
                 "YAML secrets should be a dictionary, not a list")
         raise BackendError(
             f"YAML secrets should be a dictionary, not {type(data)}")
 
+    def parse(self, text:str) -> Any:
+        '''
+        Parse YAML text
+        '''
+        return import_yaml().load(text, Loader=self.loader)
+
+    def load(self, realm:str, key:Optional[str] = None) -> Mapping[str, Any]:
+        '''
+        Load secrets dictionary from YAML file.
+        realm is like a section in an INI file, use '' to get all the secrets
+        in one dict.
+        '''
+        if realm and self.partial:
+            return self.decrypt_realm(self.read_realm(realm), key, realm)
+
+        data = self.read()
+        if not realm:
+            if not isinstance(data, dict):
+                self.raise_not_dict(data)
+            return self.decrypt_realms(data, key)
+        return self.decrypt_realm(self.get_realm(data, realm), key, realm)
+
+class IniDocument:
+    '''
+    Parsed INI file.  A section is interpolated on the first access, so that
+    a bad value in one section does not prevent loading the others.
+    '''
+
+    def __init__(self, parser:Any, source:str):
+        self.parser = parser
+        self.source = source
+        # section -> interpolated options
+        self._sections:Dict[str, Dict[str, str]] = {}
+        return
+
+    def sections(self) -> List[str]:
+        return self.parser.sections()
+
+    def section(self, name:str) -> Dict[str, str]:
+        '''
+        Options of the section, with the DEFAULT ones, interpolated.
+        The result is shared - do not modify it.
+        '''
+        res = self._sections.get(name)
+        if res is None:
+            parser = self.parser
+            try:
+                res = {opt: parser.get(name, opt) for opt in parser.options(name)}
+            except import_configparser().Error as ex:
+                raise BackendError(f"Failed to parse '{self.source}': {ex}")
+            self._sections[name] = res
+        return res
+
+    def to_dict(self) -> Dict[str, Dict[str, str]]:
+        return {sec: self.section(sec) for sec in self.sections()}
+
 class IniBackend(FileBackend):
     '''
     Backend to store settings in an un-encrypted INI file
     '''
 
-    def __init__(self, path:str, check_permissions:bool = False):
+    def __init__(self, path:Union[str, Located], check_permissions:bool = False,
+            cache:bool = True, index:bool = False):
         '''
         path - short or a fully qualified path to the file.  In former case
         current dir and user's home is checked.
         check_permissions - check that the file is readable by user only
+        cache - keep the parsed document until the file changes
+        index - when loading a single realm, use the index of section offsets
+        to parse only that section, see iniindex.build_index()
         '''
         if path is None:
             path = 'secrets.ini'
-        super().__init__(path, check_permissions)
+        super().__init__(path, check_permissions, cache)
+        self.index = index
+        # (fingerprint, section index) or None
+        self._index:Optional[Tuple[Fingerprint, Any]] = None
         return
 
-    def load(self, realm:str, key:Optional[str] = None) -> Dict[str, str]:
+    def parse_realm(self, realm:str) -> Any:
         '''
-        Load secrets dictionary from INI file.
-        realm is like a section in an INI file, use '' to get all the secrets
-        in one dict.
+        Parse just the section and the DEFAULT section, located via a memory
+        mapped index of section offsets.  The index is re-built when the file
+        changes.
         '''
-        from configparser import ConfigParser
+        import locale
+        import mmap
+        from .iniindex import build_index
 
-        parser = ConfigParser()
+        DEFAULTSECT = import_configparser().DEFAULTSECT
+
+        if not self.index or realm == DEFAULTSECT:
+            raise NotPartial()
+
+        encoding = locale.getpreferredencoding(False)
+        with open(self.path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if not st.st_size:
+                raise NotPartial()
+            fp = (self.path, st.st_mtime_ns, st.st_size, st.st_ino)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                cached = self._index
+                if cached is not None and cached[0] == fp:
+                    index = cached[1]
+                else:
+                    index = build_index(mm, encoding)
+                    self._index = (fp, index)
+                if index is None:
+                    raise NotPartial()
+                if realm not in index:
+                    raise BackendError(
+                        f"Failed to locate '{realm}' in '{self.path}'")
+                text = b''.join(
+                    mm[index[sec][0]:index[sec][1]]
+                    for sec in (DEFAULTSECT, realm) if sec in index
+                ).decode(encoding)
+        return self.get_realm(self.parse(text), realm)
+
+    def parse(self, text:str) -> IniDocument:
+        '''
+        Parse INI text, the values are interpolated per section on access
+        '''
+        parser = import_configparser().ConfigParser()
         try:
-            parser.read(self.path)
+            parser.read_string(text, source=self.path)
         except Exception as ex:
             raise BackendError(f"Failed to parse '{self.path}': {ex}")
+        return IniDocument(parser, self.path)
 
-        res:Dict[str, Any] = {}
+    def get_realm(self, data:IniDocument, realm:str) -> Dict[str, str]:
+        '''
+        Return the interpolated section or raise BackendError
+        '''
+        if not data.parser.has_section(realm):
+            raise BackendError(f"Failed to locate '{realm}' in '{self.path}'")
+        return data.section(realm)
+
+    def all_realms(self, data:IniDocument) -> Dict[str, Dict[str, str]]:
+        '''
+        All the sections, interpolated
+        '''
+        return data.to_dict()
+
+    def load(self, realm:str, key:Optional[str] = None) -> Mapping[str, Any]:
+        '''
+        Load secrets dictionary from INI file.
+        realm is like a section in an INI file, use '' to get all the secrets
+        in one dict.
+        '''
+        if realm and self.index:
+            return self.decrypt_realm(self.read_realm(realm), key, realm)
+
+        data = self.read()
         if not realm:
-            for sec in parser.sections():
-                res[sec] = {
-                    opt: parser.get(sec, opt) for opt in parser.options(sec)
-                }
-            return self.decrypt_realms(res, key)
-        elif realm in parser.sections():
-            res = {
-                opt: parser.get(realm, opt) for opt in parser.options(realm)
-            }
-            return self.decrypt_realm(res, key)
-        raise BackendError(f"Failed to locate '{realm}' in '{self.path}'")
+            return self.decrypt_realms(self.all_realms(data), key)
+        return self.decrypt_realm(self.get_realm(data, realm), key, realm)
@@ -0,0 +1,205 @@
+#
+# Compact, read-only in-memory representation of the loaded settings
+#
+# A dict of str keeps a hash table entry, a key object and a value object per
+# setting.  CompactDict keeps per setting a key id, an offset and an order index,
+# 12 bytes:
+#   - keys are interned once per store and shared by all the realms,
+#   - values are encoded back to back in one bytes buffer of the store,
+#   - nested dicts, e.g. realms, are CompactDicts over the same store.
+# Values are decoded on every access.  Values which are neither str nor could
+# be marshalled are kept as they are.
+#
+from array import array
+from bisect import bisect_left
+from typing import (
+    Any, Dict, ItemsView, Iterator, List, Mapping, Tuple, ValuesView
+)
+import marshal
+import struct
+import sys
+
+# value encoding: tag byte, payload
+tag_str = ord('s')
+tag_marshal = ord('m')
+# payload is an index in CompactStore.objects
+tag_object = ord('o')
+object_index = struct.Struct('>I')
+
+class CompactStore:
+    '''
+    Keys, value buffer and nested dicts shared by the CompactDicts built
+    together
+    '''
+    __slots__ = ('keys', 'key_ids', 'buf', 'objects')
+
+    def __init__(self) -> None:
+        self.keys:List[str] = []
+        self.key_ids:Dict[str, int] = {}
+        self.buf:Any = bytearray()
+        # nested CompactDicts and the values which could not be marshalled
+        self.objects:List[Any] = []
+        return
+
+    def key_id(self, key:str) -> int:
+        kid = self.key_ids.get(key)
+        if kid is None:
+            key = sys.intern(key)
+            kid = self.key_ids[key] = len(self.keys)
+            self.keys.append(key)
+        return kid
+
+    def add(self, data:Mapping[str, Any]) -> 'CompactDict':
+        '''
+        Encode the dict, nested dicts first, return its CompactDict
+        '''
+        values:List[bytes] = []
+        for v in data.values():
+            if isinstance(v, str):
+                try:
+                    values.append(bytes((tag_str,)) + v.encode())
+                    continue
+                except UnicodeEncodeError:
+                    # lone surrogates, marshal them
+                    pass
+            elif isinstance(v, Mapping) and all(isinstance(k, str) for k in v):
+                # a realm
+                v = self.add(v)
+            if not isinstance(v, CompactDict):
+                try:
+                    values.append(bytes((tag_marshal,)) + marshal.dumps(v))
+                    continue
+                except ValueError:
+                    pass
+            self.objects.append(v)
+            values.append(
+                bytes((tag_object,)) + object_index.pack(len(self.objects) - 1))
+        kids = [self.key_id(k) for k in data]
+        # sorted by key id for the lookups, order keeps the insertion order
+        positions = sorted(range(len(kids)), key=kids.__getitem__)
+        ids = array('I', [kids[i] for i in positions])
+        order = array('I', bytes(4 * len(kids)))
+        offsets = array('I', [len(self.buf)])
+        for n, i in enumerate(positions):
+            order[i] = n
+            self.buf += values[i]
+            offsets.append(len(self.buf))
+        return CompactDict(self, ids, offsets, order)
+
+    def freeze(self) -> None:
+        '''
+        Done adding: drop the spare capacity of the buffer and the key list
+        '''
+        self.buf = bytes(self.buf)
+        self.keys = tuple(self.keys)  # type: ignore
+        return
+
+class CompactDict(Mapping[str, Any]):
+    '''
+    Read-only mapping over a CompactStore.  Keys are in the insertion order.
+    '''
+    __slots__ = ('_store', '_ids', '_offsets', '_order')
+
+    def __init__(self, store:CompactStore, ids:'array[int]',
+            offsets:'array[int]', order:'array[int]'):
+        self._store = store
+        # key ids, sorted
+        self._ids = ids
+        # value i is buf[offsets[i]:offsets[i + 1]]
+        self._offsets = offsets
+        # indexes in ids in the insertion order
+        self._order = order
+        return
+
+    def _value(self, i:int) -> Any:
+        buf = self._store.buf
+        offsets = self._offsets
+        start = offsets[i]
+        tag = buf[start]
+        if tag == tag_str:
+            return buf[start + 1:offsets[i + 1]].decode()
+        if tag == tag_object:
+            return self._store.objects[object_index.unpack_from(buf, start + 1)[0]]
+        return marshal.loads(buf[start + 1:offsets[i + 1]])
+
+    def _index(self, k:object) -> int:
+        '''
+        Index of the key in ids, -1 if absent
+        '''
+        kid = self._store.key_ids.get(k)  # type: ignore
+        if kid is None:
+            return -1
+        ids = self._ids
+        i = bisect_left(ids, kid)
+        return i if i < len(ids) and ids[i] == kid else -1
+
+    def __getitem__(self, k:str) -> Any:
+        # _index() inlined, this is the hot path
+        kid = self._store.key_ids.get(k)
+        if kid is not None:
+            ids = self._ids
+            i = bisect_left(ids, kid)
+            if i < len(ids) and ids[i] == kid:
+                return self._value(i)
+        raise KeyError(k)
+
+    def __contains__(self, k:object) -> bool:
+        return self._index(k) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        keys = self._store.keys
+        ids = self._ids
+        return (keys[ids[i]] for i in self._order)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def items(self) -> ItemsView[str, Any]:
+        return CompactItemsView(self)
+
+    def values(self) -> ValuesView[Any]:
+        return CompactValuesView(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        '''
+        Plain dict copy, nested CompactDicts converted too
+        '''
+        return {
+            k: v.to_dict() if isinstance(v, CompactDict) else v
+            for k, v in self.items()
+        }
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.to_dict()})'
+
+class CompactItemsView(ItemsView[str, Any]):
+    '''
+    Iterate without looking up every key
+    '''
+    _mapping:CompactDict
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        d = self._mapping
+        keys = d._store.keys
+        ids = d._ids
+        return ((keys[ids[i]], d._value(i)) for i in d._order)
+
+class CompactValuesView(ValuesView[Any]):
+    _mapping:CompactDict
+
+    def __iter__(self) -> Iterator[Any]:
+        d = self._mapping
+        return (d._value(i) for i in d._order)
+
+def compact_settings(data:Any) -> Any:
+    '''
+    Build a CompactDict of data, a realm or a dict of realms.
+    Returns data as is unless it is a Mapping with str keys.
+    '''
+    if not isinstance(data, Mapping) or \
+            not all(isinstance(k, str) for k in data):
+        return data
+    store = CompactStore()
+    res = store.add(data)
+    store.freeze()
+    return res
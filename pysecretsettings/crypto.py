@@ -1,16 +1,46 @@
 from base64 import b64decode, b64encode
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import pad, unpad
-from typing import Dict
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Lock
+import json
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
 
 from .error import PySecretSettingsError
 
+#
+# pycryptodome is imported on the first use of a cipher, see import_aes(),
+# so that importing the package stays cheap for the plaintext-only users
+#
+AES:Any = None
+pad:Any = None
+unpad:Any = None
+strxor:Any = None
+get_random_bytes:Any = None
+
+def import_aes() -> None:
+    '''
+    Import pycryptodome, once
+    '''
+    global AES, pad, unpad, strxor, get_random_bytes
+    if AES is not None:
+        return
+    from Crypto.Cipher import AES as aes
+    from Crypto.Random import get_random_bytes
+    from Crypto.Util.Padding import pad, unpad
+    from Crypto.Util.strxor import strxor
+    # last: the other threads do not look further once AES is set
+    AES = aes
+    return
+
+
+block_size = 16
+
 #
 # This is convenient BUT must be reducing security of the entire solution(?)
 # Looks like this is an assumption used in
 # https://www.devglan.com/online-tools/aes-encryption-decryption
 #
-iv = bytearray([0] * AES.block_size)
+iv = bytearray([0] * block_size)
 
 def encrypt_str(input:str, key:bytes) -> str:
     '''
@@ -26,8 +56,9 @@ def encrypt_bytes(input:bytes, key:bytes) -> bytes:
     Encrypt the input bytes using the key.
     Returns encrypted bytes.
     '''
+    import_aes()
     cipher = AES.new(key, AES.MODE_CBC, iv=iv)
-    return cipher.encrypt(pad(input, AES.block_size))
+    return cipher.encrypt(pad(input, block_size))
 
 
 def decrypt_str(input:str, key:bytes) -> str:
@@ -46,38 +77,487 @@ def decrypt_bytes(input:bytes, key:bytes) -> bytes:
     Given a b64 encoded string - decrypt it using the given key.
     Returns a string
     '''
+    import_aes()
     cipher = AES.new(key, AES.MODE_CBC, iv=iv)
     text = cipher.decrypt(input)
-    text = unpad(text, AES.block_size)
+    text = unpad(text, block_size)
     return text
 
 
-def decrypt_dict(input:Dict[str, str], key:bytes) -> Dict[str, str]:
+def check_key(key:bytes) -> None:
+    '''
+    Raise PySecretSettingsError unless the key is good for AES
+    '''
+    if len(key) not in [16, 24, 32]:
+        raise PySecretSettingsError(f"Bad decryption key length {len(key)} - should be 16 or 24 or 32")
+    return
+
+class CipherContext:
+    '''
+    AES key validated and expanded once, to be used for many values.
+    Same scheme as encrypt_bytes/decrypt_bytes: CBC with the zero iv.
+    Batch methods run one AES call over all the values: CBC is implemented on
+    top of a single ECB cipher object.
+    '''
+    def __init__(self, key:Union[bytes, str]):
+        '''
+        key - 16, 24 or 32 bytes, a str is UTF-8 encoded
+        '''
+        if isinstance(key, str):
+            key = key.encode(encoding='UTF-8')
+        check_key(key)
+        import_aes()
+        self.key = bytes(key)
+        self._ecb = AES.new(self.key, AES.MODE_ECB)
+        self._gcm_key:Optional[bytes] = None
+        return
+
+    def decrypt_many(self, inputs:Sequence[bytes]) -> List[bytes]:
+        '''
+        Decrypt every ciphertext in inputs.
+        Returns a list of plaintexts, in the same order.
+        '''
+        if not inputs:
+            return []
+        bs = block_size
+        for ct in inputs:
+            if not ct or len(ct) % bs:
+                raise ValueError(
+                    'Data must be padded to 16 byte boundary in CBC mode')
+        # CBC decryption: P[i] = D(C[i]) ^ C[i-1], with C[-1] = iv
+        chained = b''.join(iv + ct[:-bs] for ct in inputs)
+        text = strxor(self._ecb.decrypt(b''.join(inputs)), chained)
+        res:List[bytes] = []
+        pos = 0
+        for ct in inputs:
+            end = pos + len(ct)
+            res.append(unpad(text[pos:end], bs))
+            pos = end
+        return res
+
+    def encrypt_many(self, inputs:Sequence[bytes]) -> List[bytes]:
+        '''
+        Encrypt every plaintext in inputs.
+        Returns a list of ciphertexts, in the same order.
+        '''
+        bs = block_size
+        padded = [pad(p, bs) for p in inputs]
+        out = [bytearray() for _ in padded]
+        prev = [bytes(iv)] * len(padded)
+        # CBC encryption is sequential within a value but not across values:
+        # encrypt block j of all the values in one call
+        active = list(range(len(padded)))
+        j = 0
+        while active:
+            blocks = b''.join(padded[i][j:j + bs] for i in active)
+            chained = b''.join(prev[i] for i in active)
+            enc = self._ecb.encrypt(strxor(blocks, chained))
+            for n, i in enumerate(active):
+                ct = enc[n * bs:(n + 1) * bs]
+                out[i] += ct
+                prev[i] = ct
+            j += bs
+            active = [i for i in active if len(padded[i]) > j]
+        return [bytes(ct) for ct in out]
+
+    def decrypt_parallel(self, inputs:Sequence[bytes], workers:int,
+            processes:bool = False) -> List[bytes]:
+        '''
+        Same as decrypt_many() but the inputs are split in chunks decrypted by
+        a pool of workers: threads, pycryptodome releases the GIL in AES, or
+        processes.  The key is passed to the worker processes.
+        '''
+        from concurrent.futures import (
+            Executor, ProcessPoolExecutor, ThreadPoolExecutor
+        )
+
+        size = -(-len(inputs) // workers)
+        chunks = [inputs[i:i + size] for i in range(0, len(inputs), size)]
+        if len(chunks) <= 1:
+            return self.decrypt_many(inputs)
+        pool:Executor = ProcessPoolExecutor(len(chunks)) if processes \
+            else ThreadPoolExecutor(len(chunks))
+        with pool:
+            parts = pool.map(decrypt_chunk, [self.key] * len(chunks), chunks)
+            return [text for part in parts for text in part]
+
+    def decrypt_str(self, input:str) -> str:
+        '''
+        Given a b64 encoded string - decrypt it.
+        Returns a string
+        '''
+        return self.decrypt_many([b64decode(input)])[0].decode()
+
+    def gcm_key(self) -> bytes:
+        '''
+        Key of the sealed realms, derived from the key so that the same key is
+        not used with two cipher modes
+        '''
+        key = self._gcm_key
+        if key is None:
+            key = self._gcm_key = blake2b(
+                b'pysecretsettings sealed-realm', key=self.key,
+                digest_size=len(self.key)).digest()
+        return key
+
+    def seal(self, plaintext:bytes, realm:str) -> bytes:
+        '''
+        Authenticated encryption with AES-GCM and a random nonce, bound to the
+        realm name, which is authenticated as the associated data.
+        Returns version | nonce | tag | ciphertext
+        '''
+        nonce = get_random_bytes(seal_nonce_size)
+        cipher = AES.new(self.gcm_key(), AES.MODE_GCM, nonce=nonce)
+        cipher.update(realm.encode('utf-8'))
+        ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+        return seal_version + nonce + tag + ciphertext
+
+    def unseal(self, blob:bytes, realm:str) -> bytes:
+        '''
+        Reverse of seal().  Raises ValueError if the blob was not sealed with
+        this key for this realm or was modified.
+        '''
+        header = len(seal_version) + seal_nonce_size + seal_tag_size
+        if len(blob) < header or not blob.startswith(seal_version):
+            raise ValueError('Bad sealed realm version')
+        nonce = blob[len(seal_version):len(seal_version) + seal_nonce_size]
+        tag = blob[header - seal_tag_size:header]
+        cipher = AES.new(self.gcm_key(), AES.MODE_GCM, nonce=nonce)
+        cipher.update(realm.encode('utf-8'))
+        return cipher.decrypt_and_verify(blob[header:], tag)
+
+    def encrypt_str(self, input:str) -> str:
+        '''
+        Encrypt the input string.
+        Returns a base64 presentation of the result.
+        '''
+        out = self.encrypt_many([input.encode('utf-8')])[0]
+        return b64encode(out).decode('utf-8')
+
+def decrypt_chunk(key:bytes, inputs:Sequence[bytes]) -> List[bytes]:
+    '''
+    decrypt_many() using a CipherContext of its own - a pool worker
+    '''
+    return CipherContext(key).decrypt_many(inputs)
+
+
+#
+# Min number of values worth decrypting in parallel
+#
+parallel_threshold = 4096
+
+class DecryptCache:
+    '''
+    Bounded LRU cache of decrypted values keyed on a digest of
+    (key, ciphertext), so that re-loading unchanged secrets does not run AES.
+    Plaintexts are kept in bytearrays which are zeroed on eviction and clear().
+    Thread safe.
+    '''
+    def __init__(self, maxsize:int = 1024):
+        '''
+        maxsize - max number of the cached values, 0 disables the cache
+        '''
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data:OrderedDict[bytes, bytearray] = OrderedDict()
+        self._lock = Lock()
+        return
+
+    @staticmethod
+    def digest(ciphertext:str, key:bytes) -> bytes:
+        '''
+        Keyed digest of the ciphertext - neither the key nor the ciphertext
+        can be recovered from it
+        '''
+        return blake2b(
+            ciphertext.encode('utf-8'), key=key, digest_size=16).digest()
+
+    def get(self, digest:bytes) -> Optional[str]:
+        '''
+        Return the cached plaintext or None
+        '''
+        with self._lock:
+            value = self._data.get(digest)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(digest)
+            self.hits += 1
+            return value.decode('utf-8')
+
+    def put(self, digest:bytes, plaintext:str) -> None:
+        '''
+        Cache the plaintext, evict the least recently used if full
+        '''
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            old = self._data.pop(digest, None)
+            if old is not None:
+                zeroize(old)
+            self._data[digest] = bytearray(plaintext, 'utf-8')
+            self._trim()
+        return
+
+    def resize(self, maxsize:int) -> None:
+        '''
+        Change the max number of the cached values
+        '''
+        with self._lock:
+            self.maxsize = maxsize
+            self._trim()
+        return
+
+    def clear(self) -> None:
+        '''
+        Zero and forget all the cached plaintexts, reset the stats
+        '''
+        with self._lock:
+            for value in self._data.values():
+                zeroize(value)
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+        return
+
+    def stats(self) -> Dict[str, float]:
+        '''
+        Cache statistics
+        '''
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _trim(self) -> None:
+        while len(self._data) > max(self.maxsize, 0):
+            _, value = self._data.popitem(last=False)
+            zeroize(value)
+        return
+
+def zeroize(buf:bytearray) -> None:
+    '''
+    Overwrite the buffer with zeros
+    '''
+    buf[:] = bytes(len(buf))
+    return
+
+
+#
+# Cache to share between the backends which opt in, see
+# PySecretSettings(decrypt_cache=...)
+#
+decrypt_cache = DecryptCache()
+
+#
+# Sealed realm: the whole realm encrypted as one AES-GCM blob stored as the
+# value of sealed_key, base64 of version | nonce | tag | ciphertext of the
+# realm dict in JSON.  The realm name is the associated data, so a blob moved
+# to another realm fails to decrypt.
+#
+sealed_key = 'sealed-realm'
+seal_version = b'\x02'
+seal_nonce_size = 12
+seal_tag_size = 16
+
+def seal_realm(data:Mapping[str, Any], key:Union[bytes, CipherContext],
+        realm:str) -> str:
+    '''
+    Encrypt the realm data, JSON serializable, as one blob which can only be
+    unsealed as the realm.
+    Store the result as the value of `sealed-realm` in the realm.
+    '''
+    ctx = key if isinstance(key, CipherContext) else CipherContext(key)
+    text = json.dumps(dict(data), separators=(',', ':'))
+    return b64encode(ctx.seal(text.encode('utf-8'), realm)).decode('utf-8')
+
+def unseal_realm(blob:str, key:Union[bytes, CipherContext],
+        realm:Optional[str], cache:Optional[DecryptCache] = None) -> Dict[str, Any]:
+    '''
+    Decrypt the value of `sealed-realm` of the realm into the realm data.
+    cache - if given, the decrypted JSON is looked up and stored there
+    '''
+    if realm is None:
+        raise PySecretSettingsError(f"Realm of '{sealed_key}' is not known")
+    ctx = key if isinstance(key, CipherContext) else CipherContext(key)
+    digest = b''
+    text = None
+    if cache is not None:
+        # the realm is a part of the key, the blob is base64 - no '\0' there
+        digest = cache.digest(f'{realm}\0{blob}', ctx.key)
+        text = cache.get(digest)
+    if text is None:
+        try:
+            text = ctx.unseal(b64decode(blob), realm).decode('utf-8')
+        except (ValueError, UnicodeDecodeError) as ex:
+            raise PySecretSettingsError(f"Failed to decrypt '{sealed_key}': {ex}")
+        if cache is not None:
+            cache.put(digest, text)
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise PySecretSettingsError(f"'{sealed_key}' should be a dictionary")
+    return data
+
+def decrypt_dict(input:Mapping[str, str], key:Union[bytes, CipherContext],
+        cache:Optional[DecryptCache] = None, workers:int = 0,
+        realm:Optional[str] = None) -> Dict[str, str]:
     '''
     For every key in `input`:
       if key starts with `encrypted-XXX` - decrypt its value,
       save it under key `XXX`
+      if key is `sealed-realm` - decrypt the realm sealed by seal_realm(),
+      save its keys
     Encryption: AES
     Cipher mode: CBC
     Key size: 128 bits
     Init vector: none
     Secret key: 1234567890123456 - should be 16, 24 or 32 bytes long
     (respectively for *AES-128*, *AES-192* or *AES-256*).
+    key - raw key or a CipherContext prepared for it
+    cache - if given, decrypted values are looked up and stored there
+    workers - see decrypt_dicts()
+    realm - name of the input, needed to decrypt a `sealed-realm`
     '''
+    return decrypt_dicts([input], key, cache, workers, realms=[realm])[0]
 
-    if len(key) not in [16, 24, 32]:
-        raise PySecretSettingsError(f"Bad decryption key length {len(key)} - should be 16 or 24 or 32")
+def decrypt_dicts(inputs:Sequence[Mapping[str, str]],
+        key:Union[bytes, CipherContext], cache:Optional[DecryptCache] = None,
+        workers:int = 0, processes:bool = False,
+        realms:Optional[Sequence[Optional[str]]] = None) -> List[Dict[str, str]]:
+    '''
+    decrypt_dict() every dict in inputs, with all the values decrypted in one
+    batch.
+    workers - if more than 1 and there are at least parallel_threshold values
+    to decrypt, decrypt them in parallel, see CipherContext.decrypt_parallel()
+    processes - use processes rather than threads
+    realms - names of the inputs, needed to decrypt a `sealed-realm`
+    '''
+    ctx = key if isinstance(key, CipherContext) else CipherContext(key)
 
     key_prefix = 'encrypted-'
-    res:Dict[str, str] = {}
-    for k,v in input.items():
-        if k.startswith(key_prefix):
-            nk = k[len(key_prefix):]
-            if not nk:
-                raise PySecretSettingsError(f"Bad key '{k}' in '{input}'")
-            nv = decrypt_str(v, key)
+    results:List[Dict[str, str]] = []
+    # (result, new key, ciphertext, digest) of the values to be decrypted
+    todo:List[Tuple[Dict[str, str], str, str, bytes]] = []
+    for i, input in enumerate(inputs):
+        res:Dict[str, str] = {}
+        results.append(res)
+        for k,v in input.items():
+            if k == sealed_key:
+                res.update(unseal_realm(
+                    v, ctx, realms[i] if realms is not None else None, cache))
+            elif k.startswith(key_prefix):
+                nk = k[len(key_prefix):]
+                if not nk:
+                    raise PySecretSettingsError(f"Bad key '{k}' in '{input}'")
+                digest = b''
+                if cache is not None:
+                    digest = cache.digest(v, ctx.key)
+                    nv = cache.get(digest)
+                    if nv is not None:
+                        res[nk] = nv
+                        continue
+                # placeholder to preserve the order of keys
+                res[nk] = v
+                todo.append((res, nk, v, digest))
+            else:
+                res[k] = v
+
+    if not todo:
+        return results
+    ciphertexts = [b64decode(v) for _, _, v, _ in todo]
+    if workers > 1 and len(todo) >= parallel_threshold:
+        texts = ctx.decrypt_parallel(ciphertexts, workers, processes)
+    else:
+        texts = ctx.decrypt_many(ciphertexts)
+    for (res, nk, v, digest), text in zip(todo, texts):
+        nv = text.decode()
+        if res[nk] is v:
+            # not overwritten by a later plain key
             res[nk] = nv
-        else:
-            res[k] = v
+        if cache is not None:
+            cache.put(digest, nv)
+    return results
 
-    return res
+class Encrypted:
+    '''
+    Not yet decrypted value held by LazyDecryptedDict
+    '''
+    __slots__ = ('ciphertext',)
+
+    def __init__(self, ciphertext:str):
+        self.ciphertext = ciphertext
+        return
+
+class LazyDecryptedDict(Mapping[str, Any]):
+    '''
+    Read-only mapping with the same keys as decrypt_dict would return,
+    but a value of an `encrypted-XXX` key is decrypted only when `XXX` is
+    accessed for the first time, then memoized.
+    Decryption errors are raised on access.
+    '''
+    def __init__(self, input:Mapping[str, Any],
+            key:Union[bytes, CipherContext],
+            cache:Optional[DecryptCache] = None, realm:Optional[str] = None):
+        '''
+        input - raw realm data
+        key - raw key or a CipherContext prepared for it
+        cache - if given, decrypted values are looked up and stored there
+        realm - name of the input, needed to decrypt a `sealed-realm`
+        '''
+        self._ctx = key if isinstance(key, CipherContext) else CipherContext(key)
+        self._cache = cache
+
+        key_prefix = 'encrypted-'
+        self._data:Dict[str, Any] = {}
+        for k,v in input.items():
+            if k == sealed_key:
+                # one blob, decrypted right away
+                self._data.update(unseal_realm(v, self._ctx, realm, cache))
+            elif k.startswith(key_prefix):
+                nk = k[len(key_prefix):]
+                if not nk:
+                    raise PySecretSettingsError(f"Bad key '{k}' in '{input}'")
+                self._data[nk] = Encrypted(v)
+            else:
+                self._data[k] = v
+        return
+
+    def __getitem__(self, k:str) -> Any:
+        v = self._data[k]
+        if not isinstance(v, Encrypted):
+            return v
+
+        cache = self._cache
+        digest = b''
+        if cache is not None:
+            digest = cache.digest(v.ciphertext, self._ctx.key)
+            nv = cache.get(digest)
+            if nv is not None:
+                self._data[k] = nv
+                return nv
+        try:
+            nv = self._ctx.decrypt_str(v.ciphertext)
+        except (ValueError, UnicodeDecodeError) as ex:
+            raise PySecretSettingsError(f"Failed to decrypt '{k}': {ex}")
+        if cache is not None:
+            cache.put(digest, nv)
+        self._data[k] = nv
+        return nv
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({list(self._data)})'
@@ -0,0 +1,179 @@
+#
+# Backend for dotenv files
+#
+#   # comment
+#   DB_HOST=localhost
+#   export DB_USER=alice
+#   GREETING="hello\nworld"    # escapes are processed in double quotes only
+#   encrypted-DB_PASSWORD=dOcV7/WfKO9RaK0Y6BbeQg==
+#   # [staging]
+#   DB_HOST=staging.example.com
+#
+# The variables before the first `# [realm]` marker belong to the realm named
+# after the file: `production.env` and `.env.production` -> `production`,
+# `.env` -> `env`.  Variables are not expanded, `${X}` is kept as is.
+#
+# The file is memory-mapped and scanned with one regex in one pass, only the
+# names and values are copied out of the mapping.
+#
+from typing import Any, Dict, Mapping, MutableMapping, Optional, Union
+import os
+import re
+import time
+
+from .backend import FileBackend, Located
+from .metrics import current_record
+from .error import PySecretSettingsBackendError as BackendError
+
+# a `# [realm]` marker or a `NAME=value` line
+line_re = re.compile(rb'''
+    ^[ \t]*(?:
+        \#[ \t]*\[(?P<realm>[^\]\r\n]+)\][ \t]*
+    |
+        (?:export[ \t]+)?(?P<name>[A-Za-z_][A-Za-z0-9_.-]*)[ \t]*=[ \t]*
+        (?:
+            "(?P<dq>(?:[^"\\]|\\.)*)"
+        |
+            '(?P<sq>[^']*)'
+        |
+            (?P<value>[^\r\n]*?)
+        )
+        (?:[ \t]+\#[^\r\n]*)?[ \t]*
+    )\r?$''', re.MULTILINE | re.VERBOSE)
+# what may be between the matches: blank lines and comments
+gap_re = re.compile(rb'(?:[ \t]*(?:\#[^\r\n]*)?\r?\n)*[ \t]*(?:\#[^\r\n]*)?')
+# first line of a dotenv file, see main.sniff()
+assignment_re = re.compile(rb'(?:export[ \t]+)?[A-Za-z_][A-Za-z0-9_.-]*[ \t]*=')
+
+escape_re = re.compile(r'\\(.)', re.DOTALL)
+escapes = {'n': '\n', 'r': '\r', 't': '\t'}
+
+def is_env_file(path:str) -> bool:
+    '''
+    `.env` or `.env.XXX`, `XXX.env` is recognized by the extension
+    '''
+    name = os.path.basename(path).lower()
+    return name == '.env' or name.startswith('.env.')
+
+def default_realm(path:str) -> str:
+    '''
+    Realm of the variables before the first `# [realm]` marker
+    '''
+    name = os.path.basename(path)
+    if name == '.env' or name.startswith('.env.'):
+        return name[len('.env.'):] or 'env'
+    return os.path.splitext(name)[0] or 'env'
+
+def unescape(value:str) -> str:
+    return escape_re.sub(lambda m: escapes.get(m.group(1), m.group(1)), value)
+
+def scan(buf:Any, realm:str, source:str) -> Dict[str, Dict[str, str]]:
+    '''
+    Parse the dotenv buffer (bytes or mmap) into a dict of realms.
+    realm - realm of the variables before the first marker
+    source - file name for the error messages
+    '''
+    data:Dict[str, Dict[str, str]] = {realm: {}}
+    current = data[realm]
+    pos = 0
+    try:
+        for m in line_re.finditer(buf):
+            if gap_re.fullmatch(buf, pos, m.start()) is None:
+                break
+            pos = m.end()
+            name, dq, sq, value, marker = m.group('name', 'dq', 'sq', 'value', 'realm')
+            if name is None:
+                current = data.setdefault(marker.strip().decode('utf-8'), {})
+            elif dq is not None:
+                current[name.decode('utf-8')] = unescape(dq.decode('utf-8'))
+            else:
+                current[name.decode('utf-8')] = \
+                    (sq if sq is not None else value).decode('utf-8')
+    except UnicodeDecodeError as ex:
+        raise BackendError(f"Failed to parse '{source}': {ex}")
+
+    if gap_re.fullmatch(buf, pos, len(buf)) is None:
+        # gap_re matches the empty string, so there is always a match
+        gap = gap_re.match(buf, pos)
+        assert gap is not None
+        bad = gap.end()
+        line = bytes(buf[:bad]).count(b'\n') + 1
+        raise BackendError(f"Failed to parse '{source}': bad line {line}")
+    if not data[realm] and len(data) > 1:
+        del data[realm]
+    return data
+
+class EnvFileBackend(FileBackend):
+    '''
+    Backend to store settings in an un-encrypted dotenv file, see the top of
+    envfile.py for the format
+    '''
+
+    def __init__(self, path:Union[str, Located], check_permissions:bool = False,
+            cache:bool = True, realm:Optional[str] = None):
+        '''
+        path - short or a fully qualified path to the file.  In former case
+        current dir and user's home is checked.
+        check_permissions - check that the file is readable by user only
+        cache - keep the parsed document until the file changes
+        realm - realm of the variables before the first `# [realm]` marker,
+        by default named after the file, see default_realm()
+        '''
+        super().__init__(path, check_permissions, cache)
+        self.realm = realm or default_realm(self.path)
+        return
+
+    def parse(self, text:str) -> Dict[str, Dict[str, str]]:
+        '''
+        Parse dotenv text into a dict of realms
+        '''
+        return scan(text.encode('utf-8'), self.realm, self.path)
+
+    def parse_file(self) -> Any:
+        '''
+        Scan the memory-mapped file
+        '''
+        import mmap
+
+        record = current_record()
+        start = time.perf_counter()
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return {self.realm: {}}
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if record is not None:
+                    record.read += time.perf_counter() - start
+                    record.bytes_read += size
+                return scan(mm, self.realm, self.path)
+
+    def load(self, realm:str, key:Optional[str] = None) -> Mapping[str, Any]:
+        '''
+        Load secrets dictionary from the dotenv file.
+        realm is a `# [realm]` marker or the file realm, use '' to get all the
+        secrets in one dict.
+        '''
+        data = self.read()
+        if not realm:
+            return self.decrypt_realms(data, key)
+        return self.decrypt_realm(self.get_realm(data, realm), key, realm)
+
+    def export_environ(self, realm:Optional[str] = None,
+            key:Optional[str] = None, override:bool = True,
+            environ:Optional[MutableMapping[str, str]] = None) -> int:
+        '''
+        Load the realm, by default the file realm, and export its variables
+        into environ, by default os.environ, in one update.  Encrypted values
+        are decrypted in one batch and exported without the `encrypted-`
+        prefix.  Variables which already have the value are not set again.
+        override - replace the variables which are already set
+        Returns the number of the variables set.
+        '''
+        env = os.environ if environ is None else environ
+        values = self.load(realm or self.realm, key)
+        changed = {
+            k: v for k, v in values.items()
+            if (override or k not in env) and env.get(k) != v
+        }
+        env.update(changed)
+        return len(changed)
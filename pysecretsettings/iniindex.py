@@ -0,0 +1,50 @@
+#
+# Index of the section offsets in an INI file
+#
+from typing import Any, Dict, List, Optional, Tuple
+import re
+
+# section header candidates: a line starting with `[`
+header_re = re.compile(rb'^\[', re.M)
+# indented `[` could be a header or a value continuation - do not guess
+indented_re = re.compile(rb'^[ \t]+\[', re.M)
+
+def build_index(buf:Any, encoding:str) -> Optional[Dict[str, Tuple[int, int]]]:
+    '''
+    Scan the buffer (bytes or mmap) for the section headers.
+    Returns a dict of section name -> (start, end) byte offsets of the section
+    including its header, or None if the file can not be reliably indexed:
+    no sections, duplicate sections, options before the first section or
+    indented section headers.
+    '''
+    from configparser import ConfigParser
+
+    if indented_re.search(buf):
+        return None
+
+    starts:List[Tuple[str, int]] = []
+    for mo in header_re.finditer(buf):
+        pos = mo.start()
+        eol = buf.find(b'\n', pos)
+        if eol < 0:
+            eol = len(buf)
+        text = bytes(buf[pos:eol]).decode(encoding).strip()
+        header = ConfigParser.SECTCRE.match(text)
+        if header is None:
+            return None
+        starts.append((header.group('header'), pos))
+    if not starts:
+        return None
+
+    for raw in bytes(buf[:starts[0][1]]).splitlines():
+        raw = raw.strip()
+        if raw and not raw.startswith((b'#', b';')):
+            return None
+
+    index:Dict[str, Tuple[int, int]] = {}
+    for i, (name, start) in enumerate(starts):
+        if name in index:
+            return None
+        end = starts[i + 1][1] if i + 1 < len(starts) else len(buf)
+        index[name] = (start, end)
+    return index
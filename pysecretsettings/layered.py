@@ -0,0 +1,195 @@
+#
+# Settings composed of several layers: base file, environment, host overrides
+#
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Set, Tuple
+
+from .backend import FileBackend, Fingerprint, PySecretSettingsBackend
+from .error import PySecretSettingsBackendError as BackendError
+
+key_prefix = 'encrypted-'
+
+def slot(name:str) -> str:
+    '''
+    `encrypted-XXX` and `XXX` are the same setting
+    '''
+    return name[len(key_prefix):] if name.startswith(key_prefix) else name
+
+def slots(realm:Mapping[str, Any]) -> Dict[str, Tuple[str, Any]]:
+    '''
+    Map the settings of the realm to (raw key, value).
+    If both `encrypted-XXX` and `XXX` are present the later one wins, as in
+    decrypt_dict()
+    '''
+    return {slot(k): (k, v) for k, v in realm.items()}
+
+class LayeredBackend(PySecretSettingsBackend):
+    '''
+    Merge of an ordered list of backends, later layers override earlier ones
+    key by key within a realm.  `encrypted-XXX` in one layer overrides `XXX` in
+    another and vice versa, within one layer the later of the two wins.
+    The merged view is precomputed, load() is a single dict lookup.  When a
+    FileBackend layer changes, only the keys it affects are recomputed.
+    '''
+
+    def __init__(self, layers:Sequence[PySecretSettingsBackend]):
+        '''
+        layers - backends, from the base to the most specific one
+        '''
+        if not layers:
+            raise BackendError('No layers given')
+        self.layers = list(layers)
+        self._fps:List[Optional[Fingerprint]] = [
+            self.layer_fingerprint(i) for i in range(len(self.layers))]
+        self._raw:List[Dict[str, Any]] = [
+            self.read_layer(i) for i in range(len(self.layers))]
+        # realm -> merged raw data
+        self._merged:Dict[str, Any] = {}
+        # realm -> slot -> (raw key, layer index)
+        self._sources:Dict[str, Dict[str, Tuple[str, int]]] = {}
+        for realm in set().union(*self._raw):
+            self.merge_realm(realm)
+        return
+
+    def layer_fingerprint(self, i:int) -> Optional[Fingerprint]:
+        layer = self.layers[i]
+        return layer.fingerprint() if isinstance(layer, FileBackend) else None
+
+    def fingerprint(self) -> Tuple[Optional[Fingerprint], ...]:
+        '''
+        Fingerprints of the FileBackend layers, the only ones re-read, see
+        refresh()
+        '''
+        return tuple(self.layer_fingerprint(i) for i in range(len(self.layers)))
+
+    def read_layer(self, i:int) -> Dict[str, Any]:
+        '''
+        Raw, not decrypted, data of the layer
+        '''
+        layer = self.layers[i]
+        data = layer.all_realms(layer.read()) \
+            if isinstance(layer, FileBackend) else layer.load('')
+        if not isinstance(data, dict):
+            raise BackendError(f'Layer {i} data should be a dictionary')
+        return data
+
+    def merge_realm(self, realm:str) -> None:
+        '''
+        Recompute the whole realm
+        '''
+        self._merged.pop(realm, None)
+        self._sources.pop(realm, None)
+        top = [i for i, raw in enumerate(self._raw) if realm in raw]
+        if not top:
+            return
+        if not isinstance(self._raw[top[-1]][realm], dict):
+            # the most specific layer replaces the realm with a value
+            self._merged[realm] = self._raw[top[-1]][realm]
+            return
+        merged:Dict[str, Any] = {}
+        sources:Dict[str, Tuple[str, int]] = {}
+        for i in top:
+            data = self._raw[i][realm]
+            if not isinstance(data, dict):
+                merged = {}
+                sources = {}
+                continue
+            for s, (k, v) in slots(data).items():
+                old = sources.get(s)
+                if old is not None:
+                    del merged[old[0]]
+                merged[k] = v
+                sources[s] = (k, i)
+        self._merged[realm] = merged
+        self._sources[realm] = sources
+        return
+
+    def merge_slots(self, realm:str, names:Set[str]) -> None:
+        '''
+        Recompute just these slots of the realm
+        '''
+        merged = self._merged[realm]
+        sources = self._sources[realm]
+        # layer index -> slots() of its realm, computed when first needed
+        layer_slots:Dict[int, Dict[str, Tuple[str, Any]]] = {}
+        for s in names:
+            old = sources.pop(s, None)
+            if old is not None:
+                del merged[old[0]]
+            for i in range(len(self._raw) - 1, -1, -1):
+                data = self._raw[i].get(realm)
+                if data is None:
+                    continue
+                if not isinstance(data, dict):
+                    # replaced by a value in this layer, lower ones are hidden
+                    break
+                if i not in layer_slots:
+                    layer_slots[i] = slots(data)
+                kv = layer_slots[i].get(s)
+                if kv is not None:
+                    merged[kv[0]] = kv[1]
+                    sources[s] = (kv[0], i)
+                    break
+        return
+
+    def refresh(self) -> bool:
+        '''
+        Re-read the FileBackend layers which changed, re-merge the keys they
+        affect.  Returns True if anything changed.
+        '''
+        changed = False
+        for i in range(len(self.layers)):
+            fp = self.layer_fingerprint(i)
+            if fp is None or fp == self._fps[i]:
+                continue
+            old = self._raw[i]
+            new = self.read_layer(i)
+            self._raw[i] = new
+            self._fps[i] = fp
+            changed = True
+            self.update_layer(old, new)
+        return changed
+
+    def update_layer(self, old:Dict[str, Any], new:Dict[str, Any]) -> None:
+        '''
+        Re-merge what differs between the old and the new data of a layer
+        '''
+        for realm in set(old) | set(new):
+            o = old.get(realm)
+            n = new.get(realm)
+            if o == n:
+                continue
+            if not isinstance(o, dict) or not isinstance(n, dict) or \
+                    not isinstance(self._merged.get(realm), dict):
+                self.merge_realm(realm)
+                continue
+            os_ = slots(o)
+            ns = slots(n)
+            names = {s for s in set(os_) | set(ns) if os_.get(s) != ns.get(s)}
+            self.merge_slots(realm, names)
+        return
+
+    def source(self, realm:str, name:str) -> PySecretSettingsBackend:
+        '''
+        Return the layer the setting comes from.  name could be either
+        `XXX` or `encrypted-XXX`
+        '''
+        try:
+            return self.layers[self._sources[realm][slot(name)][1]]
+        except KeyError:
+            raise BackendError(f"Failed to locate '{name}' in '{realm}'")
+
+    def load(self, realm:str, key:Optional[str] = None) -> Mapping[str, Any]:
+        '''
+        realm is like a section in an INI file - use '' to get all the secrets
+        in one dict of dicts.
+        key is the decryption key to be used to decrypt the values associated
+        with 'encrypted-' keys
+        '''
+        self.refresh()
+        if not realm:
+            return self.decrypt_realms(self._merged, key)
+        try:
+            data = self._merged[realm]
+        except KeyError:
+            raise BackendError(f"Failed to locate '{realm}' in any layer")
+        return self.decrypt_realm(data, key, realm)
@@ -1,38 +1,99 @@
 import os.path
-from typing import Any, Dict, Optional
+import re
+import threading
+from typing import Any, Callable, Dict, Mapping, Optional, Sequence, Tuple, Type
 
-from .backend import PySecretSettingsBackend, IniBackend, YamlBackend
+from .backend import (
+    PySecretSettingsBackend, FileBackend, Fingerprint, IniBackend, YamlBackend,
+    find_file
+)
+from .compact import compact_settings
+from .envfile import EnvFileBackend, assignment_re, is_env_file
+from .metrics import measure
+from .snapshot import SnapshotBackend, magic as snapshot_magic
 from .error import PySecretSettingsError, PySecretSettingsBackendError as BackendError
 
+# file extension -> backend
+extensions:Dict[str, Type[FileBackend]] = {
+    '.yaml': YamlBackend,
+    '.yml': YamlBackend,
+    '.ini': IniBackend,
+    '.pss': SnapshotBackend,
+    '.env': EnvFileBackend,
+}
+
+# path -> (fingerprint, backend detected by sniff())
+_sniffed:Dict[str, Tuple[Fingerprint, Type[FileBackend]]] = {}
+
+ini_section = re.compile(rb'\[[^\[\]]+\]\s*$')
+
+def sniff(path:str) -> Type[FileBackend]:
+    '''
+    Guess the backend from the first bytes of the file: snapshot magic,
+    an INI `[section]` header, a dotenv `NAME=value` or else YAML
+    '''
+    with open(path, 'rb') as f:
+        head = f.read(4096)
+    if head.startswith(snapshot_magic):
+        return SnapshotBackend
+    for line in head.splitlines():
+        line = line.strip()
+        if not line or line.startswith(b'#'):
+            continue
+        if line.startswith(b';') or ini_section.match(line):
+            return IniBackend
+        if assignment_re.match(line):
+            return EnvFileBackend
+        break
+    return YamlBackend
+
 def path2backend(path:str, check_permissions:bool) -> PySecretSettingsBackend:
-    _, ext = os.path.splitext(path)
-    ext = ext.lower()
-    if ext in ('.yaml', '.yml'):
-        return YamlBackend(path, check_permissions)
-    elif ext in ('.ini'):
-        return IniBackend(path, check_permissions)
-    try:
-        # start guessing...is it YAML?
-        return YamlBackend(path, check_permissions)
-    except BackendError:
-        pass
-    try:
-        # keep guessing...is it INI?
-        return IniBackend(path, check_permissions)
-    except BackendError:
-        pass
-    # I give up
-    raise BackendError(f"Failed to identify backend from '{path}'")
+    '''
+    Locate the file, pick the backend by the file extension or by the contents.
+    The file is located once and the detected format of every file is
+    remembered while the file does not change.
+    '''
+    located = find_file(path)
+    if located is None:
+        raise BackendError(f"Failed to find '{path}'")
+    _, ext = os.path.splitext(located.path)
+    cls = extensions.get(ext.lower())
+    if cls is None and is_env_file(located.path):
+        # .env, .env.production
+        cls = EnvFileBackend
+    if cls is None:
+        st = located.stat
+        fp = (located.path, st.st_mtime_ns, st.st_size, st.st_ino)
+        sniffed = _sniffed.get(located.path)
+        if sniffed is not None and sniffed[0] == fp:
+            cls = sniffed[1]
+        else:
+            try:
+                cls = sniff(located.path)
+            except OSError as err:
+                raise BackendError(
+                    f"Failed to identify backend from '{path}': {err}")
+            _sniffed[located.path] = (fp, cls)
+    return cls(located, check_permissions)
 
 class PySecretSettings:
     '''
     Generic API to retrieve secrets, with or without encryption.
     '''
 
-    def __init__(self, arg:Any, **args:Dict[str,Any]):
+    def __init__(self, arg:Any, **args:Any):
         '''
         arg can be a backend or a string - in the latter case we will guess the
         backend
+        args:
+          check_permissions - check that the file is readable by user only
+          lazy_decrypt - decrypt values on the first access rather than on load
+          decrypt_workers - decrypt large loads by that many threads
+          metrics - LoadMetrics to collect the load timings
+          compact - keep the loaded secrets in a CompactDict, saves memory
+          decrypt_cache - DecryptCache to keep the decrypted values in, so
+            that re-loading unchanged secrets does not decrypt them again.
+            None, the default, keeps no plaintexts around.
         '''
 
         self.backend:PySecretSettingsBackend
@@ -44,18 +105,125 @@ class PySecretSettings:
         else:
             raise BackendError(
                 f"Failed to identify backend from '{arg}'")
-        self.secrets:Optional[Dict[str, str]] = None
+        if 'lazy_decrypt' in args:
+            self.backend.lazy_decrypt = bool(args['lazy_decrypt'])
+        if 'decrypt_workers' in args:
+            self.backend.decrypt_workers = int(args['decrypt_workers'])  # type: ignore
+        if 'decrypt_cache' in args:
+            self.backend.decrypt_cache = args['decrypt_cache']
+        if 'metrics' in args:
+            self.backend.metrics = args['metrics']  # type: ignore
+        self.compact = bool(args.get('compact', False))
+        if self.compact and self.backend.lazy_decrypt:
+            raise PySecretSettingsError(
+                'compact and lazy_decrypt are mutually exclusive')
+        self.secrets:Optional[Mapping[str, Any]] = None
+        # (backend fingerprint, key, realm -> secrets) set by preload()
+        self._preloaded:Optional[Tuple[Any, Optional[str], Dict[str, Any]]] = None
+        self._preload_thread:Optional[threading.Thread] = None
+        # the exception raised by the last background preload()
+        self.preload_error:Optional[Exception] = None
         return
 
-    def load(self, realm:str, key:Optional[str] = None) -> Dict[str, str]:
+    def preload(self, realms:Sequence[str], key:Optional[str] = None,
+            background:bool = False) -> None:
+        '''
+        Load and decrypt the realms ahead of time, in one pass over the file,
+        see PySecretSettingsBackend.load_realms().  load() of these realms with
+        the same key is then served from memory while the backend fingerprint()
+        does not change.  Backends without a fingerprint, e.g. VaultBackend,
+        are only warmed up: load() still goes to them and to their own cache.
+        background - preload in a daemon thread, load() waits for it to finish.
+        Errors are then kept in preload_error and load() falls back to the
+        backend.
+        '''
+        self.wait_preload()
+        if not background:
+            self._preload(list(realms), key)
+            return
+        self.preload_error = None
+        self._preload_thread = threading.Thread(
+            target=self._preload_background, args=(list(realms), key),
+            name='PySecretSettings preload', daemon=True)
+        self._preload_thread.start()
+        return
+
+    def _preload(self, realms:Sequence[str], key:Optional[str]) -> None:
+        backend = self.backend
+        fp = backend.fingerprint()
+        # one record for all the realms, counted like load('')
+        loaded = self.measured('', backend.load_realms, realms, key)
+        if fp is None:
+            # no way to tell when the data changes
+            self._preloaded = None
+            return
+        if self.compact:
+            loaded = {realm: compact_settings(data) for realm, data in loaded.items()}
+        self._preloaded = (fp, key, loaded)
+        return
+
+    def _preload_background(self, realms:Sequence[str],
+            key:Optional[str]) -> None:
+        try:
+            self._preload(realms, key)
+        except Exception as ex:
+            self.preload_error = ex
+        return
+
+    def wait_preload(self) -> None:
+        '''
+        Wait for the background preload(), if any, to finish
+        '''
+        thread = self._preload_thread
+        if thread is not None:
+            thread.join()
+            self._preload_thread = None
+        return
+
+    def preloaded(self, realm:str, key:Optional[str]) -> Optional[Mapping[str, Any]]:
+        '''
+        The preloaded realm if it is still valid, None otherwise
+        '''
+        if self._preload_thread is not None:
+            self.wait_preload()
+        preloaded = self._preloaded
+        if preloaded is None:
+            return None
+        fp, preload_key, loaded = preloaded
+        data = loaded.get(realm)
+        if data is None or preload_key != key:
+            return None
+        if fp != self.backend.fingerprint():
+            # the data changed, load() it again
+            self._preloaded = None
+            return None
+        # a copy, like the backends return, so that callers do not modify it
+        return dict(data) if type(data) is dict else data
+
+    def load(self, realm:str, key:Optional[str] = None) -> Mapping[str, Any]:
         '''
         Use backend to load the secrets into self.secrets
         '''
         if self.backend is None:
             raise PySecretSettingsError('backend not set')
-        self.secrets = self.backend.load(realm, key)
+        secrets = self.preloaded(realm, key)
+        if secrets is None:
+            secrets = self.measured(realm, self.backend.load, realm, key)
+            if self.compact:
+                secrets = compact_settings(secrets)
+        self.secrets = secrets
         return self.secrets
 
+    def measured(self, realm:str, load:Callable[..., Any], *args:Any) -> Any:
+        '''
+        Call the backend load(*args), collecting a LoadRecord if the backend
+        metrics are enabled
+        '''
+        metrics = self.backend.metrics
+        if not metrics.enabled:
+            return load(*args)
+        return measure(metrics, self.backend, realm, load, *args)
+
     def get(self, key:str, default:Any = None) -> Any:
         if self.secrets is None:
             raise PySecretSettingsError('secrets not loaded')
@@ -0,0 +1,185 @@
+#
+# Load-time and decrypt-time instrumentation
+#
+# Every backend has a `metrics` attribute, by default the no-op null_metrics.
+# Set it to an enabled LoadMetrics, e.g. HistogramMetrics, to get a
+# LoadRecord per PySecretSettings.load() and preload():
+#
+#   metrics = HistogramMetrics()
+#   settings = PySecretSettings(backend, metrics=metrics)
+#   ...
+#   json.dumps(metrics.export())
+#
+from bisect import bisect_left
+from threading import Lock, local
+from typing import Any, Dict, List, Mapping, Optional
+import time
+
+class LoadRecord:
+    '''
+    Timings, in seconds, and counters of one load()
+    '''
+    __slots__ = (
+        'backend', 'realm', 'discover', 'read', 'parse', 'decrypt', 'total',
+        'values', 'bytes_read')
+
+    def __init__(self, backend:str, realm:str):
+        self.backend = backend
+        self.realm = realm
+        # file discovery, reported with the first load of a backend
+        self.discover = 0.0
+        self.read = 0.0
+        self.parse = 0.0
+        self.decrypt = 0.0
+        self.total = 0.0
+        self.values = 0
+        self.bytes_read = 0
+        return
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class LoadMetrics:
+    '''
+    Instrumentation interface and the default no-op implementation.
+    Backends skip all the measurements unless enabled is True.
+    '''
+    enabled = False
+
+    def on_load(self, record:LoadRecord) -> None:
+        '''
+        Called after every load() with the measurements
+        '''
+        return
+
+
+null_metrics = LoadMetrics()
+
+_local = local()
+
+def current_record() -> Optional[LoadRecord]:
+    '''
+    Record of the load() in progress in this thread, None if not measured
+    '''
+    return getattr(_local, 'record', None)
+
+def set_current_record(record:Optional[LoadRecord]) -> None:
+    _local.record = record
+    return
+
+def count_values(data:Any, realm:str) -> int:
+    '''
+    Number of settings in the load() result
+    '''
+    if not isinstance(data, Mapping):
+        return 1
+    if realm:
+        return len(data)
+    return sum(len(v) if isinstance(v, Mapping) else 1 for v in data.values())
+
+def measure(metrics:LoadMetrics, backend:Any, realm:str, load:Any,
+        *args:Any) -> Any:
+    '''
+    Call load(*args) collecting a LoadRecord
+    '''
+    record = LoadRecord(type(backend).__name__, realm)
+    record.discover = getattr(backend, 'discover_time', 0.0)
+    if record.discover:
+        # reported once
+        backend.discover_time = 0.0
+    set_current_record(record)
+    start = time.perf_counter()
+    try:
+        res = load(*args)
+    finally:
+        record.total = time.perf_counter() - start
+        set_current_record(None)
+    record.values = count_values(res, realm)
+    metrics.on_load(record)
+    return res
+
+class Histogram:
+    '''
+    Log2 buckets from 1us to ~16s
+    '''
+    bounds = [2 ** i * 1e-6 for i in range(25)]
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        return
+
+    def add(self, value:float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        return
+
+    def export(self) -> Dict[str, Any]:
+        buckets:List[List[Any]] = [
+            [bound, n] for bound, n in zip(self.bounds, self.counts) if n]
+        if self.counts[-1]:
+            buckets.append(['inf', self.counts[-1]])
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min if self.count else 0.0,
+            'max': self.max,
+            'buckets': buckets,
+        }
+
+class HistogramMetrics(LoadMetrics):
+    '''
+    In-memory histograms of the load phases, per backend class
+    '''
+    enabled = True
+    phases = ('discover', 'read', 'parse', 'decrypt', 'total')
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.reset()
+        return
+
+    def reset(self) -> None:
+        with self._lock:
+            self.loads = 0
+            self.values = 0
+            self.bytes_read = 0
+            self.histograms:Dict[str, Dict[str, Histogram]] = {}
+        return
+
+    def on_load(self, record:LoadRecord) -> None:
+        with self._lock:
+            self.loads += 1
+            self.values += record.values
+            self.bytes_read += record.bytes_read
+            hists = self.histograms.get(record.backend)
+            if hists is None:
+                hists = self.histograms[record.backend] = {
+                    phase: Histogram() for phase in self.phases}
+            for phase in self.phases:
+                value = getattr(record, phase)
+                if phase == 'discover' and not value:
+                    continue
+                hists[phase].add(value)
+        return
+
+    def export(self) -> Dict[str, Any]:
+        '''
+        JSON serializable snapshot of the collected metrics
+        '''
+        with self._lock:
+            return {
+                'loads': self.loads,
+                'values': self.values,
+                'bytes_read': self.bytes_read,
+                'backends': {
+                    backend: {p: h.export() for p, h in hists.items()}
+                    for backend, hists in self.histograms.items()
+                },
+            }
@@ -0,0 +1,211 @@
+#
+# Re-key a settings file: decrypt the `encrypted-` values and the sealed realms
+# with the old key, encrypt them with the new one.
+# Or convert a settings file to the sealed realms format.
+#
+# The file is rewritten textually, in one pass, so that the comments, order and
+# formatting survive.  All the values go through one batch decrypt and one
+# batch encrypt.  The result is written atomically.
+#
+from base64 import b64decode, b64encode
+from typing import Any, Dict, List, Mapping, Optional, Tuple, Union
+import binascii
+import os
+import re
+import stat
+import tempfile
+
+from .backend import IniBackend, YamlBackend, import_configparser, import_yaml
+from .crypto import CipherContext, decrypt_dict, seal_realm, sealed_key
+from .error import PySecretSettingsError, PySecretSettingsBackendError as BackendError
+
+key_prefix = 'encrypted-'
+
+# `encrypted-XXX: value` or `sealed-realm: value` in YAML, possibly quoted
+yaml_value = re.compile(
+    r'''^\s*(?:-\s+)?(?P<kq>["']?)(?P<key>encrypted-[^\n"':#]*|sealed-realm)(?P=kq)\s*:[ \t]+(?P<vq>["']?)(?P<value>[A-Za-z0-9+/]+={0,2})(?P=vq)[ \t]*(?:#[^\n]*)?$''',
+    re.MULTILINE)
+# `encrypted-XXX = value` or `encrypted-XXX: value` in INI
+ini_value = re.compile(
+    r'''^[ \t]*(?P<key>encrypted-[^\n=:]*?|sealed-realm)[ \t]*[=:][ \t]*(?P<value>[A-Za-z0-9+/]+={0,2})[ \t]*$''',
+    re.MULTILINE | re.IGNORECASE)
+
+def count_encrypted(data:Any) -> int:
+    '''
+    Number of the `encrypted-` string values in the realms and at the top level
+    plus the number of the sealed realms
+    '''
+    if not isinstance(data, dict):
+        return 0
+    res = 0
+    for k, v in data.items():
+        if isinstance(v, dict):
+            res += sum(
+                1 for kk, vv in v.items()
+                if (kk.startswith(key_prefix) or kk == sealed_key)
+                and isinstance(vv, str))
+        elif k.startswith(key_prefix) and isinstance(v, str):
+            res += 1
+    return res
+
+def ini_sections(text:str, source:str) -> Dict[str, Dict[str, str]]:
+    '''
+    Sections of the INI text as they are written: the DEFAULT values once,
+    not merged into every section as by IniBackend.parse()
+    '''
+    # no default section, [DEFAULT] is read as an ordinary section
+    parser = import_configparser().ConfigParser(
+        default_section='\0', interpolation=None)
+    try:
+        parser.read_string(text, source=source)
+    except Exception as ex:
+        raise BackendError(f"Failed to parse '{source}': {ex}")
+    return {s: dict(parser[s]) for s in parser.sections()}
+
+def sealed_realms(data:Any) -> Dict[str, str]:
+    '''
+    `sealed-realm` value -> its realm, the nonce makes every blob unique
+    '''
+    if not isinstance(data, dict):
+        return {}
+    return {
+        v[sealed_key]: realm for realm, v in data.items()
+        if isinstance(v, dict) and isinstance(v.get(sealed_key), str)
+    }
+
+def rekey_text(text:str, pattern:'re.Pattern[str]', old:CipherContext,
+        new:CipherContext,
+        realms:Optional[Mapping[str, str]] = None) -> Tuple[str, int]:
+    '''
+    Replace every value matched by pattern.
+    realms - realm of every sealed value, see sealed_realms()
+    Returns (new text, number of the values replaced)
+    '''
+    matches = list(pattern.finditer(text))
+    values:List[str] = [''] * len(matches)
+    # the encrypted- values are done in one batch, sealed realms one by one
+    batch:List[int] = []
+    try:
+        for i, m in enumerate(matches):
+            blob = b64decode(m.group('value'), validate=True)
+            if m.group('key').lower() != sealed_key:
+                batch.append(i)
+                continue
+            realm = (realms or {}).get(m.group('value'))
+            if realm is None:
+                raise PySecretSettingsError(
+                    f"Failed to locate the realm of '{sealed_key}'")
+            values[i] = b64encode(
+                new.seal(old.unseal(blob, realm), realm)).decode('utf-8')
+        plaintexts = old.decrypt_many(
+            [b64decode(matches[i].group('value')) for i in batch])
+    except (binascii.Error, ValueError) as ex:
+        raise PySecretSettingsError(f'Failed to decrypt with the old key: {ex}')
+    for i, ct in zip(batch, new.encrypt_many(plaintexts)):
+        values[i] = b64encode(ct).decode('utf-8')
+
+    out:List[str] = []
+    pos = 0
+    for m, value in zip(matches, values):
+        out.append(text[pos:m.start('value')])
+        out.append(value)
+        pos = m.end('value')
+    out.append(text[pos:])
+    return ''.join(out), len(matches)
+
+def rekey_file(path:str, old_key:Union[bytes, str], new_key:Union[bytes, str],
+        out:Optional[str] = None) -> int:
+    '''
+    Re-encrypt all the `encrypted-` values and sealed realms of the INI/YAML
+    file path with new_key, save the result into out, by default over path.
+    The file is written atomically with the permissions of path.
+    Returns the number of the values re-encrypted.
+    '''
+    from .main import path2backend
+
+    backend = path2backend(path, False)
+    if isinstance(backend, YamlBackend):
+        pattern = yaml_value
+    elif isinstance(backend, IniBackend):
+        pattern = ini_value
+    else:
+        raise BackendError(
+            f"Can not re-key '{path}', re-key the source file instead")
+
+    with open(backend.path) as f:
+        text = f.read()
+    if isinstance(backend, IniBackend):
+        data = ini_sections(text, backend.path)
+    else:
+        data = backend.parse(text)
+    expected = count_encrypted(data)
+    text, count = rekey_text(
+        text, pattern, CipherContext(old_key), CipherContext(new_key),
+        sealed_realms(data))
+    if count != expected:
+        # e.g. YAML flow style or multi-line values
+        raise BackendError(
+            f"'{backend.path}' has {expected} encrypted values but {count} "
+            "are in the format which can be re-keyed")
+
+    write_atomic(text, out or backend.path, backend.path)
+    return count
+
+def write_atomic(text:str, dst:str, src:str) -> None:
+    '''
+    Write text into dst via a temp file, with the permissions of src
+    '''
+    dst = os.path.abspath(dst)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), prefix='.rekey-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.chmod(tmp, stat.S_IMODE(os.stat(src).st_mode))
+        os.replace(tmp, dst)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return
+
+def seal_file(path:str, key:Union[bytes, str], out:Optional[str] = None) -> int:
+    '''
+    Convert the INI/YAML file path into the sealed realms format: every realm
+    is decrypted with key and replaced by its `sealed-realm`, see seal_realm().
+    Comments are not preserved, nor is the INI DEFAULT section - its values are
+    sealed in every realm.
+    The result is saved into out, by default over path, atomically with the
+    permissions of path.
+    Returns the number of the realms sealed.
+    '''
+    from .main import path2backend
+
+    backend = path2backend(path, False)
+    if not isinstance(backend, (IniBackend, YamlBackend)):
+        raise BackendError(
+            f"Can not seal '{path}', seal the source file instead")
+    ctx = CipherContext(key)
+    data = backend.load('')
+    if not isinstance(data, dict):
+        raise BackendError(f"'{backend.path}' should be a dictionary")
+
+    res:Dict[str, Any] = {}
+    count = 0
+    for realm, values in data.items():
+        if not isinstance(values, dict):
+            res[realm] = values
+            continue
+        decrypted = decrypt_dict(values, ctx, realm=realm)
+        try:
+            res[realm] = {sealed_key: seal_realm(decrypted, ctx, realm)}
+        except (TypeError, ValueError) as ex:
+            raise BackendError(f"Failed to seal '{realm}': {ex}")
+        count += 1
+
+    if isinstance(backend, YamlBackend):
+        text = import_yaml().safe_dump(res, sort_keys=False, width=float('inf'))
+    else:
+        text = ''.join(
+            f'[{realm}]\n{sealed_key} = {values[sealed_key]}\n\n'
+            for realm, values in res.items())
+    write_atomic(text, out or backend.path, backend.path)
+    return count
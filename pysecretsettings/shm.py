@@ -0,0 +1,139 @@
+#
+# Settings shared by the pre-fork worker processes via shared memory
+#
+# The master process loads the settings file once and publishes it, still
+# encrypted, as a snapshot (see snapshot.py) in a shared memory segment:
+#
+#   shm = publish_settings('settings.yaml')
+#   # start the workers, pass them shm.name
+#   ...
+#   shm.close()
+#   shm.unlink()
+#
+# Workers attach to the segment without copying it:
+#
+#   settings = PySecretSettings(SharedMemoryBackend(name))
+#   settings.load('realm1', key)
+#
+# Decryption, if any, happens in every worker, with its own decrypt cache.
+#
+from typing import Any, Dict, Mapping, Optional, Union
+import mmap
+import os
+import sys
+
+from .backend import PySecretSettingsBackend
+from .error import PySecretSettingsBackendError as BackendError
+from .snapshot import SnapshotReader, dump_snapshot
+
+def publish_settings(source:Union[str, PySecretSettingsBackend],
+        name:Optional[str] = None, check_permissions:bool = False) -> Any:
+    '''
+    Load the raw settings from the source - a path or a backend - and copy them
+    into a new shared memory segment.
+    Returns multiprocessing.shared_memory.SharedMemory, the caller is
+    responsible to close() and unlink() it.
+    '''
+    from multiprocessing import shared_memory
+    from .main import path2backend
+
+    backend = path2backend(source, check_permissions) \
+        if isinstance(source, str) else source
+    blob = dump_snapshot(backend.load(''))
+    shm = shared_memory.SharedMemory(name=name, create=True, size=len(blob))
+    assert shm.buf is not None
+    shm.buf[:len(blob)] = blob
+    return shm
+
+
+class Segment:
+    '''
+    Read-only mapping of an existing POSIX shared memory segment, like
+    SharedMemory(name) but never registered with the resource tracker
+    '''
+
+    def __init__(self, name:str):
+        import _posixshmem  # type: ignore
+
+        fd = _posixshmem.shm_open('/' + name, os.O_RDONLY, mode=0o600)
+        try:
+            self._mmap = mmap.mmap(fd, os.fstat(fd).st_size, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        self.name = name
+        self.buf = memoryview(self._mmap)
+        return
+
+    def close(self) -> None:
+        self.buf.release()
+        self._mmap.close()
+        return
+
+
+def attach(name:str) -> Any:
+    '''
+    Attach to the existing shared memory segment without taking ownership of it
+    '''
+    from multiprocessing import shared_memory
+
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)  # type: ignore
+    if os.name == 'nt':
+        # no resource tracker on windows, the segment lives while it is open
+        return shared_memory.SharedMemory(name=name)
+    # before python 3.13 SharedMemory(name) registers the attached segment
+    # with the resource tracker which would unlink it when this process exits,
+    # see bpo-39959, and unregistering it would drop the registration of the
+    # master if the tracker is shared.  Map the segment directly instead.
+    return Segment(name)
+
+class SharedMemoryBackend(PySecretSettingsBackend):
+    '''
+    Backend to read the settings published by publish_settings().
+    Realms are decoded from the shared memory on demand, once per process.
+    '''
+
+    def __init__(self, name:str):
+        '''
+        name - shared memory segment name, SharedMemory.name in the master
+        '''
+        try:
+            self.shm = attach(name)
+        except FileNotFoundError:
+            raise BackendError(f"Failed to find shared memory '{name}'")
+        self.name = name
+        self.reader = SnapshotReader(self.shm.buf.toreadonly())
+        self._realms:Dict[str, Any] = {}
+        return
+
+    def read_realm(self, realm:str) -> Any:
+        '''
+        Return the raw data of the realm
+        '''
+        data = self._realms.get(realm)
+        if data is None:
+            try:
+                data = self._realms[realm] = self.reader.get(realm)
+            except KeyError:
+                raise BackendError(
+                    f"Failed to locate '{realm}' in shared memory '{self.name}'")
+        return data
+
+    def load(self, realm:str, key:Optional[str] = None) -> Mapping[str, Any]:
+        '''
+        Load secrets dictionary from the shared memory.
+        realm is like a section in an INI file, use '' to get all the secrets
+        in one dict.
+        '''
+        if not realm:
+            data = {r: self.read_realm(r) for r in self.reader.table}
+            return self.decrypt_realms(data, key)
+        return self.decrypt_realm(self.read_realm(realm), key, realm)
+
+    def close(self) -> None:
+        '''
+        Detach from the shared memory
+        '''
+        self.reader.buf.release()
+        self.shm.close()
+        return
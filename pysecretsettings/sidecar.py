@@ -0,0 +1,619 @@
+#
+# Settings daemon: one process per host loads, decrypts and watches the
+# settings files, the other processes ask it over a Unix domain socket
+#
+#   python3 -m pysecretsettings serve settings.yaml --key-file key
+#
+#   settings = PySecretSettings(SocketBackend())
+#   settings.load('realm1')
+#
+# The socket is created readable and writable by the owner only, the values
+# are served decrypted: the key the clients pass to load() is ignored.
+#
+# Protocol, all integers are big endian, every message is a frame:
+#   u32 length of the rest of the frame
+#   request:  u32 id, u8 op, then u16 length + UTF-8 of every argument
+#   response: u32 id, u8 status, u64 generation, payload
+# ops: op_realm (realm, '' for all the realms), op_value (realm, name),
+# op_generation (no arguments).  The payload of a successful response is
+# marshal.dumps() of the value, of an error the UTF-8 message.  The
+# generation is incremented on every change of the served values.
+# Requests can be pipelined, the responses come in the request order.
+#
+from typing import (
+    Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+)
+import marshal
+import os
+import socket
+import stat
+import struct
+import threading
+import time
+
+from .backend import FileBackend, PySecretSettingsBackend
+from .metrics import current_record
+from .watch import FileWatcher
+from .error import PySecretSettingsBackendError as BackendError
+
+frame_len = struct.Struct('>I')
+request_header = struct.Struct('>IB')
+response_header = struct.Struct('>IBQ')
+arg_len = struct.Struct('>H')
+# struct ucred: pid, uid, gid
+peer_creds = struct.Struct('3i')
+# larger frames are a protocol error
+max_frame = 64 * 1024 * 1024
+
+op_realm = 1
+op_value = 2
+op_generation = 3
+
+status_ok = 0
+status_not_found = 1
+status_error = 2
+
+def private_dir(path:str) -> str:
+    '''
+    Create the directory accessible by the owner only, or check that the
+    existing one is such and is ours, not a symlink
+    '''
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or \
+            stat.S_IMODE(st.st_mode) & 0o077:
+        raise BackendError(f"'{path}' is not a private directory of this user")
+    return path
+
+def default_socket_path() -> str:
+    '''
+    $XDG_RUNTIME_DIR/pysecretsettings.sock, else the socket in a private
+    per-user directory in the temp dir - the temp dir itself is writable by
+    everybody
+    '''
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'pysecretsettings.sock')
+    import tempfile
+
+    runtime_dir = private_dir(os.path.join(
+        tempfile.gettempdir(), f'pysecretsettings-{os.getuid()}'))
+    return os.path.join(runtime_dir, 'settings.sock')
+
+def peer_uid(sock:socket.socket, path:str) -> int:
+    '''
+    uid of the process on the other end of the connected Unix socket,
+    SO_PEERCRED, or of the owner of the socket file where it is not supported
+    '''
+    if hasattr(socket, 'SO_PEERCRED'):
+        creds = peer_creds.unpack(sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, peer_creds.size))
+        return creds[1]
+    return os.stat(path).st_uid
+
+def pack_request(id:int, op:int, args:Sequence[str]) -> bytes:
+    parts = [request_header.pack(id, op)]
+    for arg in args:
+        data = arg.encode('utf-8')
+        parts.append(arg_len.pack(len(data)))
+        parts.append(data)
+    body = b''.join(parts)
+    return frame_len.pack(len(body)) + body
+
+def unpack_request(body:bytes) -> Tuple[int, int, List[str]]:
+    '''
+    Returns (id, op, args), raises ValueError if malformed
+    '''
+    try:
+        id, op = request_header.unpack_from(body, 0)
+        pos = request_header.size
+        args:List[str] = []
+        while pos < len(body):
+            (n,) = arg_len.unpack_from(body, pos)
+            pos += arg_len.size
+            if pos + n > len(body):
+                raise ValueError('truncated argument')
+            args.append(body[pos:pos + n].decode('utf-8'))
+            pos += n
+    except (struct.error, UnicodeDecodeError) as ex:
+        raise ValueError(str(ex))
+    return id, op, args
+
+def pack_response(id:int, status:int, generation:int, payload:bytes) -> bytes:
+    return frame_len.pack(response_header.size + len(payload)) + \
+        response_header.pack(id, status, generation) + payload
+
+class SettingsServer:
+    '''
+    Serve the decrypted realms of the settings files over a Unix socket.
+    The files are watched, see FileWatcher, and the changes served right away.
+    A realm present in several files is served from the first one.
+    All the connections are served by one thread, see serve_forever().
+    '''
+
+    def __init__(self, sources:Sequence[Union[str, FileBackend]],
+            key:Optional[str] = None, socket_path:Optional[str] = None,
+            interval:float = 1.0):
+        '''
+        sources - settings file paths or FileBackends
+        key - the decryption key, None to serve the values as they are
+        socket_path - default is default_socket_path()
+        interval - file polling interval, see FileWatcher
+        '''
+        from .main import path2backend
+
+        if not sources:
+            raise BackendError('No settings files given')
+        self.watchers:List[FileWatcher] = []
+        for source in sources:
+            backend = path2backend(source, False) \
+                if isinstance(source, str) else source
+            if not isinstance(backend, FileBackend):
+                raise BackendError(f"Can not watch '{source}'")
+            self.watchers.append(FileWatcher(backend, key, interval))
+        self.socket_path = socket_path or default_socket_path()
+        # (generation, realm -> marshalled realm) of the realms served so far
+        self._encoded:Tuple[int, Dict[str, bytes]] = (self.generation, {})
+        self._sock:Optional[socket.socket] = None
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._stop = False
+        self._thread:Optional[threading.Thread] = None
+        return
+
+    @property
+    def generation(self) -> int:
+        '''
+        Generation of the served values, 1 plus the changes of all the files
+        including the ones which just add or remove an empty realm
+        '''
+        return 1 + sum(watcher.reloads for watcher in self.watchers)
+
+    def realm(self, realm:str) -> Any:
+        '''
+        Decrypted realm, KeyError if none of the files has it
+        '''
+        for watcher in self.watchers:
+            realms = watcher.realms
+            if realm in realms:
+                return realms[realm]
+        raise KeyError(realm)
+
+    def realms(self) -> Dict[str, Any]:
+        res:Dict[str, Any] = {}
+        for watcher in self.watchers:
+            for realm, data in watcher.realms.items():
+                res.setdefault(realm, data)
+        return res
+
+    def encoded_realm(self, realm:str) -> bytes:
+        '''
+        marshal.dumps() of the realm, '' for all, re-used until a change
+        '''
+        generation = self.generation
+        cached_generation, encoded = self._encoded
+        if cached_generation != generation:
+            encoded = {}
+            self._encoded = (generation, encoded)
+        res = encoded.get(realm)
+        if res is None:
+            data = self.realms() if not realm else self.realm(realm)
+            res = encoded[realm] = marshal.dumps(data)
+        return res
+
+    def handle(self, body:bytes) -> bytes:
+        '''
+        Answer one request frame
+        '''
+        generation = self.generation
+        try:
+            id, op, args = unpack_request(body)
+        except ValueError as ex:
+            return pack_response(0, status_error, generation, str(ex).encode())
+        try:
+            if op == op_realm and len(args) == 1:
+                payload = self.encoded_realm(args[0])
+            elif op == op_value and len(args) == 2:
+                realm = self.realm(args[0])
+                if not isinstance(realm, dict):
+                    raise KeyError(args[1])
+                payload = marshal.dumps(realm[args[1]])
+            elif op == op_generation and not args:
+                payload = marshal.dumps(generation)
+            else:
+                return pack_response(
+                    id, status_error, generation, b'bad request')
+        except KeyError as ex:
+            return pack_response(
+                id, status_not_found, generation, str(ex).encode('utf-8'))
+        except ValueError as ex:
+            return pack_response(
+                id, status_error, generation, str(ex).encode('utf-8'))
+        return pack_response(id, status_ok, generation, payload)
+
+    def bind(self) -> None:
+        '''
+        Create the listening socket, owner-only.  Replaces a stale socket file
+        left by a daemon which is no longer running.
+        '''
+        path = self.socket_path
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            pass
+        else:
+            if not stat.S_ISSOCK(st.st_mode):
+                raise BackendError(f"'{path}' exists and is not a socket")
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except OSError:
+                os.unlink(path)
+            else:
+                raise BackendError(f"'{path}' is served by another process")
+            finally:
+                probe.close()
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            sock.bind(path)
+        except OSError:
+            sock.close()
+            raise
+        finally:
+            os.umask(umask)
+        os.chmod(path, 0o600)
+        sock.listen(128)
+        sock.setblocking(False)
+        self._sock = sock
+        return
+
+    def serve_forever(self) -> None:
+        '''
+        Watch the files and serve until shutdown()
+        '''
+        import selectors
+
+        if self._sock is None:
+            self.bind()
+        assert self._sock is not None
+        for watcher in self.watchers:
+            watcher.start()
+        sel = selectors.DefaultSelector()
+        sel.register(self._sock, selectors.EVENT_READ)
+        sel.register(self._wake_r, selectors.EVENT_READ)
+        # connection -> (input buffer, output buffer)
+        conns:Dict[socket.socket, Tuple[bytearray, bytearray]] = {}
+        try:
+            while not self._stop:
+                for skey, events in sel.select():
+                    sock = skey.fileobj
+                    if sock is self._wake_r:
+                        self.drain_wake()
+                    elif sock is self._sock:
+                        self.accept(sel, conns)
+                    else:
+                        assert isinstance(sock, socket.socket)
+                        self.serve_connection(sel, conns, sock, events)
+        finally:
+            for conn in list(conns):
+                self.close_connection(sel, conns, conn)
+            sel.close()
+            for watcher in self.watchers:
+                watcher.stop()
+            self._sock.close()
+            self._sock = None
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+        return
+
+    def drain_wake(self) -> None:
+        '''
+        Read all the bytes sent by shutdown(), including the ones left from an
+        earlier stop, so that the wake up socket does not stay readable
+        '''
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        return
+
+    def accept(self, sel:Any,
+            conns:Dict[socket.socket, Tuple[bytearray, bytearray]]) -> None:
+        '''
+        Accept a new connection and register it with the selector
+        '''
+        import selectors
+
+        assert self._sock is not None
+        try:
+            conn, _ = self._sock.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        conns[conn] = (bytearray(), bytearray())
+        sel.register(conn, selectors.EVENT_READ)
+        return
+
+    def serve_connection(self, sel:Any,
+            conns:Dict[socket.socket, Tuple[bytearray, bytearray]],
+            conn:socket.socket, events:int) -> None:
+        '''
+        Read the requests available on the connection, answer the complete
+        ones, send what can be sent without blocking
+        '''
+        import selectors
+
+        inbuf, outbuf = conns[conn]
+        if events & selectors.EVENT_READ:
+            try:
+                data = conn.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                data = None
+            except OSError:
+                data = b''
+            if data == b'':
+                self.close_connection(sel, conns, conn)
+                return
+            if data:
+                inbuf += data
+                if not self.process(inbuf, outbuf):
+                    self.close_connection(sel, conns, conn)
+                    return
+        if outbuf:
+            try:
+                sent = conn.send(outbuf)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError:
+                self.close_connection(sel, conns, conn)
+                return
+            del outbuf[:sent]
+        # wait for writability only while there is something to send
+        sel.modify(conn, selectors.EVENT_READ | (
+            selectors.EVENT_WRITE if outbuf else 0))
+        return
+
+    @staticmethod
+    def close_connection(sel:Any,
+            conns:Dict[socket.socket, Tuple[bytearray, bytearray]],
+            conn:socket.socket) -> None:
+        sel.unregister(conn)
+        del conns[conn]
+        conn.close()
+        return
+
+    def process(self, inbuf:bytearray, outbuf:bytearray) -> bool:
+        '''
+        Answer all the complete requests in inbuf.
+        Returns False if the connection should be closed.
+        '''
+        pos = 0
+        while len(inbuf) - pos >= frame_len.size:
+            (n,) = frame_len.unpack_from(inbuf, pos)
+            if n > max_frame:
+                return False
+            if len(inbuf) - pos - frame_len.size < n:
+                break
+            start = pos + frame_len.size
+            outbuf += self.handle(bytes(inbuf[start:start + n]))
+            pos = start + n
+        del inbuf[:pos]
+        return True
+
+    def shutdown(self) -> None:
+        '''
+        Make serve_forever() return, can be called from any thread or a
+        signal handler
+        '''
+        self._stop = True
+        self._wake_w.send(b'\0')
+        return
+
+    def start(self) -> 'SettingsServer':
+        '''
+        Bind and serve in a daemon thread
+        '''
+        if self._thread is None:
+            self.bind()
+            self._stop = False
+            self._thread = threading.Thread(
+                target=self.serve_forever, name='SettingsServer', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        '''
+        Stop the thread started by start()
+        '''
+        thread = self._thread
+        if thread is not None:
+            self.shutdown()
+            thread.join()
+            self._thread = None
+        return
+
+    def close(self) -> None:
+        self.stop()
+        self._wake_r.close()
+        self._wake_w.close()
+        return
+
+    def __enter__(self) -> 'SettingsServer':
+        return self.start()
+
+    def __exit__(self, *args:Any) -> None:
+        self.close()
+        return
+
+class SocketBackend(PySecretSettingsBackend):
+    '''
+    Client of SettingsServer.  One connection per process, re-opened after
+    fork() and if the server restarts.  Thread safe.
+    '''
+
+    def __init__(self, socket_path:Optional[str] = None, timeout:float = 5.0):
+        '''
+        socket_path - default is default_socket_path()
+        timeout - socket timeout in seconds
+        '''
+        self.socket_path = socket_path or default_socket_path()
+        self.timeout = timeout
+        # generation of the served values in the last response
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._sock:Optional[socket.socket] = None
+        self._rfile:Any = None
+        self._pid = 0
+        self._next_id = 0
+        return
+
+    def connect(self) -> None:
+        '''
+        Connect to the server, which must run as the same user
+        '''
+        self.disconnect()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+            uid = peer_uid(sock, self.socket_path)
+        except OSError as ex:
+            sock.close()
+            raise BackendError(
+                f"Failed to connect to '{self.socket_path}': {ex}")
+        if uid != os.getuid():
+            sock.close()
+            raise BackendError(
+                f"'{self.socket_path}' is served by uid {uid}, not by this user")
+        self._sock = sock
+        self._rfile = sock.makefile('rb')
+        self._pid = os.getpid()
+        return
+
+    def disconnect(self) -> None:
+        if self._sock is not None:
+            # after fork() the parent still uses the connection, do not
+            # shut it down, just drop our copy
+            self._rfile.close()
+            self._sock.close()
+            self._sock = None
+            self._rfile = None
+        return
+
+    def read_frame(self) -> bytes:
+        head = self._rfile.read(frame_len.size)
+        if len(head) < frame_len.size:
+            raise ConnectionError('connection closed by the server')
+        (n,) = frame_len.unpack(head)
+        body = self._rfile.read(n)
+        if len(body) < n:
+            raise ConnectionError('connection closed by the server')
+        return body
+
+    def exchange(self,
+            requests:Sequence[Tuple[int, Sequence[str]]]) -> List[Tuple[int, bytes]]:
+        '''
+        Send all the (op, args) requests at once, wait for all the responses.
+        Returns (status, payload) per request.
+        '''
+        if not requests:
+            return []
+        with self._lock:
+            for attempt in (0, 1):
+                if self._sock is None or self._pid != os.getpid():
+                    self.connect()
+                assert self._sock is not None
+                first = self._next_id
+                self._next_id = (first + len(requests)) & 0xffffffff
+                frames = b''.join(
+                    pack_request((first + i) & 0xffffffff, op, args)
+                    for i, (op, args) in enumerate(requests))
+                try:
+                    self._sock.sendall(frames)
+                    res:List[Tuple[int, bytes]] = []
+                    for i in range(len(requests)):
+                        body = self.read_frame()
+                        id, status, generation = \
+                            response_header.unpack_from(body, 0)
+                        if id != (first + i) & 0xffffffff:
+                            raise ConnectionError('response out of order')
+                        res.append((status, body[response_header.size:]))
+                    self.generation = generation
+                    return res
+                except (OSError, struct.error) as ex:
+                    self.disconnect()
+                    if attempt:
+                        raise BackendError(
+                            f"Failed to talk to '{self.socket_path}': {ex}")
+        raise AssertionError('not reached')
+
+    def call(self, requests:Sequence[Tuple[int, Sequence[str]]]) -> List[Any]:
+        '''
+        exchange() and decode the payloads, raise BackendError on errors
+        '''
+        record = current_record()
+        start = time.perf_counter()
+        responses = self.exchange(requests)
+        if record is not None:
+            record.read += time.perf_counter() - start
+            record.bytes_read += sum(len(p) for _, p in responses)
+        res:List[Any] = []
+        for (op, args), (status, payload) in zip(requests, responses):
+            if status == status_not_found:
+                what = '/'.join(a for a in args if a)
+                raise BackendError(
+                    f"Failed to locate '{what}' in '{self.socket_path}'")
+            if status != status_ok:
+                raise BackendError(
+                    f"'{self.socket_path}': {payload.decode('utf-8', 'replace')}")
+            res.append(marshal.loads(payload))
+        return res
+
+    def load(self, realm:str, key:Optional[str] = None) -> Mapping[str, Any]:
+        '''
+        Load secrets dictionary from the server.
+        realm is like a section in an INI file, use '' to get all the secrets
+        in one dict.
+        key is ignored, the server decrypts with its own key.
+        '''
+        return self.call([(op_realm, (realm,))])[0]
+
+    def load_many(self, realms:Iterable[str]) -> Dict[str, Mapping[str, Any]]:
+        '''
+        Load several realms in one round trip
+        '''
+        realms = list(realms)
+        return dict(zip(realms, self.call([(op_realm, (r,)) for r in realms])))
+
+    def load_realms(self, realms:Sequence[str],
+            key:Optional[str] = None) -> Dict[str, Mapping[str, Any]]:
+        '''
+        load_many(), key is ignored
+        '''
+        return self.load_many(realms)
+
+    def get_values(self, names:Iterable[Tuple[str, str]]) -> List[Any]:
+        '''
+        Values of the (realm, name) pairs, in one round trip
+        '''
+        return self.call([(op_value, pair) for pair in names])
+
+    def server_generation(self) -> int:
+        '''
+        Ask the server for the generation of the served values, it changes
+        whenever they do
+        '''
+        return self.call([(op_generation, ())])[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self.disconnect()
+        return
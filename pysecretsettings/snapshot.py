@@ -0,0 +1,177 @@
+#
+# Compiled binary snapshot of a settings file
+#
+# Layout, all integers are big endian:
+#   magic b'PSS1', u32 number of entries
+#   table: for every entry: u16 name length, name (UTF-8), u64 offset, u64 size
+#   payloads: marshal.dumps() of every top-level value, still encrypted
+#
+# marshal is fast but not safe against maliciously crafted data: only load
+# snapshots you have compiled yourself, consider check_permissions.
+#
+from typing import Any, Dict, Mapping, Optional, Tuple, Union
+import marshal
+import os
+import stat
+import struct
+
+from .backend import FileBackend, Fingerprint, Located
+from .error import PySecretSettingsBackendError as BackendError
+
+magic = b'PSS1'
+header = struct.Struct('>4sI')
+name_len = struct.Struct('>H')
+location = struct.Struct('>QQ')
+
+def dump_snapshot(data:Mapping[str, Any]) -> bytes:
+    '''
+    Serialize the raw, not decrypted, settings document
+    '''
+    payloads = []
+    for name, value in data.items():
+        if not isinstance(name, str):
+            raise BackendError(f"Snapshot realm name should be str, not {type(name)}")
+        try:
+            payloads.append(marshal.dumps(value))
+        except ValueError as ex:
+            raise BackendError(f"Failed to serialize '{name}': {ex}")
+
+    names = [name.encode('utf-8') for name in data]
+    table_size = sum(name_len.size + len(n) + location.size for n in names)
+    offset = header.size + table_size
+    out = [header.pack(magic, len(names))]
+    for n, payload in zip(names, payloads):
+        out.append(name_len.pack(len(n)))
+        out.append(n)
+        out.append(location.pack(offset, len(payload)))
+        offset += len(payload)
+    out.extend(payloads)
+    return b''.join(out)
+
+class SnapshotReader:
+    '''
+    Decode the realms of a snapshot on demand from a buffer: bytes, mmap,
+    shared memory
+    '''
+    def __init__(self, buf:Any):
+        self.buf = buf
+        self.table:Dict[str, Tuple[int, int]] = {}
+        try:
+            mgc, count = header.unpack_from(buf, 0)
+            if mgc != magic:
+                raise BackendError('Bad snapshot magic')
+            pos = header.size
+            for _ in range(count):
+                (n,) = name_len.unpack_from(buf, pos)
+                pos += name_len.size
+                name = bytes(buf[pos:pos + n]).decode('utf-8')
+                pos += n
+                offset, size = location.unpack_from(buf, pos)
+                pos += location.size
+                if offset + size > len(buf):
+                    raise BackendError(f"Truncated snapshot realm '{name}'")
+                self.table[name] = (offset, size)
+        except (struct.error, UnicodeDecodeError) as ex:
+            raise BackendError(f'Bad snapshot: {ex}')
+        return
+
+    def get(self, name:str) -> Any:
+        '''
+        Decode the entry, raise KeyError if there is none
+        '''
+        offset, size = self.table[name]
+        return marshal.loads(self.buf[offset:offset + size])
+
+    def all(self) -> Dict[str, Any]:
+        '''
+        Decode all the entries
+        '''
+        return {name: self.get(name) for name in self.table}
+
+def compile_snapshot(src:str, dst:Optional[str] = None,
+        check_permissions:bool = False) -> str:
+    '''
+    Compile INI/YAML settings file src into a snapshot dst, by default src with
+    the extension replaced by `.pss`.  Values remain encrypted.
+    The file is written atomically with the permissions of src.
+    Returns the dst path.
+    '''
+    import tempfile
+    from .main import path2backend
+
+    backend = path2backend(src, check_permissions)
+    assert isinstance(backend, FileBackend)
+    data = backend.load('')
+    blob = dump_snapshot(data)
+
+    if dst is None:
+        dst = os.path.splitext(backend.path)[0] + '.pss'
+    dst = os.path.abspath(dst)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), prefix='.pss-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(blob)
+        os.chmod(tmp, stat.S_IMODE(os.stat(backend.path).st_mode))
+        os.replace(tmp, dst)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return dst
+
+class SnapshotBackend(FileBackend):
+    '''
+    Backend to read settings from a snapshot compiled by compile_snapshot().
+    The file is memory-mapped, realms are decoded on demand.
+    '''
+
+    def __init__(self, path:Union[str, Located], check_permissions:bool = False,
+            cache:bool = True):
+        '''
+        path - short or a fully qualified path to the file.  In former case
+        current dir and user's home is checked.
+        check_permissions - check that the file is readable by user only
+        cache - keep the decoded realms until the file changes
+        '''
+        super().__init__(path, check_permissions, cache)
+        # (fingerprint, reader over the mmap)
+        self._reader:Optional[Tuple[Fingerprint, SnapshotReader]] = None
+        return
+
+    def reader(self) -> SnapshotReader:
+        '''
+        Return the reader of the current file contents, re-mapping the file
+        if it changed
+        '''
+        import mmap
+
+        fp = self.fingerprint()
+        cached = self._reader
+        if cached is not None and cached[0] == fp:
+            return cached[1]
+        with open(self.path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                raise BackendError(f"Empty snapshot '{self.path}'")
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # the previous mapping is closed when no longer referenced
+        reader = SnapshotReader(mm)
+        self._reader = (fp, reader)
+        return reader
+
+    def parse_file(self) -> Any:
+        return self.reader().all()
+
+    def parse_realm(self, realm:str) -> Any:
+        try:
+            return self.reader().get(realm)
+        except KeyError:
+            raise BackendError(f"Failed to locate '{realm}' in '{self.path}'")
+
+    def load(self, realm:str, key:Optional[str] = None) -> Mapping[str, Any]:
+        '''
+        Load secrets dictionary from the snapshot.
+        realm is like a section in an INI file, use '' to get all the secrets
+        in one dict.
+        '''
+        if not realm:
+            return self.decrypt_realms(self.read(), key)
+        return self.decrypt_realm(self.read_realm(realm), key, realm)
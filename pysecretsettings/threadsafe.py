@@ -0,0 +1,112 @@
+#
+# Thread safe PySecretSettings: readers never lock
+#
+# Every load() publishes a new immutable Snapshot with a single attribute
+# assignment, atomic in Python.  A reader takes the current snapshot and reads
+# from it, it is never changed afterwards, so all the values it sees come from
+# the same load even if another thread reloads meanwhile:
+#
+#   settings = ConcurrentPySecretSettings('settings.yaml')
+#   settings.load('realm1', key)
+#   ...
+#   snap = settings.snapshot()
+#   connect(snap['host'], snap['port'])
+#
+from threading import Lock
+from types import MappingProxyType
+from typing import Any, Mapping, Optional
+
+from .compact import compact_settings
+from .error import PySecretSettingsError
+from .main import PySecretSettings
+
+class Snapshot:
+    '''
+    Secrets published by one load(), never modified
+    '''
+    __slots__ = ('generation', 'realm', 'secrets')
+
+    def __init__(self, generation:int, realm:str, secrets:Mapping[str, Any]):
+        # number of the loads so far, 1 for the first one
+        self.generation = generation
+        self.realm = realm
+        self.secrets = secrets
+        return
+
+    def get(self, key:str, default:Any = None) -> Any:
+        return self.secrets.get(key, default)
+
+    def __getitem__(self, key:str) -> Any:
+        '''
+        enable use of []
+        '''
+        return self.get(key)
+
+def freeze(data:Any) -> Any:
+    '''
+    Read-only copy of the load() result: dicts, also nested, are copied into
+    MappingProxyType, other mappings are read-only already
+    '''
+    if isinstance(data, dict):
+        return MappingProxyType({k: freeze(v) for k, v in data.items()})
+    return data
+
+class ConcurrentPySecretSettings:
+    '''
+    PySecretSettings which can be read by many threads while being reloaded.
+    Reads take no lock and see a consistent snapshot, loads are serialized.
+    '''
+
+    def __init__(self, arg:Any, **args:Any):
+        '''
+        arg and args - see PySecretSettings
+        '''
+        settings = PySecretSettings(arg, **args)
+        self.backend = settings.backend
+        self.compact = settings.compact
+        self._lock = Lock()
+        self._snapshot:Optional[Snapshot] = None
+        return
+
+    def load(self, realm:str, key:Optional[str] = None) -> Mapping[str, Any]:
+        '''
+        Load the secrets and publish them as the new snapshot
+        '''
+        with self._lock:
+            data = self.backend.load(realm, key)
+            secrets = compact_settings(data) if self.compact else freeze(data)
+            old = self._snapshot
+            generation = old.generation + 1 if old is not None else 1
+            self._snapshot = Snapshot(generation, realm, secrets)
+        return secrets
+
+    def snapshot(self) -> Snapshot:
+        '''
+        The current snapshot, use it to read several related values
+        '''
+        snap = self._snapshot
+        if snap is None:
+            raise PySecretSettingsError('secrets not loaded')
+        return snap
+
+    @property
+    def generation(self) -> int:
+        '''
+        Generation of the current snapshot, 0 if nothing is loaded yet
+        '''
+        snap = self._snapshot
+        return snap.generation if snap is not None else 0
+
+    @property
+    def secrets(self) -> Optional[Mapping[str, Any]]:
+        snap = self._snapshot
+        return snap.secrets if snap is not None else None
+
+    def get(self, key:str, default:Any = None) -> Any:
+        return self.snapshot().secrets.get(key, default)
+
+    def __getitem__(self, key:str) -> Any:
+        '''
+        enable use of []
+        '''
+        return self.get(key)
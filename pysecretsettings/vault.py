@@ -0,0 +1,285 @@
+#
+# Backend for HashiCorp Vault KV version 2 secrets engine, over plain HTTP(S)
+#
+# Every realm is a secret at `<mount>/data/<prefix>/<realm>`, its key/value
+# pairs are the realm settings.  `encrypted-` values, if any, are decrypted
+# with the key as in the file backends:
+#
+#   backend = VaultBackend('https://vault:8200', token, prefix='myapp')
+#   settings = PySecretSettings(backend)
+#   settings.load('production')
+#
+# Connections are kept alive in a small pool, the secrets read are cached for
+# ttl seconds, or less if Vault returns a shorter lease, so that repeated
+# loads do not touch the network.  load('') lists the realms and fetches the
+# ones not cached in parallel over the pool.
+#
+# url and token default to VAULT_ADDR and VAULT_TOKEN.  See vaultstub.py for an
+# in-process server to test against.
+#
+from threading import Lock
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+from urllib.parse import quote, urlsplit
+import json
+import os
+import time
+
+from .backend import PySecretSettingsBackend
+from .metrics import current_record
+from .error import PySecretSettingsBackendError as BackendError
+
+class ConnectionPool:
+    '''
+    Keep-alive HTTP(S) connections to one host, at most size of them are kept
+    idle.  Thread safe.
+    '''
+
+    def __init__(self, url:str, size:int = 4, timeout:float = 5.0):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise BackendError(f"Bad Vault URL '{url}'")
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.size = size
+        self.timeout = timeout
+        self._idle:List[Any] = []
+        self._lock = Lock()
+        # connections opened so far
+        self.opened = 0
+        return
+
+    def connect(self) -> Any:
+        import http.client
+
+        self.opened += 1
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(
+            self.host, self.port, timeout=self.timeout)
+
+    def request(self, method:str, path:str,
+            headers:Mapping[str, str]) -> Tuple[int, bytes]:
+        '''
+        Send the request over an idle connection or a new one.
+        Returns (status, body).  A request which fails on a reused connection,
+        e.g. closed by the server meanwhile, is retried once on a new one.
+        '''
+        import http.client
+
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self.connect()
+            try:
+                conn.request(method, path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+                break
+            except (http.client.HTTPException, OSError) as ex:
+                conn.close()
+                conn = None
+                if not reused:
+                    raise BackendError(f'Vault request failed: {ex}')
+                reused = False
+        if resp.will_close:
+            conn.close()
+        else:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+        return resp.status, body
+
+    def close(self) -> None:
+        '''
+        Close the idle connections
+        '''
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+        return
+
+class VaultBackend(PySecretSettingsBackend):
+    '''
+    Settings stored in Vault KV v2, see the top of vault.py
+    '''
+
+    def __init__(self, url:Optional[str] = None, token:Optional[str] = None,
+            mount:str = 'secret', prefix:str = '', ttl:float = 60.0,
+            namespace:Optional[str] = None, pool_size:int = 4,
+            timeout:float = 5.0):
+        '''
+        url - Vault address, e.g. https://vault:8200, by default VAULT_ADDR
+        token - Vault token, by default VAULT_TOKEN
+        mount - mount point of the KV v2 secrets engine
+        prefix - path of the realms under the mount
+        ttl - seconds to serve a secret from the cache, 0 to always fetch.
+        A shorter lease_duration returned by Vault takes precedence.
+        namespace - Vault Enterprise namespace
+        pool_size - connections kept alive, also the parallel fetches
+        timeout - socket timeout in seconds
+        '''
+        url = url or os.environ.get('VAULT_ADDR')
+        if not url:
+            raise BackendError('Vault URL not given and VAULT_ADDR not set')
+        token = token or os.environ.get('VAULT_TOKEN')
+        if not token:
+            raise BackendError('Vault token not given and VAULT_TOKEN not set')
+        self.url = url
+        self.mount = mount.strip('/')
+        self.prefix = prefix.strip('/')
+        self.ttl = ttl
+        self.pool = ConnectionPool(url, pool_size, timeout)
+        self.headers = {'X-Vault-Token': token}
+        if namespace:
+            self.headers['X-Vault-Namespace'] = namespace
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # realm -> (expiry time.monotonic(), data)
+        self._cache:Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        # (expiry, realm names)
+        self._realms:Optional[Tuple[float, List[str]]] = None
+        return
+
+    def api_path(self, kind:str, realm:str = '') -> str:
+        '''
+        `/v1/<mount>/<kind>/<prefix>/<realm>`, kind is data or metadata
+        '''
+        path = '/'.join(p for p in (self.prefix, realm) if p)
+        return quote(f'/v1/{self.mount}/{kind}/{path}')
+
+    def call(self, method:str, path:str) -> Optional[Dict[str, Any]]:
+        '''
+        Returns the JSON response, None if not found
+        '''
+        record = current_record()
+        start = time.perf_counter()
+        status, body = self.pool.request(method, path, self.headers)
+        if record is not None:
+            record.read += time.perf_counter() - start
+            record.bytes_read += len(body)
+        if status == 404:
+            return None
+        if status != 200:
+            try:
+                errors = '; '.join(json.loads(body)['errors'])
+            except (ValueError, KeyError, TypeError):
+                errors = body[:200].decode('utf-8', 'replace')
+            raise BackendError(f"Vault {method} {path} failed: {status} {errors}")
+        try:
+            res = json.loads(body)
+        except ValueError as ex:
+            raise BackendError(f'Bad Vault response to {path}: {ex}')
+        if not isinstance(res, dict):
+            raise BackendError(f'Bad Vault response to {path}')
+        return res
+
+    def expiry(self, response:Dict[str, Any]) -> float:
+        '''
+        When the response should be fetched again
+        '''
+        ttl = self.ttl
+        lease = response.get('lease_duration') or 0
+        if lease > 0:
+            ttl = min(ttl, lease)
+        return time.monotonic() + ttl
+
+    def fetch(self, realm:str) -> Tuple[float, Dict[str, Any]]:
+        '''
+        Read the realm from Vault, returns (expiry, data)
+        '''
+        res = self.call('GET', self.api_path('data', realm))
+        if res is None:
+            raise BackendError(f"Failed to locate '{realm}' in Vault '{self.url}'")
+        data = (res.get('data') or {}).get('data')
+        if data is None:
+            # the latest version was deleted
+            raise BackendError(f"Failed to locate '{realm}' in Vault '{self.url}'")
+        if not isinstance(data, dict):
+            raise BackendError(f"Vault secret '{realm}' should be a dictionary")
+        return self.expiry(res), data
+
+    def list_realms(self) -> List[str]:
+        '''
+        Names of the secrets under the prefix, sub-folders are skipped
+        '''
+        now = time.monotonic()
+        cached = self._realms
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        res = self.call('LIST', self.api_path('metadata').rstrip('/') + '/')
+        keys = [] if res is None else (res.get('data') or {}).get('keys') or []
+        realms = [k for k in keys if isinstance(k, str) and not k.endswith('/')]
+        self._realms = (self.expiry(res or {}), realms)
+        return realms
+
+    def read_realms(self, realms:Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        '''
+        Raw data of the realms, from the cache or fetched, in parallel if
+        there are several to fetch.
+        The result is shared - do not modify it.
+        '''
+        now = time.monotonic()
+        res:Dict[str, Dict[str, Any]] = {}
+        missing:List[str] = []
+        for realm in realms:
+            cached = self._cache.get(realm)
+            if cached is not None and cached[0] > now:
+                self.cache_hits += 1
+                res[realm] = cached[1]
+            else:
+                missing.append(realm)
+
+        if len(missing) > 1 and self.pool.size > 1:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(min(self.pool.size, len(missing))) as pool:
+                fetched = list(pool.map(self.fetch, missing))
+        else:
+            fetched = [self.fetch(realm) for realm in missing]
+        for realm, (expiry, data) in zip(missing, fetched):
+            self.cache_misses += 1
+            if self.ttl > 0:
+                self._cache[realm] = (expiry, data)
+            res[realm] = data
+        # in the requested order
+        return {realm: res[realm] for realm in realms}
+
+    def load(self, realm:str, key:Optional[str] = None) -> Mapping[str, Any]:
+        '''
+        Load secrets dictionary from Vault.
+        realm is a secret under the prefix, use '' to get all the secrets
+        in one dict.
+        '''
+        if not realm:
+            return self.decrypt_realms(self.read_realms(self.list_realms()), key)
+        return self.decrypt_realm(self.read_realms([realm])[realm], key, realm)
+
+    def load_realms(self, realms:Sequence[str],
+            key:Optional[str] = None) -> Dict[str, Mapping[str, Any]]:
+        '''
+        Fetch the realms not cached in parallel, decrypt them in one batch
+        '''
+        return self.decrypt_realms(self.read_realms(realms), key)
+
+    def clear_cache(self) -> None:
+        '''
+        Forget the cached secrets, next load() fetches them again
+        '''
+        self._cache = {}
+        self._realms = None
+        return
+
+    def close(self) -> None:
+        '''
+        Close the pooled connections
+        '''
+        self.pool.close()
+        return
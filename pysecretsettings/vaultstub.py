@@ -0,0 +1,189 @@
+#
+# In-process stand-in for a Vault server, KV v2 only, to test VaultBackend
+# offline:
+#
+#   with VaultStub({'myapp/production': {'username': 'alice'}}) as vault:
+#       backend = VaultBackend(vault.url, vault.token, prefix='myapp')
+#       backend.load('production')
+#
+# Supports reading, writing and listing secrets under one `secret` mount with
+# one token, keep-alive connections.  Not a secure store.
+#
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Any, Dict, Mapping, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+import json
+import time
+
+class VaultStubHandler(BaseHTTPRequestHandler):
+    '''
+    Serves one connection to VaultStub
+    '''
+    protocol_version = 'HTTP/1.1'
+    # headers and body go in separate writes, do not wait for the ACK
+    disable_nagle_algorithm = True
+    server:'VaultStubServer'
+
+    def log_message(self, format:str, *args:Any) -> None:
+        return
+
+    def reply(self, status:int, data:Optional[Dict[str, Any]] = None) -> None:
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return
+
+    def route(self) -> Optional[Tuple[str, str]]:
+        '''
+        Check the token, split the path into (kind, secret path).
+        Replies and returns None on error.
+        '''
+        stub = self.server.stub
+        with stub.lock:
+            stub.requests += 1
+        if stub.delay:
+            time.sleep(stub.delay)
+        if self.headers.get('X-Vault-Token') != stub.token:
+            self.reply(403, {'errors': ['permission denied']})
+            return None
+        path = unquote(urlsplit(self.path).path)
+        parts = path.split('/', 4)
+        # '', 'v1', mount, kind, path
+        if len(parts) < 4 or parts[1] != 'v1' or parts[2] != stub.mount or \
+                parts[3] not in ('data', 'metadata'):
+            self.reply(404, {'errors': []})
+            return None
+        return parts[3], parts[4] if len(parts) > 4 else ''
+
+    def do_GET(self) -> None:
+        if 'list=true' in urlsplit(self.path).query:
+            self.do_LIST()
+            return
+        route = self.route()
+        if route is None:
+            return
+        kind, path = route
+        secret = self.server.stub.secrets.get(path) if kind == 'data' else None
+        if secret is None:
+            self.reply(404, {'errors': []})
+            return
+        data, version = secret
+        self.reply(200, {
+            'request_id': '', 'lease_id': '', 'renewable': False,
+            'lease_duration': self.server.stub.lease_duration,
+            'data': {'data': data, 'metadata': {'version': version}},
+        })
+        return
+
+    def do_LIST(self) -> None:
+        route = self.route()
+        if route is None:
+            return
+        kind, path = route
+        prefix = path.rstrip('/') + '/' if path.strip('/') else ''
+        keys = set()
+        for name in self.server.stub.secrets:
+            if kind == 'metadata' and name.startswith(prefix):
+                rest = name[len(prefix):]
+                keys.add(rest.split('/', 1)[0] + '/' if '/' in rest else rest)
+        if not keys:
+            self.reply(404, {'errors': []})
+            return
+        self.reply(200, {'data': {'keys': sorted(keys)}})
+        return
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        route = self.route()
+        if route is None:
+            return
+        kind, path = route
+        try:
+            data = json.loads(body)['data']
+        except (ValueError, KeyError, TypeError):
+            self.reply(400, {'errors': ['bad request']})
+            return
+        if kind != 'data' or not isinstance(data, dict):
+            self.reply(400, {'errors': ['bad request']})
+            return
+        version = self.server.stub.put(path, data)
+        self.reply(200, {'data': {'version': version}})
+        return
+
+    do_PUT = do_POST
+
+class VaultStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    stub:'VaultStub'
+
+class VaultStub:
+    '''
+    Vault KV v2 stub server on localhost, running in a thread
+    '''
+
+    def __init__(self, secrets:Optional[Mapping[str, Dict[str, Any]]] = None,
+            token:str = 'stub-token', mount:str = 'secret',
+            lease_duration:int = 0, delay:float = 0.0):
+        '''
+        secrets - secret path -> key/value pairs
+        lease_duration - returned with every secret, 0 like Vault KV
+        delay - seconds to wait before replying, to simulate the network
+        '''
+        self.token = token
+        self.mount = mount
+        self.lease_duration = lease_duration
+        self.delay = delay
+        self.lock = Lock()
+        # path -> (data, version)
+        self.secrets:Dict[str, Tuple[Dict[str, Any], int]] = {}
+        # requests served so far
+        self.requests = 0
+        for path, data in (secrets or {}).items():
+            self.put(path, data)
+        self.server:Optional[VaultStubServer] = None
+        self.thread:Optional[Thread] = None
+        return
+
+    def put(self, path:str, data:Dict[str, Any]) -> int:
+        '''
+        Write a new version of the secret, returns the version
+        '''
+        with self.lock:
+            old = self.secrets.get(path.strip('/'))
+            version = old[1] + 1 if old is not None else 1
+            self.secrets[path.strip('/')] = (dict(data), version)
+        return version
+
+    @property
+    def url(self) -> str:
+        assert self.server is not None, 'not started'
+        host = str(self.server.server_address[0])
+        port = self.server.server_address[1]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'VaultStub':
+        self.server = VaultStubServer(('127.0.0.1', 0), VaultStubHandler)
+        self.server.stub = self
+        self.thread = Thread(
+            target=self.server.serve_forever, name='vault-stub', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        return
+
+    def __enter__(self) -> 'VaultStub':
+        return self.start()
+
+    def __exit__(self, *args:Any) -> None:
+        self.stop()
+        return
@@ -0,0 +1,287 @@
+#
+# Watch a settings file and reload it incrementally
+#
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import threading
+
+from .backend import FileBackend, Fingerprint
+from .crypto import sealed_key, unseal_realm
+
+# callback(realm, name, old value, new value), None value if absent
+Callback = Callable[[str, str, Any, Any], None]
+
+class Inotify:
+    '''
+    Minimal inotify(7) binding via ctypes: wake up on changes in a directory
+    '''
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+
+    def __init__(self, dir:str):
+        '''
+        Raises OSError if inotify is not available
+        '''
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux')
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # watch the directory, not the file: editors and deployment tools
+        # often replace the file by renaming a new one over it
+        mask = self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE | \
+            self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | \
+            self.IN_DELETE
+        if libc.inotify_add_watch(self.fd, os.fsencode(dir), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch '{dir}' failed")
+        return
+
+    def wait(self, timeout:float) -> bool:
+        '''
+        Wait for events up to timeout seconds, drain them.
+        Returns True if there were any.
+        '''
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self) -> None:
+        os.close(self.fd)
+        return
+
+class FileWatcher:
+    '''
+    Keep the decrypted realms of a FileBackend up to date.
+    When the file changes it is re-parsed, compared with the previous
+    version, only the changed `encrypted-` values are decrypted again and the
+    subscribers of the changed keys are notified.
+    Changes are detected with inotify where available, with stat polling
+    otherwise, or by calling check().
+    '''
+
+    def __init__(self, backend:FileBackend, key:Optional[str] = None,
+            interval:float = 1.0, use_inotify:bool = True):
+        '''
+        backend - settings file to watch
+        key - the decryption key, None to keep the values encrypted
+        interval - polling interval in seconds, also the max delay of stop()
+        use_inotify - use inotify if available
+        '''
+        self.backend = backend
+        self.key = key
+        self.interval = interval
+        self.use_inotify = use_inotify
+        # the last exception raised in the watcher thread
+        self.error:Optional[Exception] = None
+        # number of the changes seen by check(), counted after the realms
+        # are replaced
+        self.reloads = 0
+
+        self._lock = threading.Lock()
+        self._subscribers:List[Tuple[Optional[str], Optional[str], Callback]] = []
+        self._thread:Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        self._fp:Optional[Fingerprint] = backend.fingerprint()
+        self._raw:Dict[str, Any] = self.read_raw()
+        # decrypted realms, replaced as a whole on every change
+        self.realms:Dict[str, Any] = {
+            realm: self.decrypt(realm, data, {}, {})
+            for realm, data in self._raw.items()
+        }
+        return
+
+    def read_raw(self) -> Dict[str, Any]:
+        '''
+        Return the parsed, not decrypted, document
+        '''
+        data = self.backend.all_realms(self.backend.read())
+        if not isinstance(data, dict):
+            # let the backend complain
+            self.backend.load('')
+        return dict(data)
+
+    def decrypt(self, realm:str, new:Any, old:Any, old_decrypted:Any) -> Any:
+        '''
+        Decrypt the new realm data re-using the decrypted values of the
+        unchanged `encrypted-` entries of the old one
+        '''
+        if self.key is None or not isinstance(new, dict):
+            return new
+        ctx = self.backend.cipher_context(self.key)
+        key_prefix = 'encrypted-'
+        res:Dict[str, Any] = {}
+        for k, v in new.items():
+            if k == sealed_key:
+                res.update(
+                    unseal_realm(v, ctx, realm, self.backend.decrypt_cache))
+                continue
+            if not k.startswith(key_prefix):
+                res[k] = v
+                continue
+            nk = k[len(key_prefix):]
+            if isinstance(old, dict) and old.get(k) == v and nk in old_decrypted:
+                res[nk] = old_decrypted[nk]
+            else:
+                res[nk] = ctx.decrypt_str(v)
+        return res
+
+    def subscribe(self, callback:Callback, realm:Optional[str] = None,
+            name:Optional[str] = None) -> None:
+        '''
+        Call callback(realm, name, old, new) when the value of `name` in
+        `realm` changes.  None realm or name means any.
+        For the top-level values which are not realms name is ''.
+        '''
+        with self._lock:
+            self._subscribers.append((realm, name, callback))
+        return
+
+    def unsubscribe(self, callback:Callback) -> None:
+        '''
+        Stop calling callback
+        '''
+        with self._lock:
+            self._subscribers = [
+                s for s in self._subscribers if s[2] != callback]
+        return
+
+    def check(self) -> bool:
+        '''
+        Reload the file if it changed and notify the subscribers.
+        Returns True if the file changed.
+        '''
+        fp = self.backend.fingerprint()
+        if fp == self._fp:
+            return False
+        raw = self.read_raw()
+        self._fp = fp
+
+        changes:List[Tuple[str, str, Any, Any]] = []
+        realms = dict(self.realms)
+        for realm in set(self._raw) | set(raw):
+            old = self._raw.get(realm)
+            new = raw.get(realm)
+            if old == new:
+                continue
+            old_decrypted = self.realms.get(realm)
+            if realm not in raw:
+                new_decrypted = None
+                del realms[realm]
+            else:
+                new_decrypted = realms[realm] = self.decrypt(
+                    realm, new, old, old_decrypted or {})
+            changes.extend(diff(realm, old_decrypted, new_decrypted))
+        self._raw = raw
+        self.realms = realms
+
+        with self._lock:
+            self.reloads += 1
+            subscribers = list(self._subscribers)
+        for realm, name, old_value, new_value in changes:
+            for sub_realm, sub_name, callback in subscribers:
+                if sub_realm is not None and sub_realm != realm:
+                    continue
+                if sub_name is not None and sub_name != name:
+                    continue
+                callback(realm, name, old_value, new_value)
+        return True
+
+    def start(self) -> 'FileWatcher':
+        '''
+        Start watching in a daemon thread
+        '''
+        if self._thread is not None:
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.run, name=f'FileWatcher {self.backend.path}',
+            daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        '''
+        Stop the watcher thread
+        '''
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join()
+        self._thread = None
+        return
+
+    def run(self) -> None:
+        inotify:Optional[Inotify] = None
+        if self.use_inotify:
+            try:
+                inotify = Inotify(os.path.dirname(self.backend.path))
+            except (OSError, AttributeError):
+                inotify = None
+        try:
+            while not self._stop.is_set():
+                if inotify is not None:
+                    inotify.wait(self.interval)
+                else:
+                    self._stop.wait(self.interval)
+                if self._stop.is_set():
+                    break
+                try:
+                    self.check()
+                except Exception as ex:
+                    # e.g. the file is being re-written, try again later
+                    self.error = ex
+        finally:
+            if inotify is not None:
+                inotify.close()
+        return
+
+    def __enter__(self) -> 'FileWatcher':
+        return self.start()
+
+    def __exit__(self, *args:Any) -> None:
+        self.stop()
+        return
+
+def diff(realm:str, old:Any, new:Any) -> List[Tuple[str, str, Any, Any]]:
+    '''
+    List the (realm, name, old, new) of the changed values
+    '''
+    res:List[Tuple[str, str, Any, Any]] = []
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        if old == new:
+            return res
+        if isinstance(old, dict):
+            res.extend((realm, k, v, None) for k, v in old.items())
+            old = None
+        if isinstance(new, dict):
+            res.extend((realm, k, None, v) for k, v in new.items())
+            new = None
+        if old is not None or new is not None:
+            res.append((realm, '', old, new))
+        return res
+    for k in list(old) + [k for k in new if k not in old]:
+        ov = old.get(k)
+        nv = new.get(k)
+        if ov != nv:
+            res.append((realm, k, ov, nv))
+    return res
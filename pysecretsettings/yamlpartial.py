@@ -0,0 +1,140 @@
+#
+# Partial YAML loading: parse just one top-level realm
+#
+from collections import deque
+from typing import Any, Deque, Dict, List
+
+from .backend import NotPartial
+
+class NoRealm(Exception):
+    '''
+    The document is a mapping without the requested realm
+    '''
+    pass
+
+def load_realm(stream:Any, realm:str, loader:Any) -> Any:
+    '''
+    Walk the events of the top-level mapping in stream.  Subtrees of the other
+    realms are skipped without building nodes or Python objects for them.
+    Stops as soon as the realm is done, so the first of the duplicate realms
+    wins, unlike in a full load.
+    Returns the realm data constructed with the constructor of the loader.
+    Raises NoRealm if the realm is not there, NotPartial if the document
+    is not a mapping or the realm refers to an anchor defined elsewhere.
+    '''
+    from yaml import composer, events
+
+    parser = loader(stream)
+    try:
+        parser.get_event()
+        if not parser.check_event(events.DocumentStartEvent):
+            raise NotPartial()
+        parser.get_event()
+        if not parser.check_event(events.MappingStartEvent):
+            raise NotPartial()
+        parser.get_event()
+
+        while not parser.check_event(events.MappingEndEvent):
+            event = parser.get_event()
+            if isinstance(event, events.ScalarEvent) and \
+                    event.value == realm and is_str(event):
+                node_events = collect(parser, parser.get_event())
+                try:
+                    return construct(node_events, loader)
+                except composer.ComposerError:
+                    # e.g. an alias to an anchor in a skipped realm
+                    raise NotPartial()
+            # skip the key then the value
+            collect(parser, event, keep=False)
+            collect(parser, parser.get_event(), keep=False)
+        raise NoRealm()
+    finally:
+        parser.dispose()
+
+def is_str(event:Any) -> bool:
+    '''
+    Will the scalar be constructed as a str?
+    '''
+    from yaml import nodes, resolver
+
+    str_tag = 'tag:yaml.org,2002:str'
+    if event.tag not in (None, '!'):
+        return bool(event.tag == str_tag)
+    if event.style:
+        # quoted or block scalar
+        return True
+    tag = resolver.Resolver().resolve(
+        nodes.ScalarNode, event.value, event.implicit)
+    return bool(tag == str_tag)
+
+def collect(parser:Any, first:Any, keep:bool = True) -> List[Any]:
+    '''
+    Consume the events of the node which starts with `first`.
+    Returns the list of the events if keep, empty list otherwise.
+    '''
+    from yaml import events
+
+    res = [first] if keep else []
+    if not isinstance(first, events.CollectionStartEvent):
+        return res
+    depth = 1
+    while depth:
+        event = parser.get_event()
+        if isinstance(event, events.CollectionStartEvent):
+            depth += 1
+        elif isinstance(event, events.CollectionEndEvent):
+            depth -= 1
+        if keep:
+            res.append(event)
+    return res
+
+
+_event_loaders:Dict[Any, Any] = {}
+
+def construct(node_events:List[Any], loader:Any) -> Any:
+    '''
+    Compose and construct the node from the list of events
+    '''
+    cls = _event_loaders.get(loader)
+    if cls is None:
+        cls = _event_loaders[loader] = event_loader(loader)
+    ldr = cls(node_events)
+    node = ldr.compose_node(None, None)
+    return ldr.construct_document(node)
+
+def event_loader(loader:Any) -> Any:
+    '''
+    Create a pure python loader class which takes the events from a list and
+    uses the same constructor as the loader
+    '''
+    from yaml import composer, constructor, resolver
+
+    for base in (constructor.UnsafeConstructor, constructor.FullConstructor,
+            constructor.SafeConstructor):
+        if issubclass(loader, base):
+            break
+    else:
+        base = constructor.SafeConstructor
+
+    class EventLoader(composer.Composer, base, resolver.Resolver):  # type: ignore
+        def __init__(self, node_events:List[Any]):
+            self.node_events:Deque[Any] = deque(node_events)
+            composer.Composer.__init__(self)
+            base.__init__(self)
+            resolver.Resolver.__init__(self)
+            return
+
+        def check_event(self, *choices:Any) -> bool:
+            if not self.node_events:
+                return False
+            if not choices:
+                return True
+            return isinstance(self.node_events[0], choices)
+
+        def peek_event(self) -> Any:
+            return self.node_events[0]
+
+        def get_event(self) -> Any:
+            return self.node_events.popleft()
+
+    return EventLoader
@@ -1,16 +1,45 @@
 #
 #
 #
+import json
+import marshal
+import multiprocessing
 import os.path
-#from typing import List
+import shutil
+import signal
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional, Tuple
 import unittest
+from unittest import mock
 
 
 #from logger import log
+from pysecretsettings.main import path2backend
+from pysecretsettings.sidecar import default_socket_path
+from pysecretsettings.vaultstub import VaultStub
 from pysecretsettings import (
     FileBackend,
     IniBackend,
     YamlBackend,
+    SnapshotBackend,
+    compile_snapshot,
+    EnvFileBackend,
+    VaultBackend,
+    SettingsServer,
+    SocketBackend,
+    SharedMemoryBackend,
+    publish_settings,
+    FileWatcher,
+    LayeredBackend,
+    HistogramMetrics,
+    PySecretSettings,
+    encrypt_str,
     decrypt_dict,
     PySecretSettingsError
 )
@@ -196,6 +225,59 @@ class YamlBackend_test(unittest.TestCase):
         self.assertIsInstance(data['sample-list'], list)
         return
 
+    def test_yaml_loaders(self) -> None:
+        '''
+        All the loaders produce the same data
+        '''
+        fname = test_file('test-simple.yaml')
+        expected = YamlBackend(fname, loader='unsafe').load('')
+        for loader in ('auto', 'python'):
+            data = YamlBackend(fname, loader=loader).load('')
+            self.assertEqual(data, expected)
+
+        with self.assertRaises(PySecretSettingsError) as ctx:
+            YamlBackend(fname, loader='fast')
+        self.assertEqual(ctx.exception.msg, "Unknown YAML loader 'fast'")
+        return
+
+    def test_yaml_partial(self) -> None:
+        '''
+        Partial load of a realm gives the same data as the full load
+        '''
+        fname = test_file('test-simple.yaml')
+        full = YamlBackend(fname).load('')
+        for loader in ('auto', 'python', 'unsafe'):
+            backend = YamlBackend(fname, loader=loader, partial=True)
+            for realm in full:
+                self.assertEqual(backend.load(realm), full[realm])
+            self.assertEqual(backend.read_realm('realm1'), full['realm1'])
+
+            with self.assertRaises(PySecretSettingsError) as ctx:
+                backend.load('nope')
+            self.assertEqual(ctx.exception.msg, "YAML data have no realm 'nope'")
+
+        backend = YamlBackend(test_file('test-list.yaml'), partial=True)
+        with self.assertRaises(PySecretSettingsError) as ctx:
+            backend.load('one')
+        self.assertEqual(
+            ctx.exception.msg, "YAML secrets should be a dictionary, not a list")
+        return
+
+    def test_yaml_partial_alias(self) -> None:
+        '''
+        A realm referring to an anchor in a skipped realm is loaded in full
+        '''
+        fd, path = tempfile.mkstemp(suffix='.yaml')
+        with os.fdopen(fd, 'w') as f:
+            f.write('base: &base\n  port: 80\nweb:\n  <<: *base\n  host: w\n')
+        try:
+            backend = YamlBackend(path, partial=True)
+            self.assertEqual(backend.load('web'), {'port': 80, 'host': 'w'})
+            self.assertEqual(backend.load('base'), {'port': 80})
+        finally:
+            os.remove(path)
+        return
+
 
 class IniBackend_test(unittest.TestCase):
     '''
@@ -282,6 +364,842 @@ class IniBackend_test(unittest.TestCase):
             decrypted2['password'], decrypted2['decrypted-password'])
         return
 
+    def test_ini_interpolation(self) -> None:
+        '''
+        A bad value in one section does not break loading the others
+        '''
+        fd, path = tempfile.mkstemp(suffix='.ini')
+        with os.fdopen(fd, 'w') as f:
+            f.write('[realm1]\nusername=alice\n[realm2]\npassword=50%off\n')
+        try:
+            backend = IniBackend(path)
+            for _ in range(2):
+                self.assertEqual(backend.load('realm1'), {'username': 'alice'})
+                with self.assertRaisesRegex(PySecretSettingsError, '%off'):
+                    backend.load('realm2')
+                with self.assertRaises(PySecretSettingsError):
+                    backend.load('')
+        finally:
+            os.remove(path)
+        return
+
+    def test_ini_index(self) -> None:
+        '''
+        Indexed load of a section gives the same data as the full load
+        '''
+        for fname in ('test-simple.ini', 'test-secrets.ini'):
+            full = IniBackend(test_file(fname)).load('')
+            backend = IniBackend(test_file(fname), index=True)
+            for realm in full:
+                self.assertEqual(backend.load(realm), full[realm])
+            self.assertIsNotNone(backend._index)
+            self.assertEqual(backend.cache_misses, len(full))
+
+            with self.assertRaises(PySecretSettingsError) as ctx:
+                backend.load('nope')
+            self.assertEqual(
+                ctx.exception.msg,
+                f"Failed to locate 'nope' in '{test_file(fname)}'")
+        return
+
+    def test_ini_index_default(self) -> None:
+        '''
+        DEFAULT section values are seen by the indexed load, changed file is
+        re-indexed
+        '''
+        fd, path = tempfile.mkstemp(suffix='.ini')
+        with os.fdopen(fd, 'w') as f:
+            f.write('# comment\n[DEFAULT]\nport=80\n[a]\nhost=a\n[b]\nhost=b\n')
+        try:
+            backend = IniBackend(path, index=True)
+            self.assertEqual(backend.load('b'), {'host': 'b', 'port': '80'})
+            with open(path, 'a') as f:
+                f.write('[c]\nhost=c\n  [not-a-header]\n')
+            # indented header - falls back to the full parse
+            self.assertEqual(
+                backend.load('c'),
+                {'host': 'c\n[not-a-header]', 'port': '80'})
+            self.assertIsNone(backend._index[1] if backend._index else None)
+        finally:
+            os.remove(path)
+        return
+
+
+class SnapshotBackend_test(unittest.TestCase):
+    '''
+    class SnapshotBackend test cases
+
+    to run all these: `python3 -m unittest backend_test.SnapshotBackend_test`
+    '''
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        return
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+        return
+
+    def test_snapshot(self) -> None:
+        '''
+        Snapshot gives the same data as the source file
+        '''
+        for fname in ('test-secrets.ini', 'test-simple.yaml'):
+            src = test_file(fname)
+            dst = os.path.join(self.dir.name, fname + '.pss')
+            self.assertEqual(compile_snapshot(src, dst), dst)
+
+            source = IniBackend(src) if fname.endswith('.ini') else YamlBackend(src)
+            backend = SnapshotBackend(dst)
+            self.assertEqual(backend.load(''), source.load(''))
+            for realm in ('secrets', 'realm1'):
+                self.assertEqual(backend.load(realm), source.load(realm))
+
+            key = str(source.load('secrets')['key'])
+            self.assertEqual(backend.load('realm1', key), source.load('realm1', key))
+
+            with self.assertRaises(PySecretSettingsError) as ctx:
+                backend.load('nope')
+            self.assertEqual(
+                ctx.exception.msg, f"Failed to locate 'nope' in '{dst}'")
+        return
+
+    def test_bad_snapshot(self) -> None:
+        '''
+        Not a snapshot
+        '''
+        backend = SnapshotBackend(test_file('test-simple.ini'))
+        with self.assertRaises(PySecretSettingsError) as ctx:
+            backend.load('realm1')
+        self.assertEqual(ctx.exception.msg, 'Bad snapshot magic')
+        return
+
+
+class EnvFileBackend_test(unittest.TestCase):
+    '''
+    class EnvFileBackend test cases
+
+    to run all these: `python3 -m unittest backend_test.EnvFileBackend_test`
+    '''
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        return
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+        return
+
+    def write(self, name:str, text:str) -> str:
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_env(self) -> None:
+        '''
+        Realms, quoting, comments and decryption
+        '''
+        backend = EnvFileBackend(test_file('test-secrets.env'))
+        data = backend.load('')
+        self.assertEqual(list(data), ['test-secrets', 'realm2'])
+        data1 = data['test-secrets']
+        self.assertEqual(data1['USERNAME'], 'alice')
+        self.assertEqual(data1['HOME_DIR'], '/home/alice')
+        self.assertEqual(data1['GREETING'], 'hello\nworld # not a comment')
+        self.assertEqual(data1['PATTERN'], 'a\\nb')
+        self.assertEqual(data1['EMPTY'], '')
+        self.assertEqual(data['realm2']['USERNAME'], 'bob')
+
+        data1 = backend.load('test-secrets', '1234567890123456')
+        self.assertEqual(data1['password1'], data1['decrypted-password1'])
+        data2 = backend.load('realm2', '1234567890123456')
+        self.assertEqual(data2['password'], data2['decrypted-password'])
+        self.assertEqual(backend.load('', '1234567890123456')['realm2'], data2)
+
+        with self.assertRaises(PySecretSettingsError):
+            backend.load('nonexistent')
+
+        path = self.write('bad.env', 'A=1\n# comment\n\nnot an assignment\n')
+        with self.assertRaisesRegex(PySecretSettingsError, 'bad line 4'):
+            EnvFileBackend(path).load('')
+        return
+
+    def test_detection(self) -> None:
+        '''
+        path2backend() recognizes dotenv files, the realm is named after
+        the file
+        '''
+        for name, realm in (('.env', 'env'), ('.env.production', 'production'),
+                ('staging.env', 'staging')):
+            backend = path2backend(self.write(name, 'A=1\n'), False)
+            self.assertIsInstance(backend, EnvFileBackend)
+            self.assertEqual(backend.load(realm), {'A': '1'})
+        backend = path2backend(self.write('settings', '# x\nexport A=1\n'), False)
+        self.assertIsInstance(backend, EnvFileBackend)
+        self.assertEqual(backend.load('settings'), {'A': '1'})
+        return
+
+    def test_export_environ(self) -> None:
+        '''
+        Only the variables which change are set, decrypted values exported
+        without the prefix
+        '''
+        backend = EnvFileBackend(test_file('test-secrets.env'))
+        environ = {'USERNAME': 'alice', 'EMPTY': 'x'}
+        count = backend.export_environ(
+            key='1234567890123456', override=False, environ=environ)
+        self.assertEqual(environ['password1'], 'BigB1gSecret')
+        self.assertEqual(environ['EMPTY'], 'x')
+        self.assertEqual(count, len(environ) - 2)
+
+        self.assertEqual(backend.export_environ('realm2', environ=environ), 3)
+        self.assertEqual(environ['USERNAME'], 'bob')
+
+        name = 'PSS_TEST_EXPORT'
+        path = self.write('export.env', f'{name}=42\n')
+        try:
+            self.assertEqual(EnvFileBackend(path).export_environ(), 1)
+            self.assertEqual(os.environ[name], '42')
+            self.assertEqual(EnvFileBackend(path).export_environ(), 0)
+        finally:
+            os.environ.pop(name, None)
+        return
+
+class VaultBackend_test(unittest.TestCase):
+    '''
+    class VaultBackend test cases, against VaultStub
+
+    to run all these: `python3 -m unittest backend_test.VaultBackend_test`
+    '''
+    key = '1234567890123456'
+
+    def setUp(self) -> None:
+        self.stub = VaultStub({
+            'myapp/realm1': {
+                'username': 'alice',
+                'encrypted-password': encrypt_str('secret', self.key.encode()),
+            },
+            'myapp/realm2': {'username': 'bob'},
+            'myapp/nested/realm3': {'username': 'carol'},
+            'other/realm1': {'username': 'dave'},
+        }).start()
+        return
+
+    def tearDown(self) -> None:
+        self.stub.stop()
+        return
+
+    def backend(self, **args:Any) -> VaultBackend:
+        backend = VaultBackend(self.stub.url, self.stub.token, **args)
+        self.addCleanup(backend.close)
+        return backend
+
+    def test_load(self) -> None:
+        '''
+        Realms are the secrets under the prefix, decrypted with the key
+        '''
+        backend = self.backend(prefix='myapp')
+        self.assertEqual(
+            backend.load('realm1', self.key),
+            {'username': 'alice', 'password': 'secret'})
+        self.assertEqual(backend.load('realm2'), {'username': 'bob'})
+
+        data = backend.load('', self.key)
+        self.assertEqual(list(data), ['realm1', 'realm2'])
+        self.assertEqual(data['realm1']['password'], 'secret')
+        self.assertEqual(
+            self.backend(prefix='myapp/nested').load('realm3'),
+            {'username': 'carol'})
+
+        with self.assertRaises(PySecretSettingsError):
+            backend.load('nonexistent')
+        backend = VaultBackend(self.stub.url, 'bad token')
+        self.addCleanup(backend.close)
+        with self.assertRaisesRegex(PySecretSettingsError, '403'):
+            backend.load('realm1')
+        return
+
+    def test_cache(self) -> None:
+        '''
+        Cached realms do not touch the network until the ttl expires,
+        connections are re-used
+        '''
+        backend = self.backend(prefix='myapp', pool_size=1)
+        backend.load('realm1')
+        requests = self.stub.requests
+        for _ in range(10):
+            backend.load('realm1')
+        self.assertEqual(self.stub.requests, requests)
+        self.assertEqual(backend.cache_hits, 10)
+
+        # list + realm2, realm1 is cached
+        backend.load('')
+        self.assertEqual(self.stub.requests, requests + 2)
+        self.assertEqual(backend.pool.opened, 1)
+
+        self.stub.put('myapp/realm1', {'username': 'eve'})
+        self.assertEqual(backend.load('realm1')['username'], 'alice')
+        backend.clear_cache()
+        self.assertEqual(backend.load('realm1')['username'], 'eve')
+
+        backend = self.backend(prefix='myapp', ttl=0)
+        backend.load('realm1')
+        backend.load('realm1')
+        self.assertEqual(backend.cache_hits, 0)
+
+        # the lease is shorter than the ttl
+        self.stub.lease_duration = 1
+        backend = self.backend(prefix='myapp')
+        backend.load('realm1')
+        self.assertLessEqual(
+            backend._cache['realm1'][0], time.monotonic() + 1)
+        return
+
+    def test_reconnect(self) -> None:
+        '''
+        A connection closed by the server is replaced transparently
+        '''
+        backend = self.backend(prefix='myapp', ttl=0, pool_size=1)
+        backend.load('realm1')
+        for conn in backend.pool._idle:
+            conn.sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(backend.load('realm2'), {'username': 'bob'})
+        self.assertEqual(backend.pool.opened, 2)
+        return
+
+class SettingsServer_test(unittest.TestCase):
+    '''
+    class SettingsServer and SocketBackend test cases
+
+    to run all these: `python3 -m unittest backend_test.SettingsServer_test`
+    '''
+    key = '1234567890123456'
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.dir.name, 'settings.sock')
+        self.src = os.path.join(self.dir.name, 'secrets.ini')
+        shutil.copy(test_file('test-secrets.ini'), self.src)
+        return
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+        return
+
+    def client(self) -> SocketBackend:
+        client = SocketBackend(self.socket_path)
+        self.addCleanup(client.close)
+        return client
+
+    def test_serve(self) -> None:
+        '''
+        Clients get the decrypted realms, pipelined requests, changes
+        '''
+        expected = IniBackend(self.src).load('', self.key)
+        with SettingsServer([self.src], self.key, self.socket_path, 0.05):
+            self.assertEqual(
+                stat.S_IMODE(os.stat(self.socket_path).st_mode), 0o600)
+            client = self.client()
+            self.assertEqual(client.load('realm1'), expected['realm1'])
+            self.assertEqual(client.load(''), expected)
+            self.assertEqual(
+                client.load_many(['realm2', 'realm1']),
+                {'realm2': expected['realm2'], 'realm1': expected['realm1']})
+            self.assertEqual(
+                client.get_values([('realm2', 'password'), ('secrets', 'key')]),
+                ['alice', self.key])
+            with self.assertRaises(PySecretSettingsError):
+                client.load('nonexistent')
+            with self.assertRaises(PySecretSettingsError):
+                client.get_values([('realm1', 'nonexistent')])
+
+            # a second server on the same socket is refused
+            server = SettingsServer([self.src], None, self.socket_path)
+            self.addCleanup(server.close)
+            with self.assertRaisesRegex(PySecretSettingsError, 'another'):
+                server.bind()
+
+            generation = client.server_generation()
+            time.sleep(0.05)
+            with open(self.src, 'a') as f:
+                f.write('\n[realm3]\nusername = carol\n')
+            for _ in range(100):
+                if client.server_generation() != generation:
+                    break
+                time.sleep(0.02)
+            self.assertEqual(client.load('realm3'), {'username': 'carol'})
+        self.assertFalse(os.path.exists(self.socket_path))
+        return
+
+    def test_empty_realm(self) -> None:
+        '''
+        Adding an empty realm is a change too, load('') is not served stale
+        '''
+        server = SettingsServer([self.src], self.key, self.socket_path)
+        self.addCleanup(server.close)
+        generation = server.generation
+        self.assertNotIn('empty', marshal.loads(server.encoded_realm('')))
+        with open(self.src, 'a') as f:
+            f.write('\n[empty]\n')
+        self.assertTrue(server.watchers[0].check())
+        self.assertEqual(server.generation, generation + 1)
+        self.assertEqual(marshal.loads(server.encoded_realm(''))['empty'], {})
+        return
+
+    def test_reconnect(self) -> None:
+        '''
+        The client reconnects when the server restarts and after fork()
+        '''
+        client = self.client()
+        with self.assertRaises(PySecretSettingsError):
+            client.load('realm1')
+        with SettingsServer([self.src], None, self.socket_path):
+            self.assertEqual(client.load('realm2')['username'], 'bob')
+        with SettingsServer([self.src], None, self.socket_path):
+            self.assertEqual(client.load('realm2')['username'], 'bob')
+
+            pid = os.fork()
+            if pid == 0:
+                os._exit(0 if client.load('realm1')['username'] == 'alice' else 1)
+            _, status = os.waitpid(pid, 0)
+            self.assertEqual(status, 0)
+            self.assertEqual(client.load('realm2')['username'], 'bob')
+        return
+
+    def test_restart(self) -> None:
+        '''
+        The wake up byte of a stop is drained on the next start, the server
+        does not spin
+        '''
+        server = SettingsServer([self.src], None, self.socket_path)
+        self.addCleanup(server.close)
+        server.start()
+        server.stop()
+        server.start()
+        client = self.client()
+        self.assertEqual(client.load('realm2')['username'], 'bob')
+        time.sleep(0.05)
+        with self.assertRaises(BlockingIOError):
+            server._wake_r.recv(1, socket.MSG_DONTWAIT)
+        server.stop()
+        self.assertFalse(os.path.exists(self.socket_path))
+        return
+
+    def test_peer_uid(self) -> None:
+        '''
+        The client refuses a server running as another user
+        '''
+        with SettingsServer([self.src], None, self.socket_path):
+            client = self.client()
+            with mock.patch('os.getuid', return_value=os.getuid() + 1):
+                with self.assertRaisesRegex(PySecretSettingsError, 'served by uid'):
+                    client.load('realm1')
+            self.assertEqual(client.load('realm2')['username'], 'bob')
+        return
+
+    def test_default_socket_path(self) -> None:
+        '''
+        Without XDG_RUNTIME_DIR the socket is in a private directory
+        '''
+        env = {k: v for k, v in os.environ.items() if k != 'XDG_RUNTIME_DIR'}
+        with mock.patch.dict(os.environ, env, clear=True), \
+                mock.patch.object(tempfile, 'tempdir', self.dir.name):
+            path = default_socket_path()
+            self.assertEqual(os.path.dirname(os.path.dirname(path)), self.dir.name)
+            self.assertEqual(
+                stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode), 0o700)
+            self.assertEqual(default_socket_path(), path)
+
+            os.chmod(os.path.dirname(path), 0o777)
+            with self.assertRaisesRegex(PySecretSettingsError, 'private'):
+                default_socket_path()
+        return
+
+    def test_cli(self) -> None:
+        '''
+        `python3 -m pysecretsettings serve` until SIGTERM
+        '''
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'pysecretsettings', 'serve', self.src,
+                '--socket', self.socket_path, '--no-key'],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stderr=subprocess.DEVNULL)
+        try:
+            for _ in range(200):
+                if os.path.exists(self.socket_path):
+                    break
+                time.sleep(0.02)
+            client = self.client()
+            self.assertTrue(client.load('realm1')['encrypted-password1'])
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            self.assertEqual(proc.wait(10), 0)
+        self.assertFalse(os.path.exists(self.socket_path))
+        return
+
+def load_shared(name:str, realm:str, key:str) -> Dict[str, Any]:
+    '''
+    Worker process side of SharedMemoryBackend_test
+    '''
+    backend = SharedMemoryBackend(name)
+    try:
+        return dict(backend.load(realm, key))
+    finally:
+        backend.close()
+
+class SharedMemoryBackend_test(unittest.TestCase):
+    '''
+    class SharedMemoryBackend test cases
+
+    to run all these: `python3 -m unittest backend_test.SharedMemoryBackend_test`
+    '''
+
+    def test_shared_memory(self) -> None:
+        '''
+        Workers see the same data as the published file
+        '''
+        fname = test_file('test-secrets.ini')
+        source = IniBackend(fname)
+        key = str(source.load('secrets')['key'])
+        shm = publish_settings(fname)
+        try:
+            backend = SharedMemoryBackend(shm.name)
+            self.assertEqual(backend.load(''), source.load(''))
+            self.assertEqual(backend.load('realm1', key), source.load('realm1', key))
+            with self.assertRaises(PySecretSettingsError):
+                backend.load('nope')
+            backend.close()
+
+            ctx = multiprocessing.get_context('spawn')
+            with ctx.Pool(2) as pool:
+                res = pool.starmap(
+                    load_shared, [(shm.name, 'realm1', key), (shm.name, 'realm2', key)])
+            self.assertEqual(res[0], source.load('realm1', key))
+            self.assertEqual(res[1], source.load('realm2', key))
+
+            # workers must not register the segment with their resource
+            # tracker, which would unlink it when they exit
+            with mock.patch('multiprocessing.resource_tracker.register') as register:
+                SharedMemoryBackend(shm.name).close()
+            register.assert_not_called()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        with self.assertRaises(PySecretSettingsError) as ctx_err:
+            SharedMemoryBackend(shm.name)
+        self.assertEqual(
+            ctx_err.exception.msg, f"Failed to find shared memory '{shm.name}'")
+        return
+
+
+class FileWatcher_test(unittest.TestCase):
+    '''
+    class FileWatcher test cases
+
+    to run all these: `python3 -m unittest backend_test.FileWatcher_test`
+    '''
+    key = '1234567890123456'
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'watched.ini')
+        self.write('alice', 'secret1', 'secret2')
+        self.changes:List[Tuple[str, str, Any, Any]] = []
+        self.changed = threading.Event()
+        return
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+        return
+
+    def write(self, user:str, password1:str, password2:str) -> None:
+        '''
+        Replace the watched file atomically
+        '''
+        key = self.key.encode()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(
+                f'[realm1]\nusername={user}\n'
+                f'encrypted-password1={encrypt_str(password1, key)}\n'
+                f'[realm2]\nencrypted-password2={encrypt_str(password2, key)}\n')
+        os.replace(tmp, self.path)
+        return
+
+    def on_change(self, realm:str, name:str, old:Any, new:Any) -> None:
+        self.changes.append((realm, name, old, new))
+        self.changed.set()
+        return
+
+    def test_check(self) -> None:
+        '''
+        Only the changed keys are reported
+        '''
+        watcher = FileWatcher(IniBackend(self.path), self.key)
+        self.assertEqual(watcher.realms['realm1']['password1'], 'secret1')
+        watcher.subscribe(self.on_change)
+        self.assertFalse(watcher.check())
+
+        self.write('alice', 'secret3', 'secret2')
+        self.assertTrue(watcher.check())
+        self.assertEqual(
+            self.changes, [('realm1', 'password1', 'secret1', 'secret3')])
+        self.assertEqual(watcher.realms['realm1']['password1'], 'secret3')
+        self.assertEqual(watcher.realms['realm2']['password2'], 'secret2')
+
+        # subscription to a particular key
+        self.changes = []
+        watcher.unsubscribe(self.on_change)
+        watcher.subscribe(self.on_change, 'realm1', 'username')
+        self.write('bob', 'secret4', 'secret5')
+        self.assertTrue(watcher.check())
+        self.assertEqual(self.changes, [('realm1', 'username', 'alice', 'bob')])
+        return
+
+    def test_thread(self) -> None:
+        '''
+        Changes are picked up by the watcher thread, with and without inotify
+        '''
+        for use_inotify in (True, False):
+            self.changes = []
+            self.changed.clear()
+            watcher = FileWatcher(
+                IniBackend(self.path), self.key, interval=0.05,
+                use_inotify=use_inotify)
+            watcher.subscribe(self.on_change, 'realm2')
+            with watcher:
+                self.write('carol', 'secret1', f'inotify-{use_inotify}')
+                self.assertTrue(self.changed.wait(5))
+            self.assertEqual(self.changes[0][3], f'inotify-{use_inotify}')
+            self.assertIsNone(watcher.error)
+        return
+
+
+class LayeredBackend_test(unittest.TestCase):
+    '''
+    class LayeredBackend test cases
+
+    to run all these: `python3 -m unittest backend_test.LayeredBackend_test`
+    '''
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        return
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+        return
+
+    def write(self, fname:str, text:str) -> str:
+        path = os.path.join(self.dir.name, fname)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_layers(self) -> None:
+        '''
+        Later layers override earlier ones, changes are picked up
+        '''
+        key = '1234567890123456'
+        secret = encrypt_str('BigB1gSecret', key.encode())
+        base = IniBackend(self.write(
+            'base.ini',
+            '[db]\nhost=localhost\nport=5432\npassword=plain\n[log]\nlevel=info\n'))
+        override = IniBackend(self.write(
+            'override.ini', f'[db]\nhost=db1\nencrypted-password={secret}\n'))
+        backend = LayeredBackend([base, override])
+
+        self.assertEqual(
+            backend.load('db', key),
+            {'host': 'db1', 'port': '5432', 'password': 'BigB1gSecret'})
+        self.assertEqual(backend.load('log'), {'level': 'info'})
+        self.assertIs(backend.source('db', 'host'), override)
+        self.assertIs(backend.source('db', 'port'), base)
+        self.assertIs(backend.source('db', 'password'), override)
+        self.assertFalse(backend.refresh())
+
+        self.write('override.ini', '[db]\nport=6543\n[log]\nlevel=debug\n')
+        self.assertTrue(backend.refresh())
+        self.assertEqual(
+            backend.load('', key),
+            {'db': {'host': 'localhost', 'port': '6543', 'password': 'plain'},
+             'log': {'level': 'debug'}})
+        self.assertIs(backend.source('db', 'host'), base)
+        self.assertIs(backend.source('db', 'port'), override)
+
+        with self.assertRaises(PySecretSettingsError) as ctx:
+            backend.load('nope')
+        self.assertEqual(ctx.exception.msg, "Failed to locate 'nope' in any layer")
+        return
+
+    def test_single_layer(self) -> None:
+        '''
+        A stack of one layer loads the same as the layer: of `XXX` and
+        `encrypted-XXX` in one realm the later one wins
+        '''
+        key = '1234567890123456'
+        secret = encrypt_str('BigB1gSecret', key.encode())
+        layer = IniBackend(self.write(
+            'layer.ini',
+            f'[a]\npassword=plain\nencrypted-password={secret}\n'
+            f'[b]\nencrypted-password={secret}\npassword=plain\n'))
+        backend = LayeredBackend([layer])
+        self.assertEqual(backend.load('', key), layer.load('', key))
+        self.assertEqual(backend.load('a', key), {'password': 'BigB1gSecret'})
+        self.assertEqual(backend.load('b', key), {'password': 'plain'})
+
+        # re-merged key by key
+        self.write(
+            'layer.ini',
+            f'[a]\npassword=plain\nencrypted-password={secret}\nport=1\n'
+            f'[b]\nencrypted-password={secret}\npassword=plain2\n')
+        self.assertTrue(backend.refresh())
+        self.assertEqual(backend.load('', key), layer.load('', key))
+        self.assertEqual(backend.load('b', key), {'password': 'plain2'})
+        return
+
+
+class FileBackendCache_test(unittest.TestCase):
+    '''
+    Parsed document cache test cases
+
+    to run all these: `python3 -m unittest backend_test.FileBackendCache_test`
+    '''
+
+    def setUp(self) -> None:
+        fd, self.path = tempfile.mkstemp(suffix='.ini')
+        os.close(fd)
+        self.write('[realm1]\nusername=alice\n')
+        return
+
+    def tearDown(self) -> None:
+        os.remove(self.path)
+        return
+
+    def write(self, text:str) -> None:
+        with open(self.path, 'w') as f:
+            f.write(text)
+        return
+
+    def test_cache_hit(self) -> None:
+        '''
+        Unchanged file is parsed only once
+        '''
+        backend = IniBackend(self.path)
+        data1 = backend.load('realm1')
+        data2 = backend.load('realm1')
+        backend.load('')
+        self.assertEqual(data1, data2)
+        self.assertEqual(backend.cache_misses, 1)
+        self.assertEqual(backend.cache_hits, 2)
+
+        # callers can not spoil the cached document
+        assert isinstance(data1, dict)
+        data1['username'] = 'mallory'
+        self.assertEqual(backend.load('realm1')['username'], 'alice')
+        return
+
+    def test_cache_miss_on_change(self) -> None:
+        '''
+        Changed file is re-parsed
+        '''
+        backend = IniBackend(self.path)
+        self.assertEqual(backend.load('realm1')['username'], 'alice')
+
+        self.write('[realm1]\nusername=bob\nport=8080\n')
+        self.assertEqual(backend.load('realm1')['username'], 'bob')
+        self.assertEqual(backend.cache_misses, 2)
+        self.assertEqual(backend.cache_hits, 0)
+        return
+
+    def test_cache_disabled(self) -> None:
+        '''
+        With cache=False the file is parsed on every load
+        '''
+        backend = YamlBackend(test_file('test-simple.yaml'), cache=False)
+        backend.load('secrets')
+        backend.load('secrets')
+        self.assertEqual(backend.cache_misses, 0)
+        self.assertEqual(backend.cache_hits, 0)
+        return
+
+class LoadMetrics_test(unittest.TestCase):
+    '''
+    Test the instrumentation hooks
+    '''
+
+    def test_histogram_metrics(self) -> None:
+        '''
+        Every load() is measured, discovery is reported once, decryption only
+        when there is a key
+        '''
+        metrics = HistogramMetrics()
+        backend = IniBackend(test_file('test-secrets.ini'))
+        settings = PySecretSettings(backend, metrics=metrics)
+        key = settings.load('secrets')['key']
+        data = settings.load('realm1', key)
+        self.assertEqual(data['password1'], data['decrypted-password1'])
+        settings.load('')
+        # not through PySecretSettings, not measured
+        backend.load('')
+
+        res = metrics.export()
+        json.dumps(res)
+        self.assertEqual(res['loads'], 3)
+        self.assertGreater(res['values'], 0)
+        # parsed once, then served from the cache
+        self.assertEqual(
+            res['bytes_read'], os.path.getsize(test_file('test-secrets.ini')))
+        hists = res['backends']['IniBackend']
+        self.assertEqual(hists['total']['count'], 3)
+        self.assertEqual(hists['discover']['count'], 1)
+        self.assertEqual(hists['read']['count'], 3)
+        self.assertGreater(hists['parse']['sum'], 0)
+        self.assertGreater(hists['decrypt']['sum'], 0)
+        self.assertEqual(
+            sum(n for _, n in hists['total']['buckets']), 3)
+
+        metrics.reset()
+        self.assertEqual(metrics.export()['loads'], 0)
+
+        # one record for the whole preload
+        settings.preload(['realm1', 'realm2'], key)
+        settings.load('realm1', key)
+        res = metrics.export()
+        self.assertEqual(res['loads'], 1)
+        self.assertEqual(res['values'], len(data) + len(backend.load('realm2', key)))
+        return
+
+    def test_nested_load(self) -> None:
+        '''
+        Load of a layered backend is measured once, not per layer
+        '''
+        metrics = HistogramMetrics()
+        layer = IniBackend(test_file('test-simple.ini'))
+        layer.metrics = metrics
+        PySecretSettings(LayeredBackend([layer]), metrics=metrics).load('')
+        self.assertEqual(list(metrics.export()['backends']), ['LayeredBackend'])
+        return
+
+    def test_load_signature(self) -> None:
+        '''
+        Backends keep their own load() signature
+        '''
+        class VersionedBackend(IniBackend):
+            def load(self, realm:str, key:Optional[str] = None,
+                    version:Optional[int] = None) -> Mapping[str, Any]:
+                return dict(super().load(realm, key), version=version)
+
+        metrics = HistogramMetrics()
+        backend = VersionedBackend(test_file('test-simple.ini'))
+        settings = PySecretSettings(backend, metrics=metrics)
+        self.assertEqual(settings.load('realm1')['version'], None)
+        self.assertEqual(backend.load('realm1', version=2)['version'], 2)
+        self.assertEqual(metrics.export()['loads'], 1)
+        return
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,12 +1,32 @@
+from base64 import b64decode, b64encode
+from contextlib import redirect_stderr
 from copy import copy
 from typing import Any, Dict
+import io
+import os.path
+import shutil
+import stat
+import tempfile
 import unittest
 
 from pysecretsettings import (
+    crypto,
     encrypt_str,
     decrypt_str,
-    decrypt_dict
+    decrypt_dict,
+    decrypt_dicts,
+    CipherContext,
+    DecryptCache,
+    LazyDecryptedDict,
+    IniBackend,
+    YamlBackend,
+    rekey_file,
+    seal_file,
+    seal_realm,
+    unseal_realm,
+    PySecretSettingsError
 )
+from pysecretsettings.__main__ import main
 
 key = b'1234567890123456'
 password = 'BigB1gSecret'
@@ -44,3 +64,270 @@ class crypto_test(unittest.TestCase):
         del expected['encrypted-password']
         self.assertEqual(decrypted, expected)
         return
+
+    def test_decrypt_cache(self) -> None:
+        '''
+        Repeated decryption is served from the cache
+        '''
+        cache = DecryptCache(maxsize=2)
+        input = {'encrypted-password': encrypted_password}
+        for _ in range(3):
+            decrypted = decrypt_dict(input, key, cache)
+            self.assertEqual(decrypted['password'], password)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+        # same ciphertext, different key - not a hit
+        other_key = b'6543210987654321'
+        digest = cache.digest(encrypted_password, other_key)
+        self.assertIsNone(cache.get(digest))
+
+        # eviction
+        cache.put(b'1', 'one')
+        cache.put(b'2', 'two')
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(cache.digest(encrypted_password, key)))
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()['hit_rate'], 0.0)
+        return
+
+    def test_cipher_context(self) -> None:
+        '''
+        Batch encryption/decryption matches the one value at a time functions
+        '''
+        ctx = CipherContext(key.decode())
+        texts = ['', password, 'Thing can get tricky', 'x' * 100]
+        encrypted = [encrypt_str(t, key) for t in texts]
+        self.assertEqual([ctx.encrypt_str(t) for t in texts], encrypted)
+
+        raw = ctx.encrypt_many([t.encode() for t in texts])
+        self.assertEqual([t.decode() for t in ctx.decrypt_many(raw)], texts)
+        self.assertEqual(ctx.decrypt_str(encrypted_password), password)
+
+        input = {f'encrypted-{i}': e for i, e in enumerate(encrypted)}
+        self.assertEqual(
+            decrypt_dict(input, ctx),
+            {str(i): t for i, t in enumerate(texts)})
+
+        with self.assertRaises(PySecretSettingsError) as ctx_err:
+            CipherContext(b'short')
+        self.assertEqual(
+            ctx_err.exception.msg,
+            'Bad decryption key length 5 - should be 16 or 24 or 32')
+        return
+
+    def test_decrypt_parallel(self) -> None:
+        '''
+        Parallel decryption gives the same results as serial one
+        '''
+        ctx = CipherContext(key)
+        texts = [f'secret-{i}'.encode() * (i % 5) for i in range(100)]
+        encrypted = ctx.encrypt_many(texts)
+        for processes in (False, True):
+            self.assertEqual(
+                ctx.decrypt_parallel(encrypted, 4, processes), texts)
+
+        inputs = [
+            {f'encrypted-{i}': encrypt_str(str(i), key) for i in range(r, 50)}
+            for r in range(3)
+        ]
+        expected = [decrypt_dict(input, key) for input in inputs]
+        threshold = crypto.parallel_threshold
+        crypto.parallel_threshold = 10
+        try:
+            self.assertEqual(decrypt_dicts(inputs, key, workers=3), expected)
+        finally:
+            crypto.parallel_threshold = threshold
+        return
+
+    def test_seal_realm(self) -> None:
+        '''
+        Realm sealed as one blob is decrypted transparently along with the
+        encrypted- values, tampering is detected
+        '''
+        realm = {'username': 'alice', 'port': 8080, 'password': password}
+        blob = seal_realm(realm, key, 'realm1')
+        self.assertNotEqual(seal_realm(realm, key, 'realm1'), blob)
+        self.assertEqual(unseal_realm(blob, key, 'realm1'), realm)
+
+        cache = DecryptCache()
+        data = {'sealed-realm': blob, 'encrypted-other': encrypted_password}
+        for _ in range(2):
+            self.assertEqual(
+                decrypt_dict(data, key, cache, realm='realm1'),
+                dict(realm, other=password))
+        self.assertEqual(cache.hits, 2)
+        lazy = LazyDecryptedDict(data, key, realm='realm1')
+        self.assertEqual(dict(lazy), dict(realm, other=password))
+
+        with self.assertRaises(PySecretSettingsError):
+            unseal_realm(blob, b'6543210987654321', 'realm1')
+        raw = bytearray(b64decode(blob))
+        raw[-1] ^= 1
+        with self.assertRaises(PySecretSettingsError):
+            unseal_realm(b64encode(raw).decode(), key, 'realm1')
+        with self.assertRaises(PySecretSettingsError):
+            decrypt_dict(data, key)
+        return
+
+    def test_sealed_realm_swap(self) -> None:
+        '''
+        A blob moved to another realm is rejected, cached or not
+        '''
+        blob1 = seal_realm({'role': 'admin'}, key, 'admin')
+        blob2 = seal_realm({'role': 'guest'}, key, 'guest')
+        cache = DecryptCache()
+        self.assertEqual(
+            decrypt_dicts(
+                [{'sealed-realm': blob1}, {'sealed-realm': blob2}], key,
+                cache, realms=['admin', 'guest']),
+            [{'role': 'admin'}, {'role': 'guest'}])
+        for c in (None, cache):
+            with self.assertRaises(PySecretSettingsError):
+                decrypt_dict({'sealed-realm': blob1}, key, c, realm='guest')
+            with self.assertRaises(PySecretSettingsError):
+                LazyDecryptedDict({'sealed-realm': blob1}, key, c, 'guest')
+
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'sealed.yaml')
+            with open(path, 'w') as f:
+                f.write(f'admin:\n  sealed-realm: {blob2}\n'
+                    f'guest:\n  sealed-realm: {blob1}\n')
+            backend = YamlBackend(path)
+            for realm in ('admin', 'guest', ''):
+                with self.assertRaises(PySecretSettingsError):
+                    backend.load(realm, key.decode())
+        return
+
+def test_file(fname:str) -> str:
+    '''
+    Given a short file name return a fq path
+    '''
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(dirname, fname)
+
+class rekey_test(unittest.TestCase):
+    '''
+    Re-keying of the settings files
+    '''
+    new_key = 'abcdefghijklmnopqrstuvwxyz012345'
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        return
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+        return
+
+    def copy(self, fname:str) -> str:
+        path = os.path.join(self.dir.name, fname)
+        shutil.copy(test_file(fname), path)
+        os.chmod(path, 0o600)
+        return path
+
+    def test_rekey(self) -> None:
+        '''
+        Values decrypt with the new key to the same plaintexts, the rest of the
+        file is unchanged
+        '''
+        for fname, cls, count in (
+                ('test-secrets.ini', IniBackend, 3),
+                ('test-simple.yaml', YamlBackend, 2)):
+            path = self.copy(fname)
+            expected = cls(path).load('realm1', key.decode())
+            with open(path) as f:
+                old_lines = f.read().splitlines()
+
+            self.assertEqual(rekey_file(path, key, self.new_key), count)
+            self.assertEqual(cls(path).load('realm1', self.new_key), expected)
+            self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+            with open(path) as f:
+                new_lines = f.read().splitlines()
+            changed = [
+                old for old, new in zip(old_lines, new_lines) if old != new]
+            self.assertEqual(len(old_lines), len(new_lines))
+            self.assertEqual(len(changed), count)
+            self.assertTrue(all('encrypted-' in line for line in changed))
+        return
+
+    def test_rekey_errors(self) -> None:
+        '''
+        Wrong old key and values which can not be rewritten in place
+        '''
+        path = self.copy('test-secrets.ini')
+        with open(path) as f:
+            text = f.read()
+        with self.assertRaises(PySecretSettingsError):
+            rekey_file(path, self.new_key, key)
+        with open(path) as f:
+            self.assertEqual(f.read(), text)
+
+        path = os.path.join(self.dir.name, 'flow.yaml')
+        with open(path, 'w') as f:
+            f.write(f'realm1: {{encrypted-password: {encrypted_password}}}\n')
+        with self.assertRaises(PySecretSettingsError) as ctx:
+            rekey_file(path, key, self.new_key)
+        self.assertIn('1 encrypted values but 0', ctx.exception.msg)
+        return
+
+    def test_rekey_defaults(self) -> None:
+        '''
+        A value of the INI DEFAULT section is counted and re-keyed once
+        '''
+        path = os.path.join(self.dir.name, 'defaults.ini')
+        with open(path, 'w') as f:
+            f.write(
+                f'[DEFAULT]\nencrypted-password = {encrypted_password}\n\n'
+                '[realm1]\nusername = alice\n\n[realm2]\nusername = bob\n')
+        self.assertEqual(rekey_file(path, key, self.new_key), 1)
+        for realm in ('realm1', 'realm2'):
+            self.assertEqual(
+                IniBackend(path).load(realm, self.new_key)['password'],
+                password)
+        return
+
+    def test_seal_file(self) -> None:
+        '''
+        Sealed file loads the same, can be re-keyed
+        '''
+        for fname, cls in (
+                ('test-secrets.ini', IniBackend),
+                ('test-simple.yaml', YamlBackend)):
+            path = self.copy(fname)
+            expected = cls(path).load('', key.decode())
+            sealed = path + '.sealed'
+            self.assertEqual(seal_file(path, key, sealed), 3)
+
+            backend = cls(sealed)
+            self.assertEqual(
+                list(backend.load('realm1')), ['sealed-realm'])
+            self.assertEqual(backend.load('', key.decode()), expected)
+
+            self.assertEqual(rekey_file(sealed, key, self.new_key), 3)
+            self.assertEqual(cls(sealed).load('', self.new_key), expected)
+        return
+
+    def test_cli(self) -> None:
+        '''
+        python -m pysecretsettings rekey, keys from the files
+        '''
+        path = self.copy('test-secrets.ini')
+        out = os.path.join(self.dir.name, 'out.ini')
+        old_key_file = os.path.join(self.dir.name, 'old')
+        new_key_file = os.path.join(self.dir.name, 'new')
+        with open(old_key_file, 'w') as f:
+            f.write(key.decode() + '\n')
+        with open(new_key_file, 'w') as f:
+            f.write(self.new_key + '\n')
+        with redirect_stderr(io.StringIO()) as err:
+            res = main([
+                'rekey', path, '-o', out,
+                '--old-key-file', old_key_file, '--new-key-file', new_key_file])
+        self.assertEqual(res, 0)
+        self.assertEqual(err.getvalue(), '3 values re-encrypted\n')
+        self.assertEqual(
+            IniBackend(out).load('realm2', self.new_key)['password'], 'alice')
+        return
@@ -1,11 +1,32 @@
 #
 #
 #
+import asyncio
 import os.path
-#from typing import List
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, List, Mapping, Optional
 import unittest
+from unittest import mock
 
-from pysecretsettings import PySecretSettings, PySecretSettingsError
+from pysecretsettings import (
+    AsyncPySecretSettings,
+    ConcurrentPySecretSettings,
+    PySecretSettingsBackend,
+    IniBackend,
+    YamlBackend,
+    LayeredBackend,
+    SnapshotBackend,
+    compile_snapshot,
+    CompactDict,
+    DecryptCache,
+    PySecretSettings,
+    PySecretSettingsError
+)
 
 
 def test_file(fname:str) -> str:
@@ -105,3 +126,347 @@ class PySecretSettings_test(unittest.TestCase):
         self.assertEqual(
             settings['decrypted-password2'], settings['password2'])
         return
+
+    def test_lazy_decrypt(self) -> None:
+        '''
+        Values are decrypted on the first access
+        '''
+        fname = test_file('test-secrets.ini')
+        settings = PySecretSettings(fname, lazy_decrypt=True)
+        settings.load('secrets')
+        key = settings['key']
+
+        data = settings.load('realm1', key)
+        self.assertNotIsInstance(data, dict)
+        self.assertIn('password1', data)
+        self.assertNotIn('encrypted-password1', data)
+        self.assertEqual(
+            settings['decrypted-password1'], settings['password1'])
+        self.assertEqual(
+            settings['decrypted-password2'], settings['password2'])
+
+        # wrong key is only detected on access
+        data = settings.load('realm1', '6543210987654321')
+        self.assertEqual(data['username'], 'alice')
+        with self.assertRaises(PySecretSettingsError):
+            data['password1']
+        return
+
+    def test_decrypt_cache(self) -> None:
+        '''
+        Decrypted values are cached only if asked for
+        '''
+        fname = test_file('test-secrets.ini')
+        settings = PySecretSettings(fname)
+        self.assertIsNone(settings.backend.decrypt_cache)
+
+        cache = DecryptCache()
+        settings = PySecretSettings(fname, decrypt_cache=cache)
+        key = settings.load('secrets')['key']
+        for _ in range(2):
+            self.assertEqual(settings.load('realm1', key)['password1'], 'BigB1gSecret')
+        self.assertEqual((cache.misses, cache.hits), (2, 2))
+        return
+
+    def test_compact(self) -> None:
+        '''
+        Compact secrets are equal to the plain ones, keys are shared
+        '''
+        for fname in ('test-secrets.ini', 'test-simple.yaml', 'test-flow.yaml'):
+            plain = PySecretSettings(test_file(fname))
+            settings = PySecretSettings(test_file(fname), compact=True)
+            expected = plain.load('')
+            data = settings.load('')
+            assert isinstance(data, CompactDict)
+            self.assertEqual(data, expected)
+            self.assertEqual(list(data), list(expected))
+            self.assertEqual(data.to_dict(), expected)
+            self.assertNotIn('absent', data)
+            with self.assertRaises(KeyError):
+                data['absent']
+
+        settings = PySecretSettings(test_file('test-secrets.ini'), compact=True)
+        key = settings.load('secrets')['key']
+        data = settings.load('', key)
+        self.assertEqual(data['realm1']['password1'], 'BigB1gSecret')
+        self.assertEqual(
+            list(data['realm2'].items())[0], ('username', 'bob'))
+        settings.load('realm2', key)
+        self.assertEqual(settings['password'], 'alice')
+        self.assertIsNone(settings.get('password1'))
+
+        with self.assertRaises(PySecretSettingsError):
+            PySecretSettings(
+                test_file('test-secrets.ini'), compact=True, lazy_decrypt=True)
+        return
+
+    def test_format_sniffing(self) -> None:
+        '''
+        The backend of a file without extension is detected by its contents,
+        once located a short file name costs one stat
+        '''
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as dir:
+            shutil.copy(test_file('test-secrets.ini'), f'{dir}/ini')
+            shutil.copy(test_file('test-simple.yaml'), f'{dir}/yaml')
+            compile_snapshot(test_file('test-simple.ini'), f'{dir}/pss')
+            os.chdir(dir)
+            try:
+                for fname, cls in (
+                        ('ini', IniBackend),
+                        ('yaml', YamlBackend),
+                        ('pss', SnapshotBackend)):
+                    settings = PySecretSettings(fname)
+                    self.assertIs(type(settings.backend), cls)
+                    self.assertTrue(settings.load(''))
+
+                with mock.patch('os.stat', wraps=os.stat) as stat:
+                    settings = PySecretSettings('ini')
+                self.assertEqual(stat.call_count, 1)
+                self.assertEqual(settings.load('realm1')['username'], 'alice')
+
+                # neither a section header nor an assignment: YAML, as when
+                # the backend was picked by trying YamlBackend first
+                for text in ('# comment\n\nrealm1:\n  username: alice\n', ''):
+                    with open('plain', 'w') as f:
+                        f.write(text)
+                    self.assertIs(type(PySecretSettings('plain').backend),
+                        YamlBackend)
+            finally:
+                os.chdir(cwd)
+        return
+
+    def test_preload(self) -> None:
+        '''
+        Preloaded realms are served without the backend until the file
+        changes, in the background too
+        '''
+        key = '1234567890123456'
+        with tempfile.TemporaryDirectory() as dir:
+            path = shutil.copy(test_file('test-secrets.ini'), dir)
+            expected = PySecretSettings(path).load('', key)
+            for background in (False, True):
+                settings = PySecretSettings(path)
+                with mock.patch.object(
+                        settings.backend, 'load',
+                        wraps=settings.backend.load) as load:
+                    settings.preload(['realm1', 'realm2'], key, background)
+                    self.assertEqual(settings.load('realm1', key), expected['realm1'])
+                    data = settings.load('realm2', key)
+                    self.assertEqual(data, expected['realm2'])
+                    assert isinstance(data, dict)
+                    data['username'] = 'mallory'
+                    self.assertEqual(settings['username'], 'mallory')
+                    self.assertEqual(settings.load('realm2', key)['username'], 'bob')
+                    self.assertEqual(load.call_count, 0)
+
+                    # not preloaded, other key
+                    self.assertEqual(settings.load('secrets')['key'], key)
+                    self.assertEqual(
+                        settings.load('realm1')['encrypted-password1'],
+                        'dOcV7/WfKO9RaK0Y6BbeQg==')
+                    self.assertEqual(load.call_count, 2)
+
+            settings = PySecretSettings(path, compact=True)
+            settings.preload(['realm1'], key)
+            self.assertIsInstance(settings.load('realm1', key), CompactDict)
+
+            settings.preload(['nonexistent'], key, background=True)
+            settings.wait_preload()
+            self.assertIsInstance(settings.preload_error, PySecretSettingsError)
+            with self.assertRaises(PySecretSettingsError):
+                settings.preload(['nonexistent'], key)
+
+            settings = PySecretSettings(path)
+            settings.preload(['realm2'], key)
+            with open(path) as f:
+                text = f.read()
+            with open(path, 'w') as f:
+                f.write(text.replace('username = bob', 'username = carol'))
+            self.assertEqual(settings.load('realm2', key)['username'], 'carol')
+
+            # a change of a layer is seen
+            override = os.path.join(dir, 'override.yaml')
+            with open(override, 'w') as f:
+                f.write('realm2:\n  username: dave\n')
+            settings = PySecretSettings(
+                LayeredBackend([IniBackend(path), YamlBackend(override)]))
+            settings.preload(['realm2'], key)
+            self.assertEqual(settings.load('realm2', key)['username'], 'dave')
+            with open(override, 'w') as f:
+                f.write('realm2:\n  username: eve\n')
+            self.assertEqual(settings.load('realm2', key)['username'], 'eve')
+
+        # a backend without a fingerprint is only warmed up
+        settings = PySecretSettings(CountingBackend())
+        settings.preload(['realm1'])
+        self.assertEqual(settings.load('realm1')['user'], 'user2')
+        self.assertEqual(settings.load('realm1')['user'], 'user3')
+        return
+
+
+class SlowIniBackend(IniBackend):
+    '''
+    IniBackend counting the loads and taking its time
+    '''
+    loads = 0
+
+    def load(self, realm:str, key:Optional[str] = None) -> Mapping[str, Any]:
+        self.loads += 1
+        time.sleep(0.05)
+        return super().load(realm, key)
+
+class AsyncPySecretSettings_test(unittest.IsolatedAsyncioTestCase):
+
+    async def test_load(self) -> None:
+        '''
+        Concurrent loads of the same realm are coalesced
+        '''
+        backend = SlowIniBackend(test_file('test-secrets.ini'))
+        settings = AsyncPySecretSettings(backend)
+        with self.assertRaises(PySecretSettingsError):
+            settings['key']
+
+        await settings.load('secrets')
+        key = settings['key']
+        self.assertEqual(backend.loads, 1)
+
+        results = await asyncio.gather(
+            *[settings.load('realm1', key) for _ in range(5)])
+        self.assertEqual(backend.loads, 2)
+        for res in results:
+            self.assertEqual(res['password1'], res['decrypted-password1'])
+        self.assertEqual(settings['password2'], settings['decrypted-password2'])
+
+        # not coalesced once completed
+        await settings.load('realm1', key)
+        self.assertEqual(backend.loads, 3)
+        return
+
+class CountingBackend(PySecretSettingsBackend):
+    '''
+    Every load returns the next generation of related values
+    '''
+    loads = 0
+
+    def load(self, realm:str, key:Optional[str] = None) -> Mapping[str, Any]:
+        self.loads += 1
+        return {'user': f'user{self.loads}', 'password': f'password{self.loads}'}
+
+class ConcurrentPySecretSettings_test(unittest.TestCase):
+
+    def test_reload(self) -> None:
+        '''
+        Readers see consistent snapshots and growing generations while the
+        secrets are reloaded
+        '''
+        settings = ConcurrentPySecretSettings(CountingBackend())
+        self.assertEqual(settings.generation, 0)
+        with self.assertRaises(PySecretSettingsError):
+            settings['user']
+        settings.load('realm1')
+        self.assertEqual(settings.generation, 1)
+        self.assertEqual(settings['user'], 'user1')
+        with self.assertRaises(TypeError):
+            settings.secrets['user'] = 'mallory'  # type: ignore
+
+        errors:List[str] = []
+        done = threading.Event()
+
+        def read() -> None:
+            generation = 0
+            while not done.is_set():
+                snap = settings.snapshot()
+                if snap.generation < generation:
+                    errors.append(f'generation {snap.generation} < {generation}')
+                generation = snap.generation
+                n = snap['user'][len('user'):]
+                if snap['password'] != f'password{n}' or int(n) != generation:
+                    errors.append(f'inconsistent {dict(snap.secrets)}')
+            return
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for t in readers:
+            t.start()
+        loaders = [
+            threading.Thread(
+                target=lambda: [settings.load('realm1') for _ in range(100)])
+            for _ in range(2)
+        ]
+        for t in loaders:
+            t.start()
+        for t in loaders:
+            t.join()
+        done.set()
+        for t in readers:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(settings.generation, 201)
+        self.assertEqual(settings.snapshot().realm, 'realm1')
+        return
+
+class Import_test(unittest.TestCase):
+    '''
+    Third-party modules are imported only when needed
+    '''
+    probe = '''
+import sys
+before = set(sys.modules)
+{}
+print('\\n'.join(sorted(set(sys.modules) - before)))
+'''
+
+    def imported(self, statement:str) -> List[str]:
+        '''
+        Top level names of the modules the statement imports
+        '''
+        proc = subprocess.run(
+            [sys.executable, '-c', self.probe.format(statement)],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return sorted({m.split('.')[0] for m in proc.stdout.split()})
+
+    def test_lazy_imports(self) -> None:
+        '''
+        import pysecretsettings loads nothing outside stdlib, plaintext INI
+        loads neither pycryptodome nor yaml
+        '''
+        stdlib = getattr(sys, 'stdlib_module_names', None)
+        modules = self.imported('import pysecretsettings')
+        if stdlib is not None:
+            self.assertEqual(
+                [m for m in modules
+                    if m not in stdlib and m != 'pysecretsettings'], [])
+        self.assertNotIn('Crypto', modules)
+        self.assertNotIn('yaml', modules)
+
+        modules = self.imported(
+            'from pysecretsettings import PySecretSettings\n'
+            f"PySecretSettings({test_file('test-secrets.ini')!r}).load('realm1')")
+        self.assertNotIn('Crypto', modules)
+        self.assertNotIn('yaml', modules)
+
+        modules = self.imported(
+            'from pysecretsettings import PySecretSettings\n'
+            f"PySecretSettings({test_file('test-secrets.ini')!r})"
+            ".load('realm1', '1234567890123456')")
+        self.assertIn('Crypto', modules)
+        self.assertNotIn('yaml', modules)
+        return
+
+    def test_names_after_use(self) -> None:
+        '''
+        Public names are not shadowed by the submodules once those are
+        imported
+        '''
+        modules = self.imported(
+            'from pysecretsettings import PySecretSettings\n'
+            f"PySecretSettings({test_file('test-secrets.ini')!r}, compact=True)"
+            ".load('realm1')\n"
+            'import pysecretsettings\n'
+            'from pysecretsettings import compact_settings, CompactDict\n'
+            "assert isinstance(compact_settings({'a': 'b'}), CompactDict)\n"
+            'assert all(not isinstance(getattr(pysecretsettings, n), type(sys))'
+            ' for n in pysecretsettings.__all__)')
+        self.assertIn('pysecretsettings', modules)
+        return